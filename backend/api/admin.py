@@ -1,6 +1,13 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
-from .models import User, EncryptionSettings, Category, Product, Variant, AddOn, Inventory, Transaction
+from .authentication import user_cache
+from django.db import transaction
+from .models import (
+    User, EncryptionSettings, Location, Terminal, Category, Product, Variant, AddOn, Inventory, InventoryMovement,
+    Transaction, Refund, Task
+)
+from .response_cache import invalidate_on_commit
+from .stock import set_inventory_quantity
 
 # Register your models here.
 
@@ -37,14 +44,14 @@ class EncryptionSettingsAdmin(admin.ModelAdmin):
 class UserAdmin(BaseUserAdmin):
     """Admin interface for custom User model"""
     
-    list_display = ['username', 'email', 'role', 'is_verified', 'is_active', 'date_joined']
-    list_filter = ['role', 'is_verified', 'is_active', 'is_staff']
+    list_display = ['username', 'email', 'role', 'location', 'is_verified', 'is_active', 'date_joined']
+    list_filter = ['role', 'location', 'is_verified', 'is_active', 'is_staff']
     search_fields = ['username', 'email', 'first_name', 'last_name']
     ordering = ['-date_joined']
     
     fieldsets = BaseUserAdmin.fieldsets + (
         ('Role & Verification', {
-            'fields': ('role', 'is_verified')
+            'fields': ('role', 'is_verified', 'location')
         }),
         ('Additional Info', {
             'fields': ('phone_number', 'address')
@@ -53,7 +60,7 @@ class UserAdmin(BaseUserAdmin):
     
     add_fieldsets = BaseUserAdmin.add_fieldsets + (
         ('Role & Verification', {
-            'fields': ('role', 'is_verified')
+            'fields': ('role', 'is_verified', 'location')
         }),
     )
     
@@ -62,16 +69,56 @@ class UserAdmin(BaseUserAdmin):
     def verify_users(self, request, queryset):
         """Action to verify selected users"""
         updated = queryset.update(is_verified=True)
+        # update() bypasses post_save, so drop the cached users explicitly
+        user_cache.invalidate(*queryset.values_list('pk', flat=True))
         self.message_user(request, f'{updated} user(s) verified successfully.')
     verify_users.short_description = 'Verify selected users'
     
     def unverify_users(self, request, queryset):
         """Action to unverify selected users"""
         updated = queryset.update(is_verified=False)
+        user_cache.invalidate(*queryset.values_list('pk', flat=True))
         self.message_user(request, f'{updated} user(s) unverified.')
     unverify_users.short_description = 'Unverify selected users'
 
 
+class TerminalInline(admin.TabularInline):
+    """Inline admin for Location Terminals"""
+    model = Terminal
+    extra = 1
+    fields = ['code', 'name', 'is_active']
+
+
+@admin.register(Location)
+class LocationAdmin(admin.ModelAdmin):
+    """Admin interface for Location"""
+    
+    list_display = ['name', 'code', 'kind', 'is_active', 'created_at']
+    list_filter = ['kind', 'is_active']
+    search_fields = ['name', 'code']
+    ordering = ['name']
+    inlines = [TerminalInline]
+    
+    fieldsets = (
+        ('Basic Information', {
+            'fields': ('name', 'code', 'kind', 'address')
+        }),
+        ('Status', {
+            'fields': ('is_active',)
+        }),
+    )
+
+
+@admin.register(Terminal)
+class TerminalAdmin(admin.ModelAdmin):
+    """Admin interface for Terminal"""
+    
+    list_display = ['name', 'code', 'location', 'is_active']
+    list_filter = ['location', 'is_active']
+    search_fields = ['name', 'code']
+    ordering = ['location', 'name']
+
+
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
     """Admin interface for Category"""
@@ -98,11 +145,20 @@ class VariantInline(admin.TabularInline):
     fields = ['name', 'price_adjustment', 'sku_suffix', 'is_active']
 
 
-class InventoryInline(admin.TabularInline):
+class DefaultLocationMixin:
+    """Preselect the default location on Inventory forms (the model has no default)"""
+    
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if db_field.name == 'location':
+            kwargs.setdefault('initial', Location.get_default().pk)
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
+
+
+class InventoryInline(DefaultLocationMixin, admin.TabularInline):
     """Inline admin for Product Inventory"""
     model = Inventory
     extra = 1
-    fields = ['variant', 'quantity', 'low_stock_threshold', 'last_restocked']
+    fields = ['location', 'variant', 'quantity', 'low_stock_threshold', 'last_restocked']
 
 
 @admin.register(Product)
@@ -188,17 +244,18 @@ class AddOnAdmin(admin.ModelAdmin):
 
 
 @admin.register(Inventory)
-class InventoryAdmin(admin.ModelAdmin):
+class InventoryAdmin(DefaultLocationMixin, admin.ModelAdmin):
     """Admin interface for Inventory"""
     
-    list_display = ['product', 'variant', 'quantity', 'low_stock_threshold', 'stock_status', 'last_restocked']
-    list_filter = ['product__category', 'last_restocked']
+    list_display = ['product', 'variant', 'location', 'quantity', 'low_stock_threshold', 'stock_status', 'last_restocked']
+    list_filter = ['location', 'product__category', 'last_restocked']
+    list_select_related = ['product', 'variant', 'location']
     search_fields = ['product__name', 'variant__name']
-    ordering = ['product', 'variant']
+    ordering = ['product', 'variant', 'location']
     
     fieldsets = (
         ('Product', {
-            'fields': ('product', 'variant')
+            'fields': ('location', 'product', 'variant')
         }),
         ('Stock Information', {
             'fields': ('quantity', 'low_stock_threshold', 'last_restocked')
@@ -219,24 +276,63 @@ class InventoryAdmin(admin.ModelAdmin):
     def restock_items(self, request, queryset):
         """Action to mark items as restocked"""
         from django.utils import timezone
+        product_ids = set(queryset.values_list('product_id', flat=True))
         updated = queryset.update(last_restocked=timezone.now())
+        invalidate_on_commit('inventory', *(f'product:{product_id}' for product_id in product_ids))
         self.message_user(request, f'{updated} inventory item(s) marked as restocked.')
     restock_items.short_description = 'Mark as restocked'
+    
+    def save_model(self, request, obj, form, change):
+        """Record quantity changes in the inventory ledger instead of overwriting the stock"""
+        if change and 'quantity' not in form.changed_data:
+            super().save_model(request, obj, form, change)
+            return
+        quantity = obj.quantity
+        with transaction.atomic():
+            # save() writes every column: keep the stored stock, the ledger changes it
+            obj.quantity = (
+                Inventory.objects.select_for_update().values_list('quantity', flat=True).get(pk=obj.pk)
+                if change else 0
+            )
+            super().save_model(request, obj, form, change)
+            obj.quantity = set_inventory_quantity(
+                obj, quantity, reference='' if change else 'opening stock', user=request.user
+            )
+
+
+@admin.register(InventoryMovement)
+class InventoryMovementAdmin(admin.ModelAdmin):
+    """Read-only view of the inventory ledger"""
+    
+    list_display = ['created_at', 'inventory', 'kind', 'quantity', 'reference', 'user', 'checkpoint']
+    list_filter = ['kind', 'inventory__location', 'created_at']
+    search_fields = ['reference', 'inventory__product__name']
+    list_select_related = ['inventory__product', 'inventory__variant', 'user']
+    ordering = ['-created_at', '-id']
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def has_delete_permission(self, request, obj=None):
+        return False
 
 
 @admin.register(Transaction)
 class TransactionAdmin(admin.ModelAdmin):
     """Admin interface for Transaction"""
     
-    list_display = ['transaction_number', 'cashier', 'total', 'amount_paid', 'change_given', 'status', 'created_at']
-    list_filter = ['status', 'payment_method', 'created_at']
+    list_display = ['transaction_number', 'cashier', 'location', 'total', 'amount_paid', 'change_given', 'status', 'created_at']
+    list_filter = ['status', 'payment_method', 'location', 'created_at']
     search_fields = ['transaction_number', 'cashier__username', 'notes']
     ordering = ['-created_at']
     readonly_fields = ['transaction_number', 'change_given', 'created_at', 'updated_at']
     
     fieldsets = (
         ('Transaction Info', {
-            'fields': ('transaction_number', 'cashier', 'status', 'payment_method')
+            'fields': ('transaction_number', 'cashier', 'location', 'terminal', 'status', 'payment_method')
         }),
         ('Cart Items', {
             'fields': ('cart_items',),
@@ -256,3 +352,44 @@ class TransactionAdmin(admin.ModelAdmin):
     def has_add_permission(self, request):
         # Transactions should only be created through the API
         return False
+
+
+@admin.register(Refund)
+class RefundAdmin(admin.ModelAdmin):
+    """Admin interface for Refund"""
+    
+    list_display = ['refund_number', 'transaction', 'kind', 'amount', 'processed_by', 'created_at']
+    list_filter = ['kind', 'created_at']
+    search_fields = ['refund_number', 'transaction__transaction_number', 'reason']
+    ordering = ['-created_at']
+    readonly_fields = ['refund_number', 'transaction', 'kind', 'processed_by', 'items', 'exchange_items', 'amount', 'created_at']
+    
+    def has_add_permission(self, request):
+        # Refunds are recorded through the API so stock stays consistent
+        return False
+
+
+@admin.register(Task)
+class TaskAdmin(admin.ModelAdmin):
+    """Background tasks queued by the API and run by run_tasks workers (api.tasks)"""
+    
+    list_display = ['id', 'name', 'status', 'attempts', 'max_attempts', 'run_at', 'started_at', 'duration', 'created_at']
+    list_filter = ['status', 'name', 'created_at']
+    search_fields = ['name', 'last_error']
+    ordering = ['-created_at', '-id']
+    readonly_fields = [
+        'name', 'args', 'kwargs', 'status', 'attempts', 'max_attempts', 'run_at', 'locked_by',
+        'last_error', 'created_at', 'started_at', 'finished_at', 'duration',
+    ]
+    actions = ['retry_tasks']
+    
+    def retry_tasks(self, request, queryset):
+        """Action to run failed tasks again, with a fresh set of attempts"""
+        from django.utils import timezone
+        updated = queryset.filter(status='FAILED').update(status='PENDING', attempts=0, run_at=timezone.now())
+        self.message_user(request, f'{updated} failed task(s) queued again.')
+    retry_tasks.short_description = 'Retry selected failed tasks'
+    
+    def has_add_permission(self, request):
+        # Tasks are queued by the code that owns them (api.tasks.enqueue)
+        return False
@@ -0,0 +1,62 @@
+"""
+Stock alerts, raised by background tasks instead of at checkout (api.tasks)
+
+Sales enqueue ``alerts.low_stock`` with the quantities they took. The task
+logs a warning for every inventory record the sale brought to or below its
+low-stock threshold, once per crossing rather than on every later sale.
+Notifications (email, push) belong here as well.
+"""
+import logging
+
+from django.db.models import Q
+
+from . import ledger
+from .models import Inventory
+from .stock import _match
+from .tasks import task
+
+logger = logging.getLogger(__name__)
+
+
+def queue_low_stock_alert(deltas, location_id):
+    """Enqueue the low-stock check of a sale's ``deltas`` ({(product_id, variant_id): change})"""
+    sold = [
+        [product_id, variant_id, -delta]
+        for (product_id, variant_id), delta in deltas.items()
+        if delta < 0
+    ]
+    if sold:
+        low_stock.enqueue(location_id, sold)
+
+
+@task('alerts.low_stock')
+def low_stock(location_id, sold):
+    """Warn about records that ``sold`` ([[product_id, variant_id, quantity]]) took to their threshold"""
+    condition = Q()
+    for product_id, variant_id, _ in sold:
+        condition |= _match(product_id, variant_id)
+    inventories = list(
+        Inventory.objects.filter(condition, location_id=location_id)
+        .select_related('product', 'variant', 'location')
+    )
+    # Sales not yet compacted into Inventory.quantity (deferred ledger)
+    pending = ledger.pending_by_inventory([inventory.id for inventory in inventories])
+    quantities = {(product_id, variant_id): quantity for product_id, variant_id, quantity in sold}
+
+    for inventory in inventories:
+        stock = inventory.quantity + pending.get(inventory.id, 0)
+        before = stock + quantities.get((inventory.product_id, inventory.variant_id), 0)
+        if stock <= inventory.low_stock_threshold < before:
+            variant = f' - {inventory.variant.name}' if inventory.variant else ''
+            logger.warning(
+                'Low stock at %s: %s%s, %d left',
+                inventory.location.code, inventory.product.name, variant, stock,
+                extra={
+                    'inventory_id': inventory.id,
+                    'product_id': inventory.product_id,
+                    'variant_id': inventory.variant_id,
+                    'location': inventory.location.code,
+                    'quantity': stock,
+                    'threshold': inventory.low_stock_threshold,
+                },
+            )
@@ -3,3 +3,86 @@ from django.apps import AppConfig
 
 class ApiConfig(AppConfig):
     name = 'api'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from django.db.models.signals import m2m_changed, post_delete, post_migrate, post_save, pre_save
+        from .authentication import invalidate_cached_user
+        from .catalog_cache import collect_metrics, invalidate_addon_applicability, invalidate_catalog_record
+        from .metrics import install_query_hook, registry
+        from .query_inspector import get_config, install_query_inspector
+        from . import images, media, partitions, replicas, response_cache, tasks
+
+        # Count and time SQL queries of every connection for the request metrics
+        connection_created.connect(install_query_hook, dispatch_uid='api.metrics.install_query_hook')
+
+        # Pin requests that wrote to the primary database (api.replicas)
+        if replicas.get_config()['ALIASES']:
+            connection_created.connect(replicas.install_write_hook, dispatch_uid='api.replicas.install_write_hook')
+
+        # Keep the authenticated-user cache in step with role/verification edits
+        user_model = self.get_model('User')
+        post_save.connect(invalidate_cached_user, sender=user_model, dispatch_uid='api.authentication.post_save')
+        post_delete.connect(invalidate_cached_user, sender=user_model, dispatch_uid='api.authentication.post_delete')
+
+        # Evict catalog cache records (used for pricing) after catalog edits
+        for name in ('Product', 'Variant', 'AddOn'):
+            model = self.get_model(name)
+            post_save.connect(invalidate_catalog_record, sender=model, dispatch_uid=f'api.catalog_cache.post_save.{name}')
+            post_delete.connect(invalidate_catalog_record, sender=model, dispatch_uid=f'api.catalog_cache.post_delete.{name}')
+        m2m_changed.connect(
+            invalidate_addon_applicability,
+            sender=self.get_model('AddOn').applicable_products.through,
+            dispatch_uid='api.catalog_cache.m2m_changed',
+        )
+        registry.register_collector(collect_metrics)
+
+        # Render resized derivatives when product/category images change (api.images)
+        if images.get_config()['ENABLED']:
+            for name in ('Product', 'Category'):
+                model = self.get_model(name)
+                post_save.connect(images.schedule_image_derivatives, sender=model,
+                                  dispatch_uid=f'api.images.post_save.{name}')
+                post_delete.connect(images.delete_image_derivatives, sender=model,
+                                    dispatch_uid=f'api.images.post_delete.{name}')
+
+        # Delete files of replaced/deleted images once nothing references them (api.media)
+        if media.get_config()['GC']:
+            for name in ('Product', 'Category'):
+                model = self.get_model(name)
+                pre_save.connect(media.remember_previous_image, sender=model,
+                                 dispatch_uid=f'api.media.pre_save.{name}')
+                post_save.connect(media.collect_replaced_image, sender=model,
+                                  dispatch_uid=f'api.media.post_save.{name}')
+                post_delete.connect(media.collect_deleted_image, sender=model,
+                                    dispatch_uid=f'api.media.post_delete.{name}')
+
+        # Drop cached catalog responses whose entities changed (api.response_cache)
+        if response_cache.get_config()['ENABLED']:
+            for name in ('Category', 'Product', 'Variant', 'AddOn', 'Inventory', 'EncryptionSettings'):
+                model = self.get_model(name)
+                post_save.connect(response_cache.invalidate_cached_responses, sender=model,
+                                  dispatch_uid=f'api.response_cache.post_save.{name}')
+                post_delete.connect(response_cache.invalidate_cached_responses, sender=model,
+                                    dispatch_uid=f'api.response_cache.post_delete.{name}')
+            pre_save.connect(
+                response_cache.remember_previous_category, sender=self.get_model('Product'),
+                dispatch_uid='api.response_cache.pre_save.Product',
+            )
+            m2m_changed.connect(
+                response_cache.invalidate_cached_addon_responses,
+                sender=self.get_model('AddOn').applicable_products.through,
+                dispatch_uid='api.response_cache.m2m_changed',
+            )
+            registry.register_collector(response_cache.collect_metrics)
+
+        # Register the app's background tasks for run_tasks workers, and export
+        # queue depth, lag and durations (api.tasks)
+        from . import alerts  # noqa: F401
+        registry.register_collector(tasks.collect_metrics)
+
+        # Create the coming months' transaction partitions on deploy (api.partitions)
+        post_migrate.connect(partitions.ensure_after_migrate, sender=self, dispatch_uid='api.partitions.post_migrate')
+
+        if get_config()['ENABLED']:
+            connection_created.connect(install_query_inspector, dispatch_uid='api.query_inspector')
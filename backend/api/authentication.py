@@ -0,0 +1,113 @@
+"""
+Cached JWT authentication
+
+JWTAuthentication loads the User row on every request although the views only
+read the role, verification and active flags. CachedJWTAuthentication keeps
+recently authenticated users in a per-process cache for AUTH_USER_CACHE_TTL
+seconds. Saving or deleting a user invalidates its entry in the current
+process; other worker processes pick up the change (e.g. a deactivation) once
+the TTL has expired.
+"""
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from .log import bind
+
+
+class UserCache:
+    """Thread-safe TTL cache of User instances keyed by id, bounded in size"""
+
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._generation = 0
+
+    @property
+    def ttl(self):
+        return getattr(settings, 'AUTH_USER_CACHE_TTL', 0)
+
+    @property
+    def generation(self):
+        """Read before loading a user from the database, pass to set()"""
+        return self._generation
+
+    def get(self, user_id):
+        """Return a private copy of the cached user, or None"""
+        key = str(user_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            user = entry[1]
+        # Each request gets its own instance so attribute changes do not leak
+        return copy.copy(user)
+
+    def set(self, user_id, user, generation):
+        """Cache ``user`` unless an invalidation happened since ``generation`` was read"""
+        ttl = self.ttl
+        if ttl <= 0:
+            return
+        key = str(user_id)
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._entries[key] = (time.monotonic() + ttl, copy.copy(user))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, *user_ids):
+        with self._lock:
+            self._generation += 1
+            for user_id in user_ids:
+                self._entries.pop(str(user_id), None)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+
+user_cache = UserCache()
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication that serves the user from user_cache when possible"""
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        user = user_cache.get(user_id)
+        if user is None:
+            generation = user_cache.generation
+            user = super().get_user(validated_token)
+            user_cache.set(user_id, user, generation)
+        elif api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+
+        bind(role=user.role)
+        return user
+
+
+def invalidate_cached_user(sender, instance, **kwargs):
+    """post_save/post_delete receiver dropping the user from user_cache"""
+    user_cache.invalidate(instance.pk)
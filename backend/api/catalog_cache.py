@@ -0,0 +1,411 @@
+"""
+Process-local catalog cache
+
+Checkout, QR redemption and cart quotes keep resolving the same few hundred
+products, variants and add-ons. ``catalog`` serves them from memory as
+immutable slot records (not model instances), read-through: ids missing from
+the cache are loaded together with one query per model and kept in an LRU
+bounded by CATALOG_CACHE_MAX_SIZE entries per model for CATALOG_CACHE_TTL
+seconds.
+
+Saving or deleting a product, variant or add-on (or changing which products
+an add-on applies to) evicts its record in this process once the change
+commits and bumps ``catalog.version``; loads that started before an
+invalidation are not stored, so a concurrent edit cannot be overwritten by
+stale rows. Evicting at commit rather than at save keeps a read between the
+two from caching the old row again (or a rolled back one). Other
+worker processes see edits once the TTL has expired. Queryset ``update()``
+calls bypass the signals and are also only picked up after the TTL.
+
+Add-ons are few and every product page needs to know which apply to it, so
+they are not cached one by one: ``addon_index`` holds all of them together
+with a product -> applicable add-on ids index covering both global add-ons
+(no applicable products) and product-specific ones. It is built with two
+queries and patched incrementally, once the change commits, by reloading
+only the add-ons whose row or ``applicable_products`` changed.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete
+
+from .models import AddOn, Product, Variant
+
+
+class _Record:
+    """Immutable record; subclasses list their fields in __slots__"""
+
+    __slots__ = ()
+
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values):
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f'{type(self).__name__} is read-only')
+
+    def __repr__(self):
+        fields = ', '.join(f'{name}={getattr(self, name)!r}' for name in self.__slots__)
+        return f'{type(self).__name__}({fields})'
+
+
+class ProductRecord(_Record):
+    __slots__ = ('id', 'name', 'sku', 'category_id', 'base_price', 'is_taxable', 'is_active')
+    fields = __slots__
+
+
+class VariantRecord(_Record):
+    __slots__ = ('id', 'product_id', 'name', 'sku_suffix', 'price_adjustment', 'is_active')
+    fields = __slots__
+
+
+class AddOnRecord(_Record):
+    # product_ids is a frozenset; empty means the add-on applies to every product
+    __slots__ = ('id', 'name', 'price', 'is_active', 'product_ids')
+    fields = ('id', 'name', 'price', 'is_active')
+
+    def applies_to(self, product_id):
+        return not self.product_ids or product_id in self.product_ids
+
+
+class LRUStore:
+    """Thread-safe LRU + TTL mapping with hit/miss/eviction counters"""
+
+    def __init__(self, name):
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get_many(self, keys):
+        """{key: value} of the cached, unexpired keys"""
+        found = {}
+        now = time.monotonic()
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is None or entry[0] <= now:
+                    self.misses += 1
+                    continue
+                self._entries.move_to_end(key)
+                self.hits += 1
+                found[key] = entry[1]
+        return found
+
+    def set_many(self, items, ttl, max_size):
+        expires = time.monotonic() + ttl
+        with self._lock:
+            for key, value in items.items():
+                self._entries[key] = (expires, value)
+                self._entries.move_to_end(key)
+            while len(self._entries) > max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        return entry[1] if entry else None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            size = len(self._entries)
+        lookups = self.hits + self.misses
+        return {
+            'size': size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+        }
+
+
+class CatalogCache:
+    """Read-through cache of product, variant and add-on records"""
+
+    def __init__(self):
+        self.version = 0
+        self._lock = threading.Lock()
+        self._products = LRUStore('products')
+        self._skus = LRUStore('product_skus')
+        self._variants = LRUStore('variants')
+
+    @property
+    def ttl(self):
+        return getattr(settings, 'CATALOG_CACHE_TTL', 60)
+
+    @property
+    def max_size(self):
+        return getattr(settings, 'CATALOG_CACHE_MAX_SIZE', 5000)
+
+    def _read_through(self, store, ids, load):
+        ids = set(ids)
+        found = store.get_many(ids)
+        missing = ids - found.keys()
+        if missing:
+            version = self.version
+            loaded = load(missing)
+            found.update(loaded)
+            ttl = self.ttl
+            if ttl > 0:
+                with self._lock:
+                    # Rows read before an invalidation may be stale: serve, do not keep
+                    if version == self.version:
+                        store.set_many(loaded, ttl, self.max_size)
+                        if store is self._products:
+                            self._skus.set_many(
+                                {record.sku: record.id for record in loaded.values()}, ttl, self.max_size
+                            )
+        return found
+
+    @staticmethod
+    def _load_products(ids):
+        return {
+            row[0]: ProductRecord(*row)
+            for row in Product.objects.filter(id__in=ids).values_list(*ProductRecord.fields)
+        }
+
+    @staticmethod
+    def _load_variants(ids):
+        return {
+            row[0]: VariantRecord(*row)
+            for row in Variant.objects.filter(id__in=ids).values_list(*VariantRecord.fields)
+        }
+
+    def products(self, ids):
+        """{id: ProductRecord} of the existing products among ``ids``"""
+        return self._read_through(self._products, ids, self._load_products)
+
+    def products_by_sku(self, skus):
+        """{sku: ProductRecord} of the existing products among ``skus``"""
+        skus = set(skus)
+        ids = self._skus.get_many(skus)
+        missing = skus - ids.keys()
+        if missing:
+            ids.update(Product.objects.filter(sku__in=missing).values_list('sku', 'id'))
+        records = self.products(ids.values())
+        return {sku: records[product_id] for sku, product_id in ids.items() if product_id in records}
+
+    def variants(self, ids):
+        """{id: VariantRecord} of the existing variants among ``ids``"""
+        return self._read_through(self._variants, ids, self._load_variants)
+
+    def addons(self, ids):
+        """{id: AddOnRecord} of the existing add-ons among ``ids``"""
+        return addon_index.get_many(ids)
+
+    def invalidate(self, model, ids=None):
+        """Evict records of ``model`` ('product' or 'variant'); all of them without ``ids``"""
+        store = {'product': self._products, 'variant': self._variants}[model]
+        with self._lock:
+            self.version += 1
+            if ids is None:
+                store.clear()
+                if store is self._products:
+                    self._skus.clear()
+                return
+            for record_id in ids:
+                record = store.pop(record_id)
+                if record is not None and store is self._products:
+                    self._skus.pop(record.sku)
+
+    def clear(self):
+        with self._lock:
+            self.version += 1
+            for store in (self._products, self._skus, self._variants):
+                store.clear()
+        addon_index.clear()
+
+    def stats(self):
+        return {
+            'version': self.version,
+            **{store.name: store.stats() for store in (self._products, self._skus, self._variants)},
+            'addons': addon_index.stats(),
+        }
+
+
+class AddOnIndex:
+    """
+    Every add-on record plus the add-on ids applicable to each product
+
+    Rebuilt from scratch when CATALOG_CACHE_TTL expires (to pick up edits made
+    by other processes) and patched per add-on through ``refresh()`` in
+    between.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.builds = 0
+        self.refreshes = 0
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._built_at = 0.0
+        self._records = None
+        self._global_ids = frozenset()
+        self._by_product = {}
+
+    @staticmethod
+    def _load(ids=None):
+        """{id: AddOnRecord} of all add-ons, or of those among ``ids``"""
+        addons = AddOn.objects.all() if ids is None else AddOn.objects.filter(id__in=ids)
+        rows = list(addons.values_list(*AddOnRecord.fields))
+        through = AddOn.applicable_products.through.objects
+        if ids is not None:
+            through = through.filter(addon_id__in=ids)
+        applicable = {}
+        if rows:
+            for addon_id, product_id in through.values_list('addon_id', 'product_id'):
+                applicable.setdefault(addon_id, set()).add(product_id)
+        return {row[0]: AddOnRecord(*row, frozenset(applicable.get(row[0], ()))) for row in rows}
+
+    def _index(self, records):
+        global_ids = set()
+        by_product = {}
+        for record in records.values():
+            if not record.product_ids:
+                global_ids.add(record.id)
+            for product_id in record.product_ids:
+                by_product.setdefault(product_id, set()).add(record.id)
+        self._records = records
+        self._global_ids = frozenset(global_ids)
+        self._by_product = by_product
+
+    def _current(self):
+        """The add-on records, (re)building the index when missing or expired"""
+        ttl = getattr(settings, 'CATALOG_CACHE_TTL', 60)
+        records = self._records
+        if records is not None and time.monotonic() - self._built_at < ttl:
+            self.hits += 1
+            return records
+
+        self.misses += 1
+        generation = self._generation
+        records = self._load()
+        with self._lock:
+            # A refresh during the load may have patched newer rows in: keep those
+            if generation == self._generation and ttl > 0:
+                self._index(records)
+                self._built_at = time.monotonic()
+                self.builds += 1
+        return records
+
+    def get_many(self, ids):
+        """{id: AddOnRecord} of the existing add-ons among ``ids``"""
+        records = self._current()
+        return {addon_id: records[addon_id] for addon_id in ids if addon_id in records}
+
+    def ids_for_product(self, product_id):
+        """Ids of the add-ons applicable to ``product_id`` (global and specific), ordered by name"""
+        records = self._current()
+        with self._lock:
+            if records is self._records:
+                ids = self._global_ids | self._by_product.get(product_id, frozenset())
+            else:
+                # Served from a load that was not kept
+                ids = [record.id for record in records.values() if record.applies_to(product_id)]
+        return sorted(ids, key=lambda addon_id: (records[addon_id].name, addon_id))
+
+    def product_specific_ids(self, product_id):
+        """Ids of the add-ons restricted to a set of products that includes ``product_id``"""
+        with self._lock:
+            return set(self._by_product.get(product_id, ()))
+
+    def refresh(self, addon_ids):
+        """Reload ``addon_ids`` from the database and patch them into the index"""
+        addon_ids = set(addon_ids)
+        with self._lock:
+            self._generation += 1
+            if self._records is None or not addon_ids:
+                return
+            # Loaded under the lock so concurrent refreshes apply in order
+            loaded = self._load(addon_ids)
+            records = dict(self._records)
+            for addon_id in addon_ids:
+                records.pop(addon_id, None)
+            records.update(loaded)
+            self._index(records)
+            self.refreshes += 1
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._records = None
+            self._global_ids = frozenset()
+            self._by_product = {}
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._records or ()),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': 0,
+            'builds': self.builds,
+            'refreshes': self.refreshes,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+        }
+
+
+catalog = CatalogCache()
+addon_index = AddOnIndex()
+
+
+def collect_metrics():
+    """Catalog cache statistics for the Prometheus endpoint (api.metrics)"""
+    stats = catalog.stats()
+    stores = [(name, values) for name, values in stats.items() if isinstance(values, dict)]
+    return [
+        ('pos_catalog_cache_hits_total', 'counter', 'Catalog cache lookups served from memory',
+         [({'store': name}, values['hits']) for name, values in stores]),
+        ('pos_catalog_cache_misses_total', 'counter', 'Catalog cache lookups that went to the database',
+         [({'store': name}, values['misses']) for name, values in stores]),
+        ('pos_catalog_cache_evictions_total', 'counter', 'Catalog cache records dropped to stay within the size bound',
+         [({'store': name}, values['evictions']) for name, values in stores]),
+        ('pos_catalog_cache_size', 'gauge', 'Catalog cache records held',
+         [({'store': name}, values['size']) for name, values in stores]),
+    ]
+
+
+def _refresh_addons_on_commit(addon_ids):
+    addon_ids = set(addon_ids)
+    if addon_ids:
+        transaction.on_commit(lambda: addon_index.refresh(addon_ids))
+
+
+def _invalidate_on_commit(model, ids):
+    transaction.on_commit(lambda: catalog.invalidate(model, ids))
+
+
+def invalidate_catalog_record(sender, instance, **kwargs):
+    """post_save/post_delete receiver for Product, Variant and AddOn"""
+    if sender is AddOn:
+        _refresh_addons_on_commit([instance.pk])
+        return
+    _invalidate_on_commit('product' if sender is Product else 'variant', [instance.pk])
+    if sender is Product and kwargs.get('signal') is post_delete:
+        # Deleting a product drops its M2M rows without m2m_changed; an add-on
+        # left without applicable products becomes global
+        _refresh_addons_on_commit(addon_index.product_specific_ids(instance.pk))
+
+
+def invalidate_addon_applicability(sender, instance, action, reverse, pk_set, **kwargs):
+    """m2m_changed receiver for AddOn.applicable_products"""
+    if not reverse:
+        if action.startswith('post_'):
+            _refresh_addons_on_commit([instance.pk])
+    elif action == 'pre_clear':
+        # product.available_addons.clear(): pk_set is not provided
+        _refresh_addons_on_commit(addon_index.product_specific_ids(instance.pk))
+    elif action.startswith('post_') and pk_set:
+        # product.available_addons.add(...): pk_set holds add-on ids
+        _refresh_addons_on_commit(pk_set)
@@ -2,12 +2,17 @@
 Encryption utilities for API payload encryption/decryption
 Compatible with CryptoJS AES encryption
 """
-import json
 import base64
+import functools
+import hmac
+import os
+import struct
 from Crypto.Cipher import AES
 from Crypto.Util.Padding import pad, unpad
 import hashlib
 
+from . import fast_json
+
 
 class EncryptionService:
     """Service for encrypting and decrypting API payloads using AES (CryptoJS compatible)"""
@@ -45,12 +50,18 @@ class EncryptionService:
             Base64 encoded encrypted string (CryptoJS format with Salted__ prefix)
         """
         try:
-            import os
-            
-            # Convert data to JSON
-            json_data = json.dumps(data)
-            plaintext = json_data.encode('utf-8')
-            
+            plaintext = fast_json.dumps(data)
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"Encryption failed: {str(e)}")
+        return EncryptionService.encrypt_bytes(plaintext, encryption_key)
+    
+    @staticmethod
+    def encrypt_bytes(plaintext: bytes, encryption_key: str) -> str:
+        """
+        Encrypt already serialized JSON (e.g. a rendered response body);
+        same format as encrypt_data
+        """
+        try:
             # Generate random salt (8 bytes)
             salt = os.urandom(8)
             
@@ -102,8 +113,7 @@ class EncryptionService:
             plaintext = unpad(cipher.decrypt(ciphertext), AES.block_size)
             
             # Convert to dictionary
-            json_data = plaintext.decode('utf-8')
-            return json.loads(json_data)
+            return fast_json.loads(plaintext)
         except Exception as e:
             raise ValueError(f"Decryption failed: {str(e)}")
     
@@ -124,3 +134,211 @@ class EncryptionService:
         
         excluded_list = [route.strip() for route in excluded_routes.split(',')]
         return any(path.startswith(route) for route in excluded_list if route)
+
+
+# Checkout QR codes
+
+BASE45_ALPHABET = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ $%*+-./:'
+# Maps base45 characters to their values and every other byte to 0xFF
+_BASE45_TABLE = bytes(
+    BASE45_ALPHABET.index(chr(byte)) if chr(byte) in BASE45_ALPHABET else 0xFF
+    for byte in range(256)
+)
+
+
+def base45_encode(data: bytes) -> str:
+    """RFC 9285 base45, which fits the QR alphanumeric mode"""
+    chars = []
+    for i in range(0, len(data) - 1, 2):
+        n = data[i] * 256 + data[i + 1]
+        n, c = divmod(n, 45)
+        e, d = divmod(n, 45)
+        chars += (BASE45_ALPHABET[c], BASE45_ALPHABET[d], BASE45_ALPHABET[e])
+    if len(data) % 2:
+        d, c = divmod(data[-1], 45)
+        chars += (BASE45_ALPHABET[c], BASE45_ALPHABET[d])
+    return ''.join(chars)
+
+
+def base45_decode(text: str) -> bytes:
+    try:
+        values = text.encode('ascii').translate(_BASE45_TABLE)
+    except UnicodeEncodeError:
+        raise ValueError('Invalid base45 character')
+    if 0xFF in values:
+        raise ValueError('Invalid base45 character')
+    if len(values) % 3 == 1:
+        raise ValueError('Invalid base45 length')
+
+    full = len(values) - len(values) % 3
+    words = [
+        c + d * 45 + e * 2025
+        for c, d, e in zip(values[0:full:3], values[1:full:3], values[2:full:3])
+    ]
+    if words and max(words) > 0xFFFF:
+        raise ValueError('Invalid base45 group')
+    out = bytearray(struct.pack(f'>{len(words)}H', *words))
+    if full != len(values):
+        n = values[-2] + values[-1] * 45
+        if n > 0xFF:
+            raise ValueError('Invalid base45 group')
+        out.append(n)
+    return bytes(out)
+
+
+def _write_varint(out: bytearray, value: int):
+    """Unsigned LEB128"""
+    if value < 0:
+        raise ValueError('Cannot pack negative numbers')
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varints(data: bytes) -> list:
+    """Every unsigned LEB128 number in ``data``, in order"""
+    values = []
+    value = shift = 0
+    for byte in data:
+        if byte < 0x80:
+            values.append(value | (byte << shift))
+            value = shift = 0
+        else:
+            value |= (byte & 0x7F) << shift
+            shift += 7
+            if shift > 63:
+                raise ValueError('Varint too long')
+    if shift:
+        raise ValueError('Truncated varint')
+    return values
+
+
+class CartQRCodec:
+    """
+    Versioned compact codec for customer checkout QR codes
+
+    Version 1 keeps only what the server needs to price a cart (ids and
+    quantities, plus the total shown to the customer and the cart timestamp),
+    packed as varints and sealed with AES-256-CTR and HMAC-SHA256
+    (encrypt-then-MAC, tag truncated to 16 bytes):
+
+        version (1 byte) | nonce (12 bytes) | ciphertext | tag (16 bytes)
+
+    The tag covers version, nonce and ciphertext, so forged or altered codes
+    are rejected before anything is decrypted. Both keys come from one
+    SHA-512 of a fixed context string and the shared passphrase (first half
+    encrypts, second half authenticates); the CTR counter block is the nonce
+    followed by a 32-bit counter starting at 0. Every primitive is available
+    in browsers through WebCrypto. Packed plaintext:
+
+        timestamp (seconds) | total (cents) | item count |
+        per item: product id | variant id (0 = none) | add-on count | add-on ids | quantity
+
+    The binary form is text-encoded with base45 (QR alphanumeric mode,
+    prefix ``PC1:``) or base64url (prefix ``pc1.``). Anything without one of
+    these prefixes is decoded as the legacy CryptoJS JSON payload.
+    """
+
+    VERSION = 1
+    BASE45_PREFIX = 'PC1:'
+    BASE64_PREFIX = 'pc1.'
+    NONCE_SIZE = 12
+    TAG_SIZE = 16
+    KEY_CONTEXT = b'pos-store/cart-qr/v1\x00'
+
+    @staticmethod
+    @functools.lru_cache(maxsize=8)
+    def _keys(passphrase: str) -> tuple:
+        digest = hashlib.sha512(CartQRCodec.KEY_CONTEXT + passphrase.encode('utf-8')).digest()
+        return digest[:32], digest[32:]
+
+    @staticmethod
+    def pack(cart: dict) -> bytes:
+        """Pack a cart in the QR shape ({items: [{productId, variantId, addonIds, quantity}], total, timestamp})"""
+        out = bytearray()
+        _write_varint(out, int(cart.get('timestamp') or 0) // 1000)
+        _write_varint(out, int(round(float(cart.get('total') or 0) * 100)))
+        items = cart['items']
+        _write_varint(out, len(items))
+        for item in items:
+            _write_varint(out, int(item['productId']))
+            _write_varint(out, int(item.get('variantId') or 0))
+            addon_ids = item.get('addonIds') or []
+            _write_varint(out, len(addon_ids))
+            for addon_id in addon_ids:
+                _write_varint(out, int(addon_id))
+            _write_varint(out, int(item.get('quantity', 1)))
+        return bytes(out)
+
+    @staticmethod
+    def unpack(data: bytes) -> dict:
+        values = iter(_read_varints(data))
+        try:
+            timestamp, cents, count = next(values), next(values), next(values)
+            items = []
+            for _ in range(count):
+                product_id, variant_id, addon_count = next(values), next(values), next(values)
+                addon_ids = [next(values) for _ in range(addon_count)]
+                items.append({
+                    'productId': product_id,
+                    'variantId': variant_id or None,
+                    'addonIds': addon_ids,
+                    'quantity': next(values),
+                })
+        except StopIteration:
+            raise ValueError('Truncated cart')
+        if next(values, None) is not None:
+            raise ValueError('Trailing data after cart')
+        return {
+            'items': items,
+            'total': cents / 100,
+            'itemCount': sum(item['quantity'] for item in items),
+            'timestamp': timestamp * 1000,
+        }
+
+    @classmethod
+    def encode(cls, cart: dict, passphrase: str, text: str = 'base45') -> str:
+        """Seal a cart into QR text ('base45' or 'base64url')"""
+        enc_key, mac_key = cls._keys(passphrase)
+        nonce = os.urandom(cls.NONCE_SIZE)
+        ciphertext = AES.new(enc_key, AES.MODE_CTR, nonce=nonce).encrypt(cls.pack(cart))
+        sealed = bytes([cls.VERSION]) + nonce + ciphertext
+        sealed += hmac.digest(mac_key, sealed, 'sha256')[:cls.TAG_SIZE]
+        if text == 'base45':
+            return cls.BASE45_PREFIX + base45_encode(sealed)
+        if text == 'base64url':
+            return cls.BASE64_PREFIX + base64.urlsafe_b64encode(sealed).rstrip(b'=').decode('ascii')
+        raise ValueError(f'Unknown text encoding: {text}')
+
+    @classmethod
+    def decode(cls, text: str, passphrase: str) -> dict:
+        """
+        Cart of a scanned QR code, in either the compact or the legacy format
+
+        Raises ValueError when the text is malformed, was sealed with another
+        key or has been tampered with.
+        """
+        text = text.strip()
+        if text.startswith(cls.BASE45_PREFIX):
+            sealed = base45_decode(text[len(cls.BASE45_PREFIX):])
+        elif text.startswith(cls.BASE64_PREFIX):
+            body = text[len(cls.BASE64_PREFIX):]
+            try:
+                sealed = base64.urlsafe_b64decode(body + '=' * (-len(body) % 4))
+            except (ValueError, TypeError):
+                raise ValueError('Invalid base64url payload')
+        else:
+            return EncryptionService.decrypt_data(text, passphrase)
+
+        if len(sealed) < 1 + cls.NONCE_SIZE + cls.TAG_SIZE:
+            raise ValueError('Payload too short')
+        if sealed[0] != cls.VERSION:
+            raise ValueError(f'Unsupported QR payload version {sealed[0]}')
+        enc_key, mac_key = cls._keys(passphrase)
+        body, tag = sealed[:-cls.TAG_SIZE], sealed[-cls.TAG_SIZE:]
+        if not hmac.compare_digest(hmac.digest(mac_key, body, 'sha256')[:cls.TAG_SIZE], tag):
+            raise ValueError('QR payload failed authentication')
+        nonce = body[1:1 + cls.NONCE_SIZE]
+        plaintext = AES.new(enc_key, AES.MODE_CTR, nonce=nonce).decrypt(body[1 + cls.NONCE_SIZE:])
+        return cls.unpack(plaintext)
@@ -0,0 +1,101 @@
+"""
+Idempotency-Key support for unsafe endpoints
+
+A request carrying an ``Idempotency-Key`` header is processed at most once per
+user, endpoint and key. The key row is inserted in the same database
+transaction as the view's work and holds the response once it commits:
+
+- a retry after completion gets the stored response replayed, with an
+  ``Idempotent-Replayed: true`` header, and touches nothing else;
+- a concurrent duplicate blocks on the key's unique index until the first
+  request commits, then receives the stored response;
+- if the first request fails with a 5xx, everything (including the key) is
+  rolled back so a retry runs again.
+
+Keys expire after ``settings.IDEMPOTENCY_KEY_TTL``; reusing a key with a
+different payload is rejected with 422.
+"""
+import functools
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+
+def request_fingerprint(data):
+    payload = json.dumps(data, sort_keys=True, cls=DjangoJSONEncoder).encode('utf-8')
+    return hashlib.sha256(payload).hexdigest()
+
+
+def _replay(record):
+    response = Response(record.response_body, status=record.status_code)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(view):
+    """Make a DRF view method honour the Idempotency-Key header"""
+
+    @functools.wraps(view)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key:
+            return view(self, request, *args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return Response({
+                'error': f'{HEADER} must be at most {MAX_KEY_LENGTH} characters'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        fingerprint = request_fingerprint(request.data)
+        now = timezone.now()
+        with transaction.atomic():
+            record, created = IdempotencyKey.objects.get_or_create(
+                user=request.user,
+                scope=request.resolver_match.view_name,
+                key=key,
+                defaults={
+                    'request_hash': fingerprint,
+                    'expires_at': now + settings.IDEMPOTENCY_KEY_TTL,
+                },
+            )
+            if not created:
+                # Serializes reuse of an expired key by concurrent requests
+                record = IdempotencyKey.objects.select_for_update().get(pk=record.pk)
+                if record.expires_at > now:
+                    if record.request_hash != fingerprint:
+                        return Response({
+                            'error': f'{HEADER} was already used with a different request'
+                        }, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+                    if record.status_code is None:
+                        return Response({
+                            'error': 'A request with this key is still being processed'
+                        }, status=status.HTTP_409_CONFLICT)
+                    return _replay(record)
+
+                record.request_hash = fingerprint
+                record.expires_at = now + settings.IDEMPOTENCY_KEY_TTL
+
+            response = view(self, request, *args, **kwargs)
+
+            if response.status_code >= 500:
+                # Undo the view's partial work and the key so a retry runs again
+                transaction.set_rollback(True)
+                return response
+
+            record.status_code = response.status_code
+            record.response_body = response.data
+            record.save()
+            return response
+
+    return wrapper
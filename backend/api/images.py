@@ -0,0 +1,223 @@
+"""
+Resized derivatives of product and category images
+
+Uploaded photos are often several megabytes, yet the product grid shows
+them a few hundred pixels wide. Once a save that changes ``image`` commits,
+a small thread pool renders every configured size (longest edge, never
+upscaled) in WebP and JPEG, plus AVIF when Pillow has an AVIF encoder (e.g.
+pillow-avif-plugin). Derivatives are stored under ``<upload dir>/derived/``
+(content-addressed, like the originals, with api.media's storage) and
+recorded as storage names in the model's ``image_variants``:
+
+    {"source": "products/tea.jpg",
+     "sizes": {"medium": {"width": 480, "height": 360,
+                          "webp": "products/derived/tea-medium.webp",
+                          "jpeg": "products/derived/tea-medium.jpg"}, ...}}
+
+Serializers expose them as URLs (serializers.ImageVariantsField). Work still
+queued when a process exits is picked up by ``manage.py
+generate_image_derivatives``, which also backfills existing media.
+"""
+import io
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from .media import delete_unreferenced
+from .response_cache import invalidate_on_commit
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': True,
+    # Longest edge in pixels per size name
+    'SIZES': {'thumb': 160, 'medium': 480, 'large': 1200},
+    # Generated when Pillow can encode them, in this order
+    'FORMATS': ['avif', 'webp', 'jpeg'],
+    'QUALITY': 80,
+    'WORKERS': 2,
+    # Render in the saving thread once the transaction commits (tests)
+    'SYNCHRONOUS': False,
+}
+
+# format -> (Pillow format, file extension, keeps transparency)
+ENCODERS = {
+    'avif': ('AVIF', 'avif', True),
+    'webp': ('WEBP', 'webp', True),
+    'jpeg': ('JPEG', 'jpg', False),
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'IMAGE_DERIVATIVES', {}))
+    return config
+
+
+def available_formats():
+    """Configured formats this Pillow build can write"""
+    Image.init()
+    return [name for name in get_config()['FORMATS'] if name in ENCODERS and ENCODERS[name][0] in Image.SAVE]
+
+
+def _cache_tags(model, pk):
+    name = model._meta.model_name
+    return (name, f'{name}:{pk}')
+
+
+def _flatten(image, keep_alpha):
+    """``image`` as RGB, or RGBA when it has transparency and ``keep_alpha``"""
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        if image.mode != 'RGBA':
+            image = image.convert('RGBA')
+        if keep_alpha:
+            return image
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image if image.mode == 'RGB' else image.convert('RGB')
+
+
+def render(name, storage=default_storage):
+    """
+    Write the derivatives of the stored image ``name``; returns the
+    ``image_variants`` value describing them
+    """
+    config = get_config()
+    formats = available_formats()
+    directory, filename = os.path.split(name)
+    stem = os.path.splitext(filename)[0]
+
+    with storage.open(name, 'rb') as f:
+        image = Image.open(f)
+        # Let the JPEG decoder downscale while decoding (much faster for large photos)
+        image.draft('RGB', (max(config['SIZES'].values()),) * 2)
+        image = ImageOps.exif_transpose(image)
+        # Resampling needs RGB(A); palette images would fall back to nearest neighbour
+        image = _flatten(image, keep_alpha=True)
+
+    sizes = {}
+    # Largest first: each size is resized from the previous one rather than the original
+    for label, edge in sorted(config['SIZES'].items(), key=lambda item: -item[1]):
+        image = image.copy()
+        image.thumbnail((edge, edge), Image.LANCZOS)
+        entry = sizes[label] = {'width': image.width, 'height': image.height}
+        for fmt in formats:
+            pil_format, extension, keep_alpha = ENCODERS[fmt]
+            buffer = io.BytesIO()
+            _flatten(image, keep_alpha).save(buffer, pil_format, quality=config['QUALITY'], optimize=fmt == 'jpeg')
+            entry[fmt] = storage.save(
+                os.path.join(directory, 'derived', f'{stem}-{label}.{extension}'),
+                ContentFile(buffer.getvalue()),
+            )
+    return {'source': name, 'sizes': sizes}
+
+
+def derived_names(variants):
+    """Storage names of every derivative recorded in ``variants``"""
+    return [
+        value for entry in ((variants or {}).get('sizes') or {}).values()
+        for key, value in entry.items() if key in ENCODERS
+    ]
+
+
+def generate(model, pk, force=False):
+    """
+    Bring ``image_variants`` of one row in line with its image; returns
+    True when derivatives were (re)generated or cleared
+    """
+    row = model.objects.filter(pk=pk).values_list('image', 'image_variants').first()
+    if row is None:
+        return False
+    name, previous = row[0] or '', row[1] or {}
+    if not force and previous.get('source', '') == name:
+        return False
+
+    variants = {}
+    if name:
+        try:
+            variants = render(name)
+        except (OSError, UnidentifiedImageError, Image.DecompressionBombError):
+            # Unreadable upload: record it so it is not retried on every save
+            logger.warning('Could not render derivatives of %s', name, exc_info=True)
+            variants = {'source': name, 'sizes': {}}
+
+    # Only if the image did not change again meanwhile; update() sends no signals
+    # Derivatives may be shared with other rows (api.media): delete only unreferenced ones
+    if not model.objects.filter(pk=pk, image=row[0]).update(image_variants=variants):
+        delete_unreferenced(derived_names(variants))
+        return False
+    delete_unreferenced(set(derived_names(previous)) - set(derived_names(variants)))
+    invalidate_on_commit(*_cache_tags(model, pk))
+    return True
+
+
+def _run(model, pk):
+    try:
+        generate(model, pk)
+    except Exception:
+        logger.exception('Image derivative generation failed for %s %s', model._meta.label, pk)
+    finally:
+        # Worker threads own their connections
+        connections.close_all()
+
+
+def schedule(model, pk):
+    """Generate derivatives for one row off the request thread"""
+    global _executor
+    config = get_config()
+    if config['SYNCHRONOUS']:
+        generate(model, pk)
+        return
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=config['WORKERS'], thread_name_prefix='image-derivatives')
+    _executor.submit(_run, model, pk)
+
+
+def schedule_image_derivatives(sender, instance, raw=False, update_fields=None, **kwargs):
+    """post_save receiver for Product and Category"""
+    if raw or (update_fields is not None and 'image' not in update_fields):
+        return
+    if (instance.image.name or '') == (instance.image_variants or {}).get('source', ''):
+        return
+    pk = instance.pk
+    transaction.on_commit(lambda: schedule(sender, pk))
+
+
+def delete_image_derivatives(sender, instance, **kwargs):
+    """post_delete receiver for Product and Category"""
+    names = derived_names(instance.image_variants)
+    if names:
+        transaction.on_commit(lambda: delete_unreferenced(names))
+
+
+def derivative_urls(variants, size=None, request=None):
+    """
+    URLs of the derivatives in ``variants``: of one size ({width, height,
+    <format>: url}, None until generated), or of every size by name
+    """
+    sizes = (variants or {}).get('sizes') or {}
+
+    def urls(entry):
+        data = {'width': entry['width'], 'height': entry['height']}
+        for fmt in ENCODERS:
+            if fmt in entry:
+                url = default_storage.url(entry[fmt])
+                data[fmt] = request.build_absolute_uri(url) if request is not None else url
+        return data
+
+    if size is not None:
+        entry = sizes.get(size)
+        return urls(entry) if entry else None
+    return {label: urls(entry) for label, entry in sizes.items()}
@@ -0,0 +1,241 @@
+"""
+Append-only inventory movement ledger with compaction checkpoints
+
+Every stock change is recorded as an InventoryMovement (sale, refund,
+exchange, restock, adjustment) with the transaction/refund number it came
+from. ``compact()`` periodically folds the movements recorded since the last
+run into one InventoryCheckpoint per inventory record: the stock as of that
+moment. Each folded movement is stamped with its checkpoint.
+
+``stock_as_of(inventory, when)`` starts from the checkpoint nearest to
+``when`` and corrects it with the few movements in between. It never sums
+the whole history.
+
+Two modes (``settings.INVENTORY_LEDGER['DEFERRED']``):
+
+- immediate (default): ``Inventory.quantity`` is updated in the same
+  transaction that records the movement, so every reader sees current stock;
+- deferred: recording a movement is a plain INSERT. Checkouts selling the
+  same product never wait on each other's row locks. A background compaction
+  (coalesced, COMPACT_DELAY seconds after a commit) applies the movements to
+  ``Inventory.quantity``. Until then that column is the compacted snapshot.
+  Stock checks that must be exact add the pending movements
+  (``pending_by_product``).
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Case, F, IntegerField, Q, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Inventory, InventoryCheckpoint, InventoryMovement
+from .response_cache import invalidate_on_commit
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'DEFERRED': False,
+    # Deferred mode: wait this long after a commit so one compaction covers a burst of sales
+    'COMPACT_DELAY': 1.0,
+    'BATCH_SIZE': 500,
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+_compaction_queued = threading.Event()
+# Compactions of one process run one at a time (SQLite has no row locks to serialize them)
+_compact_lock = threading.Lock()
+
+
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'INVENTORY_LEDGER', {}))
+    return config
+
+
+def is_deferred():
+    return get_config()['DEFERRED']
+
+
+def record(movements):
+    """Append InventoryMovement instances to the ledger (one INSERT)"""
+    InventoryMovement.objects.bulk_create(movements)
+    if is_deferred():
+        transaction.on_commit(schedule_compaction)
+
+
+def _pending(queryset, key):
+    if not is_deferred():
+        # Immediate mode applies every movement to Inventory.quantity right away
+        return {}
+    return dict(
+        queryset.filter(checkpoint__isnull=True)
+        .order_by()
+        .values(key)
+        .annotate(total=Sum('quantity'))
+        .values_list(key, 'total')
+    )
+
+
+def pending_by_inventory(inventory_ids):
+    """{inventory_id: quantity recorded but not yet in Inventory.quantity}"""
+    return _pending(InventoryMovement.objects.filter(inventory_id__in=inventory_ids), 'inventory_id')
+
+
+def pending_by_product(product_ids, location_id=None):
+    """{product_id: quantity recorded but not yet in Inventory.quantity} (at one location, or all)"""
+    queryset = InventoryMovement.objects.filter(inventory__product_id__in=product_ids)
+    if location_id is not None:
+        queryset = queryset.filter(inventory__location_id=location_id)
+    return _pending(queryset, 'inventory__product_id')
+
+
+def pending_by_location(product_ids=None, location_ids=None):
+    """{(product_id, location_id): quantity recorded but not yet in Inventory.quantity}"""
+    if not is_deferred():
+        return {}
+    queryset = InventoryMovement.objects.filter(checkpoint__isnull=True)
+    if product_ids is not None:
+        queryset = queryset.filter(inventory__product_id__in=product_ids)
+    if location_ids is not None:
+        queryset = queryset.filter(inventory__location_id__in=location_ids)
+    return {
+        (product_id, location_id): total
+        for product_id, location_id, total in queryset.order_by()
+        .values('inventory__product_id', 'inventory__location_id')
+        .annotate(total=Sum('quantity'))
+        .values_list('inventory__product_id', 'inventory__location_id', 'total')
+    }
+
+
+def compact(inventory_ids=None):
+    """
+    Checkpoint every inventory record with movements since its last
+    checkpoint (deferred mode: and apply them); returns the number of
+    checkpoints created
+    """
+    pending = InventoryMovement.objects.filter(checkpoint__isnull=True)
+    if inventory_ids is not None:
+        pending = pending.filter(inventory_id__in=inventory_ids)
+    targets = sorted(pending.order_by().values_list('inventory_id', flat=True).distinct())
+    batch_size = get_config()['BATCH_SIZE']
+    created = 0
+    with _compact_lock:
+        for start in range(0, len(targets), batch_size):
+            created += _compact_batch(targets[start:start + batch_size])
+    return created
+
+
+def _compact_batch(inventory_ids):
+    deferred = is_deferred()
+    with transaction.atomic():
+        # Immediate mode: waits for adjustments in flight, so quantity matches the committed movements.
+        # Deferred mode: serializes compactions of the same rows.
+        rows = {
+            inventory_id: (product_id, quantity)
+            for inventory_id, product_id, quantity in Inventory.objects.select_for_update()
+            .filter(id__in=inventory_ids)
+            .order_by('id')
+            .values_list('id', 'product_id', 'quantity')
+        }
+        movements = list(
+            InventoryMovement.objects.filter(inventory_id__in=rows, checkpoint__isnull=True)
+            .values_list('id', 'inventory_id', 'quantity')
+        )
+        if not movements:
+            return 0
+
+        totals = {}
+        for _, inventory_id, quantity in movements:
+            totals[inventory_id] = totals.get(inventory_id, 0) + quantity
+        now = timezone.now()
+        checkpoints = InventoryCheckpoint.objects.bulk_create([
+            InventoryCheckpoint(
+                inventory_id=inventory_id,
+                quantity=rows[inventory_id][1] + (total if deferred else 0),
+                as_of=now,
+            )
+            for inventory_id, total in totals.items()
+        ])
+        InventoryMovement.objects.filter(id__in=[movement_id for movement_id, _, _ in movements]).update(
+            checkpoint_id=Case(
+                *[When(inventory_id=checkpoint.inventory_id, then=Value(checkpoint.id)) for checkpoint in checkpoints],
+                output_field=IntegerField(),
+            )
+        )
+        if deferred:
+            Inventory.objects.filter(id__in=totals).update(
+                quantity=F('quantity') + Case(
+                    *[When(id=inventory_id, then=Value(total)) for inventory_id, total in totals.items()],
+                    default=Value(0), output_field=IntegerField(),
+                ),
+                updated_at=now,
+            )
+            invalidate_on_commit('inventory', *{f'product:{rows[inventory_id][0]}' for inventory_id in totals})
+        return len(checkpoints)
+
+
+def _run_compaction():
+    try:
+        time.sleep(get_config()['COMPACT_DELAY'])
+        # Commits from here on queue the next run; earlier ones are covered by this one
+        _compaction_queued.clear()
+        compact()
+    except Exception:
+        logger.exception('Inventory ledger compaction failed')
+    finally:
+        # Worker threads own their connections
+        connections.close_all()
+
+
+def schedule_compaction():
+    """Deferred mode: compact soon in a background thread, unless already queued"""
+    global _executor
+    if _compaction_queued.is_set():
+        return
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='inventory-ledger')
+        if not _compaction_queued.is_set():
+            _compaction_queued.set()
+            _executor.submit(_run_compaction)
+
+
+def stock_as_of(inventory, when):
+    """
+    Stock of ``inventory`` at ``when``: the quantity of the checkpoint
+    nearest to it (or the current quantity when there is none) plus the
+    movements made by ``when`` that it does not include, minus those it
+    includes that were made after ``when``
+    """
+    checkpoints = InventoryCheckpoint.objects.filter(inventory=inventory)
+    checkpoint = (
+        checkpoints.filter(as_of__lte=when).order_by('-as_of', '-id').first()
+        or checkpoints.filter(as_of__gt=when).order_by('as_of', 'id').first()
+    )
+    if checkpoint is not None:
+        base = checkpoint.quantity
+        # Checkpoints of one record are created in order under its row lock
+        included = Q(checkpoint_id__lte=checkpoint.id)
+        excluded = Q(checkpoint__isnull=True) | Q(checkpoint_id__gt=checkpoint.id)
+    else:
+        base = Inventory.objects.filter(pk=inventory.pk).values_list('quantity', flat=True).get()
+        if is_deferred():
+            included, excluded = Q(checkpoint__isnull=False), Q(checkpoint__isnull=True)
+        else:
+            included, excluded = Q(), Q(pk__in=[])
+
+    correction = InventoryMovement.objects.filter(inventory=inventory).filter(
+        (excluded & Q(created_at__lte=when)) | (included & Q(created_at__gt=when))
+    ).aggregate(
+        total=Coalesce(
+            Sum(Case(When(created_at__lte=when, then=F('quantity')), default=-F('quantity'))),
+            0,
+        )
+    )['total']
+    return base + correction
@@ -0,0 +1,173 @@
+"""
+Structured, non-blocking logging for the api app
+
+Records are enriched with the request id, route and user role of the request
+being handled, optionally sampled, and put on a bounded in-memory queue.
+A background listener thread formats them as JSON lines and writes them out,
+so request threads never block on stdout or a log file. When the queue is
+full, records are dropped and counted instead of stalling the request.
+Wired up through ``settings.LOGGING``.
+"""
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+
+_log_context = ContextVar('log_context', default=None)
+
+CONTEXT_FIELDS = ('request_id', 'route', 'role')
+
+# LogRecord attributes that are not user-supplied ``extra`` fields
+_RESERVED = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', *CONTEXT_FIELDS}
+
+
+def new_request_id():
+    return uuid.uuid4().hex
+
+
+@contextmanager
+def log_context(**fields):
+    """Bind fields (request_id, route, role) to records logged inside the block"""
+    context = dict(_log_context.get() or {})
+    context.update(fields)
+    token = _log_context.set(context)
+    try:
+        yield context
+    finally:
+        _log_context.reset(token)
+
+
+def bind(**fields):
+    """Add fields to the context of the current log_context() block"""
+    context = _log_context.get()
+    if context is not None:
+        context.update(fields)
+
+
+class RequestContextFilter(logging.Filter):
+    """Copy the current request context onto the record (runs in the calling thread)"""
+
+    def filter(self, record):
+        context = _log_context.get() or {}
+        for field in CONTEXT_FIELDS:
+            if not hasattr(record, field):
+                setattr(record, field, context.get(field))
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keep only a fraction of high-volume records. The rate comes from the
+    record's ``sample_rate`` extra or from ``rates`` keyed by logger name;
+    warnings and errors are never dropped.
+    """
+
+    def __init__(self, rates=None):
+        super().__init__()
+        self.rates = rates or {}
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = getattr(record, 'sample_rate', None)
+        if rate is None:
+            rate = self.rates.get(record.name, 1.0)
+        return rate >= 1.0 or random.random() < rate
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per record, including context and ``extra`` fields"""
+
+    def format(self, record):
+        entry = {
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f'.{int(record.msecs):03d}Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for field in CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED and key != 'sample_rate':
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class QueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler with its own listener thread writing to ``stream``.
+    Formatting happens on the listener thread; a full queue drops the record.
+    """
+
+    def __init__(self, stream=None, queue_size=10000):
+        super().__init__(queue.Queue(maxsize=queue_size))
+        self.target = logging.StreamHandler(stream or sys.stderr)
+        self.dropped = 0
+        self._listener = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def setFormatter(self, fmt):
+        super().setFormatter(fmt)
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        # Resolve the message and traceback now (arguments may change later)
+        # but leave JSON formatting to the listener thread
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def emit(self, record):
+        self._ensure_listener()
+        super().emit(record)
+
+    def _ensure_listener(self):
+        # Started lazily so that forked worker processes get their own thread
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._listener = logging.handlers.QueueListener(self.queue, self.target, respect_handler_level=True)
+            self._listener.start()
+            self._pid = os.getpid()
+            atexit.register(self._stop_listener)
+
+    def _stop_listener(self):
+        if self._listener is not None and self._pid == os.getpid():
+            self._listener.stop()
+            self._listener = None
+            self._pid = None
+
+    def close(self):
+        self._stop_listener()
+        self.target.close()
+        super().close()
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.partitions import archivable, archive_partition, get_config, is_partitioned
+
+
+class Command(BaseCommand):
+    help = ('Move monthly transaction partitions older than N months (and their refunds) '
+            'to gzipped CSV in the archive storage (api.partitions)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, default=None,
+                            help='Archive months that ended more than this many months ago '
+                                 '(default: TRANSACTION_PARTITIONS ARCHIVE_AFTER_MONTHS)')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only list the partitions that would be archived')
+        parser.add_argument('--database', default='default',
+                            help='Database alias')
+
+    def handle(self, *args, **options):
+        older_than = options['older_than']
+        if older_than is None:
+            older_than = get_config()['ARCHIVE_AFTER_MONTHS']
+        if older_than < 1:
+            raise CommandError('--older-than must be at least 1')
+        using = options['database']
+        if not is_partitioned(using):
+            raise CommandError('transactions is not partitioned; see partition_transactions --convert')
+
+        candidates = archivable(older_than, using=using)
+        for name, _ in candidates:
+            if options['dry_run']:
+                self.stdout.write(name)
+                continue
+            # One transaction per month: an interrupted run keeps what it finished
+            files = archive_partition(name, using=using)
+            self.stdout.write(f'Archived {name} to {", ".join(files)}')
+
+        verb = 'Would archive' if options['dry_run'] else 'Archived'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {len(candidates)} partition(s)'))
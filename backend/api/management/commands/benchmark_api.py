@@ -0,0 +1,578 @@
+"""
+Benchmark runner for the key POS API flows.
+
+Generates a throwaway dataset, drives the API with concurrent clients against
+the in-process WSGI (threads) or ASGI (asyncio tasks) application and reports
+throughput, latency percentiles and queries per request as JSON so results
+can be compared between commits. ``--interface both`` runs each interface in
+its own process (ASGI with the async read views enabled) and compares
+throughput and peak memory. The ``payment_retry_storm`` flow has every client
+send the same Idempotency-Key'd payments and verifies they took effect once.
+"""
+import asyncio
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.db.models import Count
+from asgiref.sync import ThreadSensitiveContext
+from django.test import AsyncClient, Client
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from api import ledger
+from api.encryption import EncryptionService
+from api.models import Category, EncryptionSettings, Inventory, Location, Product, Transaction, User
+
+
+BENCH_PREFIX = 'bench_'
+BENCH_SKU_PREFIX = 'BENCH-'
+BENCH_PASSWORD = 'BenchPass123!'
+
+# Queued sales sent per offline_bulk_upload request
+OFFLINE_BATCH_SIZE = 50
+
+# Lines per cart_quote request
+QUOTE_CART_LINES = 50
+
+FLOWS = [
+    'login',
+    'product_list',
+    'product_search',
+    'product_detail',
+    'category_list',
+    'cart_quote',
+    'process_payment',
+    'payment_retry_storm',
+    'offline_bulk_upload',
+    'refund',
+    'transaction_history',
+    'transaction_detail',
+    'inventory_restock',
+]
+
+_query_counter = ContextVar('benchmark_query_counter', default=None)
+
+
+def _count_queries(execute, sql, params, many, context):
+    counter = _query_counter.get()
+    if counter is not None:
+        counter[0] += 1
+    return execute(sql, params, many, context)
+
+
+def _install_query_counter(sender=None, connection=None, **kwargs):
+    if _count_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_count_queries)
+
+
+class ThreadSampler(threading.Thread):
+    """Background thread tracking the peak number of live threads"""
+
+    def __init__(self, interval=0.05):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak = threading.active_count()
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            self.peak = max(self.peak, threading.active_count())
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+
+def percentile(sorted_values, pct):
+    """Linear-interpolated percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    if len(sorted_values) == 1:
+        return sorted_values[0]
+    rank = (len(sorted_values) - 1) * (pct / 100.0)
+    lower = int(rank)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (rank - lower)
+
+
+def _current_stock(queryset):
+    """{inventory_id: (product_id, stock)} including movements a deferred ledger has not compacted yet"""
+    stock = {
+        inventory_id: (product_id, quantity)
+        for inventory_id, product_id, quantity in queryset.values_list('id', 'product_id', 'quantity')
+    }
+    for inventory_id, pending in ledger.pending_by_inventory(list(stock)).items():
+        product_id, quantity = stock[inventory_id]
+        stock[inventory_id] = (product_id, quantity + pending)
+    return stock
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the main API flows with concurrent clients and report latency percentiles as JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interface', choices=['wsgi', 'asgi', 'both'], default='wsgi',
+                            help='Drive the WSGI app with threads, the ASGI app with asyncio tasks, '
+                                 'or both in separate processes for comparison')
+        parser.add_argument('--clients', type=int, default=8, help='Number of concurrent clients')
+        parser.add_argument('--iterations', type=int, default=20, help='Requests per client per flow')
+        parser.add_argument('--products', type=int, default=200, help='Products in the generated dataset')
+        parser.add_argument('--flows', default=','.join(FLOWS),
+                            help=f'Comma-separated subset of: {", ".join(FLOWS)}')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed for request mix')
+        parser.add_argument('--output', help='Write the JSON report to this file instead of stdout')
+        parser.add_argument('--keep-data', action='store_true', help='Do not delete the generated dataset')
+
+    def handle(self, *args, **options):
+        flows = [name.strip() for name in options['flows'].split(',') if name.strip()]
+        unknown = [name for name in flows if name not in FLOWS]
+        if unknown:
+            raise CommandError(f'Unknown flow(s): {", ".join(unknown)}')
+        if options['clients'] < 1 or options['iterations'] < 1:
+            raise CommandError('--clients and --iterations must be at least 1')
+
+        if options['interface'] == 'both':
+            return self._compare_interfaces(options)
+
+        random.seed(options['seed'])
+        self.encryption = EncryptionSettings.get_settings()
+
+        self.stderr.write(self.style.WARNING(f'Generating dataset ({options["products"]} products)...'))
+        dataset = self._create_dataset(options['products'], options['clients'])
+
+        connection_created.connect(_install_query_counter)
+        _install_query_counter(connection=connection)
+        sampler = ThreadSampler()
+        sampler.start()
+        try:
+            results = {}
+            for flow in flows:
+                self.stderr.write(self.style.WARNING(f'Running {flow}...'))
+                if flow == 'payment_retry_storm':
+                    self._prepare_storm(dataset, options['iterations'])
+                if options['interface'] == 'asgi':
+                    samples, wall_time = asyncio.run(
+                        self._run_flow_asgi(flow, dataset, options['clients'], options['iterations'])
+                    )
+                else:
+                    samples, wall_time = self._run_flow_wsgi(
+                        flow, dataset, options['clients'], options['iterations']
+                    )
+                results[flow] = self._summarize(samples, wall_time)
+                if flow == 'payment_retry_storm':
+                    results[flow]['exactly_once'] = self._verify_storm()
+        finally:
+            sampler.stop()
+            connection_created.disconnect(_install_query_counter)
+            if not options['keep_data']:
+                self._delete_dataset()
+
+        report = {
+            'commit': self._git_commit(),
+            'timestamp': timezone.now().isoformat(),
+            'interface': options['interface'],
+            'async_read_views': settings.ASYNC_READ_VIEWS,
+            'database': connection.vendor,
+            'encryption_enabled': self.encryption.encryption_enabled,
+            'clients': options['clients'],
+            'iterations': options['iterations'],
+            'products': options['products'],
+            'process': {
+                'max_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+                'peak_threads': sampler.peak,
+            },
+            'flows': results,
+        }
+        self._write_report(report, options['output'])
+
+    def _write_report(self, report, path):
+        output = json.dumps(report, indent=2)
+        if path:
+            with open(path, 'w') as fh:
+                fh.write(output + '\n')
+            self.stderr.write(self.style.SUCCESS(f'Report written to {path}'))
+        else:
+            self.stdout.write(output)
+
+    def _compare_interfaces(self, options):
+        """Run WSGI and ASGI in separate processes so peak memory is comparable"""
+        runs = {}
+        for interface in ('wsgi', 'asgi'):
+            with tempfile.NamedTemporaryFile(suffix='.json') as report_file:
+                command = [
+                    sys.executable, sys.argv[0], 'benchmark_api',
+                    '--interface', interface,
+                    '--clients', str(options['clients']),
+                    '--iterations', str(options['iterations']),
+                    '--products', str(options['products']),
+                    '--flows', options['flows'],
+                    '--seed', str(options['seed']),
+                    '--output', report_file.name,
+                ]
+                env = dict(os.environ, ASYNC_READ_VIEWS='True' if interface == 'asgi' else 'False')
+                self.stderr.write(self.style.WARNING(f'=== {interface.upper()} ==='))
+                subprocess.run(command, env=env, check=True)
+                with open(report_file.name) as fh:
+                    runs[interface] = json.load(fh)
+
+        def ratio(asgi_value, wsgi_value):
+            if asgi_value is None or not wsgi_value:
+                return None
+            return round(asgi_value / wsgi_value, 3)
+
+        wsgi, asgi = runs['wsgi'], runs['asgi']
+        comparison = {
+            'max_rss_ratio': ratio(asgi['process']['max_rss_mb'], wsgi['process']['max_rss_mb']),
+            'peak_threads': {'wsgi': wsgi['process']['peak_threads'], 'asgi': asgi['process']['peak_threads']},
+            'flows': {
+                flow: {
+                    'throughput_ratio': ratio(asgi['flows'][flow]['throughput_rps'],
+                                              wsgi['flows'][flow]['throughput_rps']),
+                    'p95_ratio': ratio(asgi['flows'][flow]['latency_ms']['p95'],
+                                       wsgi['flows'][flow]['latency_ms']['p95']),
+                }
+                for flow in wsgi['flows']
+            },
+        }
+        self._write_report({'runs': runs, 'asgi_vs_wsgi': comparison}, options['output'])
+
+    # Dataset
+
+    def _create_dataset(self, product_count, client_count):
+        self._delete_dataset()
+
+        category = Category.objects.create(name=f'{BENCH_PREFIX}category', description='Benchmark data')
+        Product.objects.bulk_create([
+            Product(
+                name=f'Benchmark Product {i:05d}',
+                description='Generated by benchmark_api',
+                category=category,
+                base_price=Decimal(random.randint(100, 5000)) / 100,
+                sku=f'{BENCH_SKU_PREFIX}{i:05d}',
+                is_taxable=bool(i % 2),
+            )
+            for i in range(product_count)
+        ])
+        products = list(Product.objects.filter(sku__startswith=BENCH_SKU_PREFIX).order_by('id'))
+        # Benchmark cashiers have no location: their checkouts deduct the default location's stock
+        location = Location.get_default()
+        Inventory.objects.bulk_create([
+            Inventory(location=location, product=product, quantity=1_000_000, low_stock_threshold=10,
+                      last_restocked=timezone.now())
+            for product in products
+        ])
+        inventory_ids = list(
+            Inventory.objects.filter(product__sku__startswith=BENCH_SKU_PREFIX).values_list('id', flat=True)
+        )
+
+        cashiers = []
+        for i in range(client_count):
+            user = User.objects.create_user(
+                username=f'{BENCH_PREFIX}cashier{i}',
+                email=f'{BENCH_PREFIX}cashier{i}@bench.local',
+                password=BENCH_PASSWORD,
+                role='CASHIER',
+                is_verified=True,
+            )
+            cashiers.append({'username': user.username, 'token': str(RefreshToken.for_user(user).access_token)})
+
+        admin = User.objects.create_user(
+            username=f'{BENCH_PREFIX}admin',
+            email=f'{BENCH_PREFIX}admin@bench.local',
+            password=BENCH_PASSWORD,
+            role='ADMIN',
+            is_verified=True,
+        )
+
+        return {
+            'products': [
+                {'id': p.id, 'sku': p.sku, 'name': p.name, 'base_price': str(p.base_price), 'is_taxable': p.is_taxable}
+                for p in products
+            ],
+            'inventory_ids': inventory_ids,
+            'cashiers': cashiers,
+            'admin_token': str(RefreshToken.for_user(admin).access_token),
+        }
+
+    def _delete_dataset(self):
+        Transaction.objects.filter(cashier__username__startswith=BENCH_PREFIX).delete()
+        Product.objects.filter(sku__startswith=BENCH_SKU_PREFIX).delete()
+        Category.objects.filter(name__startswith=BENCH_PREFIX).delete()
+        User.objects.filter(username__startswith=BENCH_PREFIX).delete()
+
+    # Requests
+
+    def _build_request(self, flow, dataset, client_index, state):
+        """Return (method, path, payload, token, idempotency key) for one request of the given flow"""
+        cashier = dataset['cashiers'][client_index]
+        product = random.choice(dataset['products'])
+
+        if flow == 'login':
+            return 'post', '/api/auth/login/', {'username': cashier['username'], 'password': BENCH_PASSWORD}, None, None
+        if flow == 'product_list':
+            page_count = max(1, len(dataset['products']) // settings.REST_FRAMEWORK.get('PAGE_SIZE', 10))
+            return 'get', f'/api/products/?page={random.randint(1, page_count)}', None, cashier['token'], None
+        if flow == 'product_search':
+            return 'get', f'/api/products/?search={product["sku"]}', None, cashier['token'], None
+        if flow == 'product_detail':
+            return 'get', f'/api/products/{product["id"]}/', None, cashier['token'], None
+        if flow == 'process_payment':
+            return 'post', '/api/transactions/process-payment/', self._payment_payload(dataset), cashier['token'], None
+        if flow == 'cart_quote':
+            items = [
+                {'product': {'id': random.choice(dataset['products'])['id']}, 'quantity': random.randint(1, 3)}
+                for _ in range(QUOTE_CART_LINES)
+            ]
+            return 'post', '/api/cart/quote/', {'cart_items': items}, cashier['token'], None
+        if flow == 'payment_retry_storm':
+            # Every client retries the same terminal's keyed payments, in the same order
+            key, payload = state.pop(0)
+            return 'post', '/api/transactions/process-payment/', payload, dataset['cashiers'][0]['token'], key
+        if flow == 'offline_bulk_upload':
+            sales = []
+            for _ in range(OFFLINE_BATCH_SIZE):
+                sale = self._payment_payload(dataset)
+                sale.update(client_id=f'bench-{uuid.uuid4().hex}', created_at=timezone.now().isoformat())
+                sales.append(sale)
+            return 'post', '/api/transactions/bulk-upload/', {'sales': sales}, cashier['token'], None
+        if flow == 'refund':
+            return 'post', f'/api/transactions/{state.pop()}/refund/', {}, cashier['token'], None
+        if flow == 'category_list':
+            return 'get', '/api/categories/', None, cashier['token'], None
+        if flow == 'transaction_history':
+            return 'get', '/api/transactions/', None, cashier['token'], None
+        if flow == 'transaction_detail':
+            return 'get', f'/api/transactions/{random.choice(state)}/', None, cashier['token'], None
+        if flow == 'inventory_restock':
+            inventory_id = random.choice(dataset['inventory_ids'])
+            return 'post', f'/api/inventory/{inventory_id}/restock/', {'quantity': 5}, dataset['admin_token'], None
+        raise CommandError(f'Unknown flow: {flow}')
+
+    def _payment_payload(self, dataset):
+        items = []
+        subtotal = tax = Decimal('0')
+        for product in random.sample(dataset['products'], min(3, len(dataset['products']))):
+            quantity = random.randint(1, 3)
+            line_total = Decimal(product['base_price']) * quantity
+            subtotal += line_total
+            if product['is_taxable']:
+                tax += line_total * Decimal('0.10')
+            items.append({
+                'product': {'id': product['id'], 'name': product['name'], 'sku': product['sku']},
+                'addons': [],
+                'quantity': quantity,
+                'subtotal': float(line_total),
+            })
+        # Same rule as api.pricing, which rejects totals that disagree with it
+        tax = tax.quantize(Decimal('0.01'), ROUND_HALF_UP)
+        total = subtotal + tax
+        return {
+            'cart_items': items,
+            'subtotal': float(subtotal),
+            'tax': float(tax),
+            'total': float(total),
+            'amount_paid': float(total + 10),
+            'payment_method': 'CASH',
+            'notes': 'benchmark',
+        }
+
+    def _encode_payload(self, path, payload):
+        if payload is None or not self._encrypts(path):
+            return payload
+        return {'encrypted_data': EncryptionService.encrypt_data(payload, self.encryption.encryption_key)}
+
+    def _decode_response(self, path, body):
+        data = json.loads(body) if body else None
+        if isinstance(data, dict) and data.get('encrypted') and self._encrypts(path):
+            return EncryptionService.decrypt_data(data['data'], self.encryption.encryption_key)
+        return data
+
+    def _encrypts(self, path):
+        return (self.encryption.encryption_enabled and
+                not EncryptionService.is_route_excluded(path, self.encryption.excluded_routes))
+
+    def _headers(self, token, idempotency_key=None):
+        headers = {}
+        if token:
+            headers['Authorization'] = f'Bearer {token}'
+        if idempotency_key:
+            headers['Idempotency-Key'] = idempotency_key
+        return {'headers': headers} if headers else {}
+
+    def _prepare_state(self, flow, dataset, client_index, iterations):
+        """Create untimed fixtures a flow consumes (e.g. transactions to refund)"""
+        if flow == 'payment_retry_storm':
+            return list(self.storm_requests)
+        if flow not in ('refund', 'transaction_detail'):
+            return []
+        client = Client(raise_request_exception=False)
+        token = dataset['cashiers'][client_index]['token']
+        path = '/api/transactions/process-payment/'
+        transaction_ids = []
+        for _ in range(iterations):
+            response = client.post(
+                path,
+                data=json.dumps(self._encode_payload(path, self._payment_payload(dataset))),
+                content_type='application/json',
+                **self._headers(token),
+            )
+            if response.status_code != 201:
+                raise CommandError(f'Could not prepare refund fixtures: HTTP {response.status_code}')
+            transaction_ids.append(self._decode_response(path, response.content)['transaction']['id'])
+        return transaction_ids
+
+    def _prepare_storm(self, dataset, iterations):
+        """Keyed payments that every client sends, plus the stock they should consume once"""
+        run_id = uuid.uuid4().hex[:12]
+        self.storm_requests = []
+        for index in range(iterations):
+            key = f'bench-{run_id}-{index}'
+            payload = self._payment_payload(dataset)
+            payload['notes'] = key
+            self.storm_requests.append((key, payload))
+        self.storm_stock = {
+            inventory_id: quantity
+            for inventory_id, (_, quantity) in _current_stock(
+                Inventory.objects.filter(product__sku__startswith=BENCH_SKU_PREFIX)
+            ).items()
+        }
+
+    def _verify_storm(self):
+        """Check that each key produced exactly one transaction and one stock deduction"""
+        keys = [key for key, _ in self.storm_requests]
+        counts = dict(
+            Transaction.objects.filter(notes__in=keys)
+            .values_list('notes').annotate(count=Count('id')).values_list('notes', 'count')
+        )
+        expected = {}
+        for _, payload in self.storm_requests:
+            for item in payload['cart_items']:
+                expected[item['product']['id']] = expected.get(item['product']['id'], 0) + item['quantity']
+        consumed = {}
+        for inventory_id, (product_id, quantity) in _current_stock(
+            Inventory.objects.filter(id__in=self.storm_stock)
+        ).items():
+            consumed[product_id] = consumed.get(product_id, 0) + self.storm_stock[inventory_id] - quantity
+
+        return {
+            'keys': len(keys),
+            'transactions': sum(counts.values()),
+            'missing_keys': sum(1 for key in keys if key not in counts),
+            'duplicated_keys': sum(1 for count in counts.values() if count > 1),
+            'stock_consistent': all(consumed.get(product_id, 0) == quantity
+                                    for product_id, quantity in expected.items()),
+        }
+
+    # Runners
+
+    def _run_flow_wsgi(self, flow, dataset, clients, iterations):
+        def worker(client_index):
+            state = self._prepare_state(flow, dataset, client_index, iterations)
+            client = Client(raise_request_exception=False)
+            samples = []
+            for _ in range(iterations):
+                method, path, payload, token, idempotency_key = self._build_request(flow, dataset, client_index, state)
+                kwargs = self._headers(token, idempotency_key)
+                if payload is not None:
+                    kwargs.update(data=json.dumps(self._encode_payload(path, payload)),
+                                  content_type='application/json')
+                counter = [0]
+                marker = _query_counter.set(counter)
+                started = time.perf_counter()
+                try:
+                    response = getattr(client, method)(path, **kwargs)
+                finally:
+                    elapsed = time.perf_counter() - started
+                    _query_counter.reset(marker)
+                samples.append((elapsed, counter[0], response.status_code))
+            return samples
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=clients) as pool:
+            per_client = list(pool.map(worker, range(clients)))
+        wall_time = time.perf_counter() - started
+        return [sample for samples in per_client for sample in samples], wall_time
+
+    async def _run_flow_asgi(self, flow, dataset, clients, iterations):
+        from asgiref.sync import sync_to_async
+
+        async def worker(client_index):
+            state = await sync_to_async(self._prepare_state)(flow, dataset, client_index, iterations)
+            client = AsyncClient(raise_request_exception=False)
+            samples = []
+            for _ in range(iterations):
+                method, path, payload, token, idempotency_key = self._build_request(flow, dataset, client_index, state)
+                kwargs = self._headers(token, idempotency_key)
+                if payload is not None:
+                    kwargs.update(data=json.dumps(self._encode_payload(path, payload)),
+                                  content_type='application/json')
+                counter = [0]
+                marker = _query_counter.set(counter)
+                started = time.perf_counter()
+                try:
+                    # Like ASGIHandler: sync code of each request gets its own thread
+                    async with ThreadSensitiveContext():
+                        response = await getattr(client, method)(path, **kwargs)
+                finally:
+                    elapsed = time.perf_counter() - started
+                    _query_counter.reset(marker)
+                samples.append((elapsed, counter[0], response.status_code))
+            return samples
+
+        started = time.perf_counter()
+        per_client = await asyncio.gather(*(worker(index) for index in range(clients)))
+        wall_time = time.perf_counter() - started
+        return [sample for samples in per_client for sample in samples], wall_time
+
+    # Reporting
+
+    def _summarize(self, samples, wall_time):
+        latencies = sorted(sample[0] * 1000 for sample in samples)
+        queries = [sample[1] for sample in samples]
+        errors = sum(1 for sample in samples if sample[2] >= 400)
+
+        def ms(value):
+            return round(value, 3) if value is not None else None
+
+        return {
+            'requests': len(samples),
+            'errors': errors,
+            'wall_time_s': round(wall_time, 3),
+            'throughput_rps': round(len(samples) / wall_time, 2) if wall_time else None,
+            'latency_ms': {
+                'mean': ms(sum(latencies) / len(latencies)) if latencies else None,
+                'p50': ms(percentile(latencies, 50)),
+                'p95': ms(percentile(latencies, 95)),
+                'p99': ms(percentile(latencies, 99)),
+                'max': ms(latencies[-1]) if latencies else None,
+            },
+            'queries_per_request': {
+                'mean': round(sum(queries) / len(queries), 2) if queries else None,
+                'max': max(queries) if queries else None,
+            },
+        }
+
+    def _git_commit(self):
+        try:
+            return subprocess.check_output(
+                ['git', 'rev-parse', '--short', 'HEAD'],
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                stderr=subprocess.DEVNULL,
+            ).decode().strip()
+        except Exception:
+            return None
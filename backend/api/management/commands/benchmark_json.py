@@ -0,0 +1,132 @@
+"""
+JSON rendering, parsing and response encryption cost on large responses
+
+Builds synthetic transaction list pages shaped like TransactionSerializer
+output (cart_items snapshots included) and reports as JSON, for the
+standard-library and orjson paths:
+
+- render: DRF's JSONRenderer vs FastJSONRenderer (bytes must be identical);
+- parse: DRF's JSONParser vs FastJSONParser (results must be equal);
+- encrypt: EncryptionMiddleware's former parse, re-encode and encrypt of a
+  response body vs encrypting the rendered bytes directly.
+"""
+import io
+import json
+import random
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from api.encryption import EncryptionService
+from api.parsers import FastJSONParser
+from api.renderers import FastJSONRenderer
+
+PASSPHRASE = 'benchmark-json-key'
+
+
+def _cart_line(line_id):
+    price = round(random.uniform(1, 80), 2)
+    quantity = random.randint(1, 4)
+    return {
+        'id': line_id,
+        'product': {'id': random.randint(1, 5000), 'name': f'Product {line_id} – “deluxe”', 'sku': f'SKU-{line_id:06d}',
+                    'base_price': f'{price:.2f}', 'category_name': 'Beverages'},
+        'variant': {'id': random.randint(1, 20000), 'name': 'Large', 'price_adjustment': '0.50'}
+        if random.random() < 0.4 else None,
+        'addons': [{'id': random.randint(1, 200), 'name': 'Extra shot', 'price': '0.75'}]
+        if random.random() < 0.3 else [],
+        'quantity': quantity,
+        'price': price,
+        'subtotal': round(price * quantity, 2),
+    }
+
+
+def _page(rows, lines):
+    now = timezone.now()
+    results = []
+    for i in range(rows):
+        created = (now - timedelta(minutes=i)).isoformat().replace('+00:00', 'Z')
+        results.append({
+            'id': i + 1,
+            'transaction_number': f'TXN-{now:%Y%m%d}-{i:06d}',
+            'cashier': 3,
+            'cashier_name': 'cashier',
+            'cart_items': [_cart_line(i * lines + j) for j in range(lines)],
+            'subtotal': '412.50',
+            'tax': '49.50',
+            'total': '462.00',
+            'amount_paid': '500.00',
+            'change_given': '38.00',
+            'payment_method': 'CASH',
+            'status': 'COMPLETED',
+            'notes': '',
+            'refunds': [],
+            'client_id': None,
+            'created_at': created,
+            'updated_at': created,
+        })
+    return {'count': rows * 10, 'next': 'http://testserver/api/transactions/?page=2', 'previous': None,
+            'results': results}
+
+
+def _timed(function, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    return (time.perf_counter() - start) * 1000 / iterations
+
+
+def _legacy_encrypt(body):
+    """EncryptionMiddleware before orjson: parse the body, re-encode it with json, encrypt"""
+    plaintext = json.dumps(json.loads(body.decode('utf-8'))).encode('utf-8')
+    return EncryptionService.encrypt_bytes(plaintext, PASSPHRASE)
+
+
+class Command(BaseCommand):
+    help = 'Compare standard-library and orjson JSON rendering, parsing and response encryption'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', default='10,100,500',
+                            help='Comma-separated transactions per page to measure')
+        parser.add_argument('--lines', type=int, default=8,
+                            help='Cart lines per transaction')
+        parser.add_argument('--iterations', type=int, default=50)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+        iterations = options['iterations']
+        stdlib_renderer, fast_renderer = JSONRenderer(), FastJSONRenderer()
+        stdlib_parser, fast_parser = JSONParser(), FastJSONParser()
+        results = {}
+        for rows in [int(size) for size in options['rows'].split(',')]:
+            page = _page(rows, options['lines'])
+            body = stdlib_renderer.render(page)
+            if fast_renderer.render(page) != body:
+                raise CommandError(f'{rows} rows: FastJSONRenderer output differs from JSONRenderer')
+            if fast_parser.parse(io.BytesIO(body)) != stdlib_parser.parse(io.BytesIO(body)):
+                raise CommandError(f'{rows} rows: FastJSONParser result differs from JSONParser')
+            if EncryptionService.decrypt_data(EncryptionService.encrypt_bytes(body, PASSPHRASE), PASSPHRASE) != page:
+                raise CommandError(f'{rows} rows: encrypted body does not round-trip')
+
+            timings = {
+                'render': (_timed(lambda: stdlib_renderer.render(page), iterations),
+                           _timed(lambda: fast_renderer.render(page), iterations)),
+                'parse': (_timed(lambda: stdlib_parser.parse(io.BytesIO(body)), iterations),
+                          _timed(lambda: fast_parser.parse(io.BytesIO(body)), iterations)),
+                'encrypt': (_timed(lambda: _legacy_encrypt(body), iterations),
+                            _timed(lambda: EncryptionService.encrypt_bytes(body, PASSPHRASE), iterations)),
+            }
+            results[f'{rows}_rows'] = {'bytes': len(body)}
+            for name, (stdlib_ms, fast_ms) in timings.items():
+                results[f'{rows}_rows'][name] = {
+                    'stdlib_ms': round(stdlib_ms, 3),
+                    'orjson_ms': round(fast_ms, 3),
+                    'speedup': round(stdlib_ms / fast_ms, 2),
+                }
+
+        self.stdout.write(json.dumps(results, indent=2))
@@ -0,0 +1,95 @@
+"""
+Payload size and decode throughput of checkout QR codes, legacy vs compact
+
+Builds synthetic carts shaped like CartService.generateCheckoutQR output,
+encodes each in the legacy CryptoJS JSON format and both compact
+CartQRCodec text encodings, and reports as JSON:
+
+- characters of QR text and the data bits a QR code needs for them
+  (byte mode for base64 text, alphanumeric mode for base45);
+- decodes per second, including decryption.
+"""
+import json
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.encryption import CartQRCodec, EncryptionService
+
+
+PASSPHRASE = 'benchmark-cart-qr-key'
+
+# Data bits per character in the QR encoding mode each text form uses
+QR_BITS_PER_CHAR = {'legacy': 8, 'base45': 5.5, 'base64url': 8}
+
+
+def _legacy_cart(items):
+    """The customer app's legacy payload: names, SKUs and subtotals included"""
+    return {
+        'items': [
+            dict(item, productName=f'Product {item["productId"]}', productSku=f'SKU-{item["productId"]:06d}',
+                 variantName='Large' if item['variantId'] else None, subtotal=round(random.uniform(1, 50), 2))
+            for item in items
+        ],
+        'total': round(random.uniform(10, 500), 2),
+        'itemCount': sum(item['quantity'] for item in items),
+        'timestamp': int(time.time() * 1000),
+    }
+
+
+def _items(count):
+    return [
+        {
+            'productId': random.randint(1, 5000),
+            'variantId': random.randint(1, 20000) if random.random() < 0.4 else None,
+            'addonIds': random.sample(range(1, 200), random.choice([0, 0, 1, 2])),
+            'quantity': random.randint(1, 5),
+        }
+        for _ in range(count)
+    ]
+
+
+class Command(BaseCommand):
+    help = 'Measure checkout QR payload size and decode throughput (legacy vs compact)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', default='1,5,15,30',
+                            help='Comma-separated cart sizes to measure')
+        parser.add_argument('--iterations', type=int, default=2000,
+                            help='Decodes timed per format and cart size')
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+        results = {}
+        for count in [int(size) for size in options['items'].split(',')]:
+            cart = _legacy_cart(_items(count))
+            encoded = {
+                'legacy': EncryptionService.encrypt_data(cart, PASSPHRASE),
+                'base45': CartQRCodec.encode(cart, PASSPHRASE, text='base45'),
+                'base64url': CartQRCodec.encode(cart, PASSPHRASE, text='base64url'),
+            }
+
+            sizes = {}
+            for name, text in encoded.items():
+                decoded = CartQRCodec.decode(text, PASSPHRASE)
+                assert [item['productId'] for item in decoded['items']] == [item['productId'] for item in cart['items']]
+
+                start = time.perf_counter()
+                for _ in range(options['iterations']):
+                    CartQRCodec.decode(text, PASSPHRASE)
+                elapsed = time.perf_counter() - start
+
+                sizes[name] = {
+                    'chars': len(text),
+                    'qr_data_bits': int(len(text) * QR_BITS_PER_CHAR[name]),
+                    'decodes_per_sec': round(options['iterations'] / elapsed),
+                }
+            for name in ('base45', 'base64url'):
+                sizes[name]['qr_bits_vs_legacy'] = round(
+                    sizes[name]['qr_data_bits'] / sizes['legacy']['qr_data_bits'], 3
+                )
+            results[f'{count}_items'] = sizes
+
+        self.stdout.write(json.dumps(results, indent=2))
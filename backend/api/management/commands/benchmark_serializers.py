@@ -0,0 +1,102 @@
+"""
+Equivalence and CPU cost of the values()-based list serializers
+
+For each list endpoint with a RowSerializer, renders the same rows with the
+ModelSerializer (model instances plus the viewset's prefetches) and with the
+RowSerializer (values() rows), fails if the JSON bytes differ, and reports as
+JSON the wall and process CPU time per page for both paths.
+
+Run it against a seeded database (seed_all, or the benchmark_api dataset);
+the more rows, transactions with refunds and images, the better the check.
+"""
+import json
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from api.views_products import InventoryViewSet, ProductViewSet
+from api.views_transactions import TransactionViewSet
+
+User = get_user_model()
+
+# (name, ViewSet, list URL)
+ENDPOINTS = [
+    ('products', ProductViewSet, '/api/products/'),
+    ('inventory', InventoryViewSet, '/api/inventory/'),
+    ('transactions', TransactionViewSet, '/api/transactions/'),
+]
+
+
+def _view(viewset_class, path):
+    """A list-action ViewSet instance for an (unsaved) Super Admin"""
+    request = APIRequestFactory().get(path)
+    user = User(username='benchmark', role='SUPER_ADMIN')
+    force_authenticate(request, user=user)
+    drf_request = Request(request)
+    drf_request.user = user
+    return viewset_class(request=drf_request, action='list', args=(), kwargs={}, format_kwarg=None)
+
+
+def _timed(render, iterations):
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    for _ in range(iterations):
+        render()
+    return (
+        (time.perf_counter() - wall) * 1000 / iterations,
+        (time.process_time() - cpu) * 1000 / iterations,
+    )
+
+
+class Command(BaseCommand):
+    help = 'Check and time values()-based list serialization against the ModelSerializers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100,
+                            help='Rows per rendered page')
+        parser.add_argument('--iterations', type=int, default=50,
+                            help='Pages rendered per path and endpoint')
+
+    def handle(self, *args, **options):
+        rows, iterations = options['rows'], options['iterations']
+        renderer = JSONRenderer()
+        results = {}
+        for name, viewset_class, path in ENDPOINTS:
+            view = _view(viewset_class, path)
+            queryset = view.filter_queryset(view.get_queryset())
+            row_serializer = view.row_serializer_class(view.get_serializer_context())
+
+            def render_models():
+                return renderer.render(view.get_serializer(list(queryset[:rows]), many=True).data)
+
+            def render_rows():
+                return renderer.render(row_serializer.serialize(row_serializer.values(queryset)[:rows]))
+
+            expected, actual = render_models(), render_rows()
+            if expected != actual:
+                for expected_item, actual_item in zip(json.loads(expected), json.loads(actual)):
+                    if expected_item != actual_item:
+                        raise CommandError(
+                            f'{name}: row serializer output differs\n'
+                            f'  model: {json.dumps(expected_item, sort_keys=True)}\n'
+                            f'  rows:  {json.dumps(actual_item, sort_keys=True)}'
+                        )
+                raise CommandError(f'{name}: row serializer output differs')
+
+            model_wall, model_cpu = _timed(render_models, iterations)
+            row_wall, row_cpu = _timed(render_rows, iterations)
+            results[name] = {
+                'rows': len(json.loads(expected)),
+                'identical': True,
+                'model_ms': round(model_wall, 3),
+                'model_cpu_ms': round(model_cpu, 3),
+                'rows_ms': round(row_wall, 3),
+                'rows_cpu_ms': round(row_cpu, 3),
+                'cpu_speedup': round(model_cpu / row_cpu, 2) if row_cpu else None,
+            }
+
+        self.stdout.write(json.dumps(results, indent=2))
@@ -0,0 +1,55 @@
+import os
+import time
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from api.media import _media_models, get_config, referenced_names
+
+
+class Command(BaseCommand):
+    help = 'Delete product/category media files (and derivatives) that no row references (api.media)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only list the files that would be deleted')
+        parser.add_argument('--grace', type=int, default=None,
+                            help='Keep files modified less than this many seconds ago '
+                                 '(default: MEDIA_STORAGE GC_GRACE_SECONDS)')
+
+    def handle(self, *args, **options):
+        grace = get_config()['GC_GRACE_SECONDS'] if options['grace'] is None else options['grace']
+        # Listed before the references are read: a file saved meanwhile is too recent to delete
+        directories = sorted({model._meta.get_field('image').upload_to.strip('/') for model in _media_models()})
+        candidates = []
+        for directory in directories:
+            root = default_storage.path(directory)
+            for dirpath, _, filenames in os.walk(root):
+                for filename in filenames:
+                    path = os.path.join(dirpath, filename)
+                    name = os.path.relpath(path, default_storage.location).replace(os.sep, '/')
+                    candidates.append((name, path))
+
+        referenced = referenced_names()
+        now = time.time()
+        deleted = freed = 0
+        for name, path in candidates:
+            if name in referenced:
+                continue
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            if now - stat.st_mtime < grace:
+                continue
+            if options['dry_run']:
+                self.stdout.write(name)
+            else:
+                default_storage.delete(name)
+            deleted += 1
+            freed += stat.st_size
+
+        verb = 'Would delete' if options['dry_run'] else 'Deleted'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} {deleted} of {len(candidates)} file(s), {freed / 1024:.0f} KiB'
+        ))
@@ -0,0 +1,17 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api import ledger
+
+
+class Command(BaseCommand):
+    help = 'Checkpoint inventory records with ledger movements since their last checkpoint (api.ledger)'
+
+    def handle(self, *args, **options):
+        start = time.monotonic()
+        checkpoints = ledger.compact()
+        mode = 'deferred' if ledger.is_deferred() else 'immediate'
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {checkpoints} checkpoint(s) in {time.monotonic() - start:.1f}s ({mode} mode)'
+        ))
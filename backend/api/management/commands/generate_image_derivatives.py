@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.images import available_formats, generate
+from api.models import Category, Product
+
+MODELS = {'products': Product, 'categories': Category}
+
+
+class Command(BaseCommand):
+    help = 'Render resized image derivatives of products and categories missing them (api.images)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', choices=sorted(MODELS), action='append',
+                            help='Only this model (repeatable); default: all')
+        parser.add_argument('--force', action='store_true',
+                            help='Regenerate derivatives that are already up to date')
+        parser.add_argument('--sleep', type=float, default=0.0,
+                            help='Seconds to pause between images to limit load')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'Formats: {", ".join(available_formats())}')
+        for label in options['model'] or sorted(MODELS):
+            model = MODELS[label]
+            generated = 0
+            start = time.monotonic()
+            # Every row: generate() skips up-to-date ones and clears those whose image was removed
+            for pk in model.objects.order_by('pk').values_list('pk', flat=True).iterator():
+                if generate(model, pk, force=options['force']):
+                    generated += 1
+                    if options['sleep']:
+                        time.sleep(options['sleep'])
+            self.stdout.write(self.style.SUCCESS(
+                f'{label}: derivatives updated for {generated} row(s) in {time.monotonic() - start:.1f}s'
+            ))
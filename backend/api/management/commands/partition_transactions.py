@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.partitions import PartitionError, convert, ensure_partitions, get_config, is_partitioned, partitions
+
+
+class Command(BaseCommand):
+    help = 'Create the coming monthly partitions of the transactions table (PostgreSQL, api.partitions)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--convert', action='store_true',
+                            help='One-time: rebuild the unpartitioned table as a partitioned one '
+                                 '(locks transactions until done; run in a maintenance window)')
+        parser.add_argument('--months-ahead', type=int, default=None,
+                            help='Months after the current one to create partitions for '
+                                 '(default: TRANSACTION_PARTITIONS MONTHS_AHEAD)')
+        parser.add_argument('--database', default='default',
+                            help='Database alias')
+
+    def handle(self, *args, **options):
+        months_ahead = options['months_ahead']
+        if months_ahead is None:
+            months_ahead = get_config()['MONTHS_AHEAD']
+        using = options['database']
+
+        if options['convert']:
+            try:
+                created = convert(months_ahead, using=using)
+            except PartitionError as e:
+                raise CommandError(str(e))
+            self.stdout.write(self.style.SUCCESS(f'Partitioned transactions into {len(created)} monthly partition(s)'))
+            return
+
+        if not is_partitioned(using):
+            raise CommandError('transactions is not partitioned (PostgreSQL only); run with --convert first')
+        created = ensure_partitions(months_ahead, using=using)
+        for name in created:
+            self.stdout.write(f'Created {name}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {len(created)} partition(s); {len(partitions(using))} monthly partition(s) in total'
+        ))
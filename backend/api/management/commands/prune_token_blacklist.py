@@ -0,0 +1,56 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.utils import aware_utcnow
+
+
+class Command(BaseCommand):
+    help = 'Delete expired outstanding and blacklisted JWT refresh tokens in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='Tokens deleted per transaction')
+        parser.add_argument('--grace-hours', type=int, default=1,
+                            help='Keep tokens for this long after they expire')
+        parser.add_argument('--sleep', type=float, default=0.0,
+                            help='Seconds to pause between batches to limit database load')
+        parser.add_argument('--max-batches', type=int, default=0,
+                            help='Stop after this many batches (0 = until done)')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only count the tokens that would be deleted')
+
+    def handle(self, *args, **options):
+        cutoff = aware_utcnow() - timedelta(hours=options['grace_hours'])
+        expired = OutstandingToken.objects.filter(expires_at__lt=cutoff)
+
+        if options['dry_run']:
+            self.stdout.write(
+                f'{expired.count()} expired outstanding token(s), '
+                f'{BlacklistedToken.objects.filter(token__expires_at__lt=cutoff).count()} blacklisted, '
+                f'would be deleted'
+            )
+            return
+
+        outstanding_deleted = blacklisted_deleted = batches = 0
+        while not options['max_batches'] or batches < options['max_batches']:
+            # Walking the primary key keeps each batch an index range scan:
+            # tokens are inserted roughly in expiry order
+            ids = list(expired.order_by('id').values_list('id', flat=True)[:options['batch_size']])
+            if not ids:
+                break
+
+            with transaction.atomic():
+                blacklisted_deleted += BlacklistedToken.objects.filter(token_id__in=ids).delete()[0]
+                outstanding_deleted += OutstandingToken.objects.filter(id__in=ids).delete()[0]
+            batches += 1
+
+            if options['sleep']:
+                time.sleep(options['sleep'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Deleted {outstanding_deleted} outstanding and {blacklisted_deleted} blacklisted token(s) '
+            f'in {batches} batch(es)'
+        ))
@@ -0,0 +1,35 @@
+import signal
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.tasks import Worker
+
+
+class Command(BaseCommand):
+    help = 'Run queued background tasks (api.tasks) until stopped with SIGINT/SIGTERM'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=None,
+                            help='Tasks run at a time (default: TASK_QUEUE CONCURRENCY)')
+        parser.add_argument('--poll-interval', type=float, default=None,
+                            help='Seconds to wait between looks for due tasks when idle '
+                                 '(default: TASK_QUEUE POLL_INTERVAL)')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit as soon as no task is due (cron, deploy hooks)')
+
+    def handle(self, *args, **options):
+        if options['concurrency'] is not None and options['concurrency'] < 1:
+            raise CommandError('--concurrency must be at least 1')
+        worker = Worker(options['concurrency'], options['poll_interval'])
+
+        # Finish the running tasks, then exit
+        def stop(signum, frame):
+            worker.stop()
+        signal.signal(signal.SIGINT, stop)
+        signal.signal(signal.SIGTERM, stop)
+
+        if not options['once']:
+            self.stdout.write(f'Worker {worker.name} running {worker.concurrency} task(s) at a time')
+        counts = worker.run(once=options['once'])
+        summary = ', '.join(f'{count} {status.lower()}' for status, count in sorted(counts.items())) or 'none'
+        self.stdout.write(self.style.SUCCESS(f'Ran {sum(counts.values())} task attempt(s): {summary}'))
@@ -1,5 +1,5 @@
 from django.core.management.base import BaseCommand
-from api.models import Product, Variant, Inventory
+from api.models import Product, Variant, Inventory, Location
 from django.utils import timezone
 import random
 
@@ -13,6 +13,9 @@ class Command(BaseCommand):
         
         created_count = 0
         
+        # Seeded stock belongs to the default location
+        location = Location.get_default()
+        
         # Get all products
         products = Product.objects.all()
         
@@ -29,6 +32,7 @@ class Command(BaseCommand):
                     low_stock_threshold = random.randint(5, 20)
                     
                     inventory = Inventory.objects.create(
+                        location=location,
                         product=product,
                         variant=variant,
                         quantity=quantity,
@@ -57,6 +61,7 @@ class Command(BaseCommand):
                 low_stock_threshold = random.randint(10, 30)
                 
                 inventory = Inventory.objects.create(
+                    location=location,
                     product=product,
                     variant=None,
                     quantity=quantity,
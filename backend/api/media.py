@@ -0,0 +1,182 @@
+"""
+Content-addressed media storage and garbage collection of replaced uploads
+
+ContentAddressedStorage names every saved file after the SHA-256 of its
+content, so ``products/photo.JPG`` is stored as ``products/<sha256>.jpg``.
+Identical uploads (the same photo on several products, a re-upload) share
+one file. Because a name never changes content, the media view
+(views_media.serve_media) can serve these names as immutable for a year.
+
+Files are shared, so a replaced or deleted image is only removed when no
+product or category still references it through ``image`` or
+``image_variants`` (api.images derivatives). Files written or re-saved less
+than GC_GRACE_SECONDS ago are kept: their row may not have committed yet.
+``manage.py collect_media_garbage`` sweeps whatever this leaves behind.
+"""
+import hashlib
+import logging
+import mimetypes
+import os
+import posixpath
+import secrets
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.db import transaction
+from django.db.models import Q
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'CONTENT_ADDRESSED': True,
+    # Serve MEDIA_URL through views_media.serve_media (development, single host)
+    'SERVE': False,
+    # Cache lifetime of content-addressed files
+    'MAX_AGE': 365 * 24 * 3600,
+    # Delete files of replaced/deleted images that nothing references anymore
+    'GC': True,
+    'GC_GRACE_SECONDS': 300,
+}
+
+# (app label, model) pairs whose ``image`` and ``image_variants`` reference media files
+MEDIA_MODELS = [('api', 'Product'), ('api', 'Category')]
+
+HASH_LENGTH = hashlib.sha256().digest_size * 2
+
+
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'MEDIA_STORAGE', {}))
+    return config
+
+
+def is_content_addressed(name):
+    """Whether the file ``name`` is named after its content (never changes)"""
+    stem = os.path.splitext(posixpath.basename(name))[0]
+    return len(stem) == HASH_LENGTH and all(c in '0123456789abcdef' for c in stem)
+
+
+def _canonical_extension(name):
+    """One extension per type (``.JPG``, ``.jpeg`` -> ``.jpg``) so identical content gets one name"""
+    extension = os.path.splitext(name)[1].lower()
+    content_type = mimetypes.guess_type(name)[0]
+    return (mimetypes.guess_extension(content_type) if content_type else None) or extension
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    FileSystemStorage storing each file as ``<directory>/<sha256><extension>``;
+    saving content already stored returns the existing name
+    """
+
+    def get_available_name(self, name, max_length=None):
+        # The final name is derived from the content in _save and is never suffixed
+        return name
+
+    def _save(self, name, content):
+        directory = posixpath.dirname(name)
+        extension = _canonical_extension(name)
+        full_directory = self.path(directory)
+        os.makedirs(full_directory, exist_ok=True)
+
+        # Hash while writing a temporary file next to the target, then move it into place
+        temp_path = os.path.join(full_directory, f'.upload-{secrets.token_hex(8)}')
+        digest = hashlib.sha256()
+        fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0), 0o666)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in content.chunks():
+                    if isinstance(chunk, str):
+                        chunk = chunk.encode()
+                    digest.update(chunk)
+                    f.write(chunk)
+            name = posixpath.join(directory, digest.hexdigest() + extension)
+            full_path = self.path(name)
+            if os.path.exists(full_path):
+                # Already stored; the fresh mtime keeps GC off it until this save commits
+                os.utime(full_path)
+            else:
+                if self.file_permissions_mode is not None:
+                    os.chmod(temp_path, self.file_permissions_mode)
+                # Atomic; a concurrent save of the same content writes identical bytes
+                os.replace(temp_path, full_path)
+                temp_path = None
+        finally:
+            if temp_path is not None:
+                os.unlink(temp_path)
+        return name
+
+
+def _media_models():
+    return [apps.get_model(app_label, model_name) for app_label, model_name in MEDIA_MODELS]
+
+
+def is_referenced(name):
+    """Whether any product or category image (or derivative) is ``name``"""
+    return any(
+        model.objects.filter(Q(image=name) | Q(image_variants__sizes__icontains=name)).exists()
+        for model in _media_models()
+    )
+
+
+def referenced_names():
+    """Every storage name referenced by a product or category"""
+    from .images import derived_names
+
+    names = set()
+    for model in _media_models():
+        for image, variants in model.objects.values_list('image', 'image_variants').iterator():
+            if image:
+                names.add(image)
+            names.update(derived_names(variants))
+    return names
+
+
+def _recently_written(name, storage, grace):
+    try:
+        return time.time() - os.path.getmtime(storage.path(name)) < grace
+    except NotImplementedError:
+        # Not a local filesystem: no mtime to go by, so keep it
+        return True
+    except OSError:
+        return False
+
+
+def delete_unreferenced(names, storage=default_storage):
+    """Delete the files ``names`` that nothing references; returns those deleted"""
+    config = get_config()
+    deleted = []
+    for name in set(names):
+        if not name or is_referenced(name) or _recently_written(name, storage, config['GC_GRACE_SECONDS']):
+            continue
+        try:
+            storage.delete(name)
+        except OSError:
+            logger.warning('Could not delete media file %s', name, exc_info=True)
+        else:
+            deleted.append(name)
+    return deleted
+
+
+def remember_previous_image(sender, instance, raw=False, update_fields=None, **kwargs):
+    """pre_save receiver for Product and Category"""
+    if instance.pk and not raw and (update_fields is None or 'image' in update_fields):
+        instance._media_previous_image = (
+            sender.objects.filter(pk=instance.pk).values_list('image', flat=True).first()
+        )
+
+
+def collect_replaced_image(sender, instance, **kwargs):
+    """post_save receiver for Product and Category"""
+    previous = instance.__dict__.pop('_media_previous_image', None)
+    if previous and previous != (instance.image.name or ''):
+        transaction.on_commit(lambda: delete_unreferenced([previous]))
+
+
+def collect_deleted_image(sender, instance, **kwargs):
+    """post_delete receiver for Product and Category"""
+    name = instance.image.name
+    if name:
+        transaction.on_commit(lambda: delete_unreferenced([name]))
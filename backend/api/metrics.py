@@ -0,0 +1,205 @@
+"""
+Request-level performance metrics
+
+Collects per-request timings (database, serialization, rendering, encryption)
+into a context-local RequestMetrics object and aggregates them into per-route
+histograms that can be exported in the Prometheus text format.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+
+# Upper bounds (seconds) for phase duration histograms
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# Upper bounds for the number of SQL queries issued by a request
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+_current_metrics = ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    """Timings collected while handling a single request"""
+
+    __slots__ = ('started', 'queries', 'db_time', 'phases', '_active')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.phases = {}
+        self._active = set()
+
+    def add(self, phase, seconds):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+
+def current_metrics():
+    """Return the RequestMetrics of the request being handled, if any"""
+    return _current_metrics.get()
+
+
+@contextmanager
+def collect_metrics():
+    """Bind a fresh RequestMetrics to the current context for the duration of the block"""
+    metrics = RequestMetrics()
+    token = _current_metrics.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _current_metrics.reset(token)
+
+
+@contextmanager
+def timed(phase):
+    """
+    Add the duration of the block to ``phase`` of the current request.
+    Nested blocks of the same phase are only counted once.
+    """
+    metrics = _current_metrics.get()
+    if metrics is None or phase in metrics._active:
+        yield
+        return
+
+    metrics._active.add(phase)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.add(phase, time.perf_counter() - started)
+        metrics._active.discard(phase)
+
+
+def record_query(execute, sql, params, many, context):
+    """Database execute wrapper counting queries and their duration"""
+    metrics = _current_metrics.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.queries += 1
+        metrics.db_time += time.perf_counter() - started
+
+
+def install_query_hook(sender=None, connection=None, **kwargs):
+    """connection_created receiver attaching record_query to every new connection"""
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class Histogram:
+    """Cumulative histogram with fixed bucket bounds"""
+
+    __slots__ = ('bounds', 'counts', 'total', 'count')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * len(bounds)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.bounds):
+            if value <= bound:
+                self.counts[i] += 1
+        self.total += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """Process-wide aggregation of request metrics keyed by route"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._durations = {}
+        self._query_counts = {}
+        self._requests = {}
+        self._collectors = []
+
+    def register_collector(self, collector):
+        """
+        Add metrics computed at scrape time: ``collector()`` returns
+        (name, type, help, [(labels, value), ...]) tuples
+        """
+        if collector not in self._collectors:
+            self._collectors.append(collector)
+
+    def observe_request(self, route, method, status_code, metrics, phases):
+        with self._lock:
+            for phase, seconds in phases.items():
+                key = (route, phase)
+                histogram = self._durations.get(key)
+                if histogram is None:
+                    histogram = self._durations[key] = Histogram(DURATION_BUCKETS)
+                histogram.observe(seconds)
+
+            histogram = self._query_counts.get(route)
+            if histogram is None:
+                histogram = self._query_counts[route] = Histogram(QUERY_COUNT_BUCKETS)
+            histogram.observe(metrics.queries)
+
+            key = (route, method, str(status_code))
+            self._requests[key] = self._requests.get(key, 0) + 1
+
+    def reset(self):
+        with self._lock:
+            self._durations.clear()
+            self._query_counts.clear()
+            self._requests.clear()
+
+    def render_prometheus(self):
+        """Render all metrics in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            lines.append('# HELP pos_requests_total Requests handled, by route, method and status')
+            lines.append('# TYPE pos_requests_total counter')
+            for (route, method, status_code), count in sorted(self._requests.items()):
+                labels = _labels(route=route, method=method, status=status_code)
+                lines.append(f'pos_requests_total{{{labels}}} {count}')
+
+            lines.append('# HELP pos_request_phase_seconds Time spent per request phase')
+            lines.append('# TYPE pos_request_phase_seconds histogram')
+            for (route, phase), histogram in sorted(self._durations.items()):
+                _render_histogram(lines, 'pos_request_phase_seconds', histogram, route=route, phase=phase)
+
+            lines.append('# HELP pos_request_db_queries SQL queries issued per request')
+            lines.append('# TYPE pos_request_db_queries histogram')
+            for route, histogram in sorted(self._query_counts.items()):
+                _render_histogram(lines, 'pos_request_db_queries', histogram, route=route)
+
+        for collector in self._collectors:
+            for name, metric_type, help_text, samples in collector():
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} {metric_type}')
+                for labels, value in samples:
+                    lines.append(f'{name}{{{_labels(**labels)}}} {value}')
+
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels):
+    return ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items())
+
+
+def _render_histogram(lines, name, histogram, **labels):
+    base = _labels(**labels)
+    for bound, count in zip(histogram.bounds, histogram.counts):
+        lines.append(f'{name}_bucket{{{base},le="{bound}"}} {count}')
+    lines.append(f'{name}_bucket{{{base},le="+Inf"}} {histogram.count}')
+    lines.append(f'{name}_sum{{{base}}} {histogram.total}')
+    lines.append(f'{name}_count{{{base}}} {histogram.count}')
+
+
+registry = MetricsRegistry()
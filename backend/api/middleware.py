@@ -1,11 +1,183 @@
 """
 Middleware for automatic encryption/decryption of API payloads
+and per-request performance instrumentation
 """
-import json
+import logging
+import re
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.core.exceptions import MiddlewareNotUsed
 from django.utils.deprecation import MiddlewareMixin
 from django.http import JsonResponse
 from .models import EncryptionSettings
 from .encryption import EncryptionService
+from . import fast_json
+from .log import bind, log_context, new_request_id
+from .metrics import collect_metrics, current_metrics, registry, timed
+from .query_inspector import get_config as get_query_inspector_config, inspect_queries
+
+logger = logging.getLogger(__name__)
+request_logger = logging.getLogger('api.request')
+
+# Accept caller-supplied request ids only if they are short and harmless
+_REQUEST_ID = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+
+
+class PerformanceMiddleware:
+    """
+    Measure DB, serialization, rendering and encryption time per request.
+    Emits a Server-Timing header and feeds the per-route histograms
+    exposed on /api/metrics/. Must be the first middleware so that the
+    total includes the work of every other middleware.
+    
+    ``view`` is the view call itself as timed by ViewTimingMiddleware, less
+    the serialization and rendering done in it; ``middleware`` is what the
+    other middleware (encryption excluded) added around it.
+    
+    Also binds the request id and route to the log context and writes a
+    (sampled) access log record per request.
+    """
+    
+    sync_capable = True
+    async_capable = True
+    
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+    
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        
+        with log_context(request_id=self._request_id(request)) as context, collect_metrics() as metrics:
+            response = self.get_response(request)
+            total = metrics.elapsed()
+            return self._finish(request, response, metrics, total, context)
+    
+    async def __acall__(self, request):
+        with log_context(request_id=self._request_id(request)) as context, collect_metrics() as metrics:
+            response = await self.get_response(request)
+            total = metrics.elapsed()
+            return self._finish(request, response, metrics, total, context)
+    
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        bind(route=request.resolver_match.view_name)
+        return None
+    
+    @staticmethod
+    def _request_id(request):
+        request_id = request.headers.get('X-Request-ID', '')
+        return request_id if _REQUEST_ID.match(request_id) else new_request_id()
+    
+    def _finish(self, request, response, metrics, total, context):
+        phases = dict(metrics.phases)
+        phases['db'] = metrics.db_time
+        # No view time: answered by a middleware (cached response, CORS preflight)
+        view_call = phases.pop('view', 0.0)
+        phases['view'] = max(0.0, view_call - phases.get('serialize', 0.0) - phases.get('render', 0.0))
+        phases['middleware'] = max(0.0, total - view_call - phases.get('crypto', 0.0))
+        phases['total'] = total
+        
+        response['Server-Timing'] = self._server_timing(metrics, phases)
+        
+        match = getattr(request, 'resolver_match', None)
+        route = match.view_name if match else 'unmatched'
+        registry.observe_request(route, request.method, response.status_code, metrics, phases)
+        
+        response['X-Request-ID'] = context['request_id']
+        context['route'] = route
+        request_logger.log(
+            logging.ERROR if response.status_code >= 500 else logging.INFO,
+            '%s %s %s', request.method, request.path, response.status_code,
+            extra={
+                'method': request.method,
+                'status': response.status_code,
+                'duration_ms': round(total * 1000, 2),
+                'db_queries': metrics.queries,
+                'db_ms': round(metrics.db_time * 1000, 2),
+            },
+        )
+        
+        return response
+    
+    @staticmethod
+    def _server_timing(metrics, phases):
+        entries = []
+        for phase, seconds in phases.items():
+            entry = f'{phase};dur={seconds * 1000:.2f}'
+            if phase == 'db':
+                entry += f';desc="{metrics.queries} queries"'
+            entries.append(entry)
+        return ', '.join(entries)
+
+
+class ViewTimingMiddleware:
+    """
+    Time the view call for PerformanceMiddleware, from the last
+    process_view to the rendered response. Must be the last middleware, so
+    that no other middleware's work is counted.
+    """
+    
+    sync_capable = True
+    async_capable = True
+    
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+    
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        
+        response = self.get_response(request)
+        self._stop(request)
+        return response
+    
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        self._stop(request)
+        return response
+    
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._view_started = time.perf_counter()
+        return None
+    
+    @staticmethod
+    def _stop(request):
+        started = getattr(request, '_view_started', None)
+        metrics = current_metrics()
+        if started is not None and metrics is not None:
+            metrics.add('view', time.perf_counter() - started)
+
+
+class QueryInspectionMiddleware:
+    """
+    Flag N+1 patterns and slow queries per request (see api.query_inspector).
+    Removed from the middleware chain unless QUERY_INSPECTOR['ENABLED'] is set.
+    """
+    
+    sync_capable = True
+    async_capable = True
+    
+    def __init__(self, get_response):
+        if not get_query_inspector_config()['ENABLED']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+    
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        
+        with inspect_queries(label=f'{request.method} {request.path}'):
+            return self.get_response(request)
+    
+    async def __acall__(self, request):
+        with inspect_queries(label=f'{request.method} {request.path}'):
+            return await self.get_response(request)
 
 
 class EncryptionMiddleware(MiddlewareMixin):
@@ -36,21 +208,21 @@ class EncryptionMiddleware(MiddlewareMixin):
         if request.method in ['POST', 'PUT', 'PATCH'] and request.body:
             try:
                 # Parse request body
-                body_unicode = request.body.decode('utf-8')
-                body_data = json.loads(body_unicode)
+                body_data = fast_json.loads(request.body)
                 
                 # Check if data is encrypted (has 'encrypted_data' key)
                 if 'encrypted_data' in body_data:
                     encrypted_string = body_data['encrypted_data']
                     
                     # Decrypt data
-                    decrypted_data = EncryptionService.decrypt_data(
-                        encrypted_string, 
-                        settings.encryption_key
-                    )
+                    with timed('crypto'):
+                        decrypted_data = EncryptionService.decrypt_data(
+                            encrypted_string, 
+                            settings.encryption_key
+                        )
                     
                     # Replace request body with decrypted data
-                    request._body = json.dumps(decrypted_data).encode('utf-8')
+                    request._body = fast_json.dumps(decrypted_data)
                 else:
                     # If encryption is enabled but data is not encrypted, reject
                     return JsonResponse({
@@ -59,6 +231,7 @@ class EncryptionMiddleware(MiddlewareMixin):
                     }, status=400)
                     
             except Exception as e:
+                logger.warning('Request decryption failed: %s', e)
                 return JsonResponse({
                     'error': 'Decryption failed',
                     'detail': str(e)
@@ -91,14 +264,12 @@ class EncryptionMiddleware(MiddlewareMixin):
         if (response.status_code >= 200 and response.status_code < 300 and
             response.get('Content-Type', '').startswith('application/json')):
             try:
-                # Get response data
-                response_data = json.loads(response.content.decode('utf-8'))
-                
-                # Encrypt data
-                encrypted_string = EncryptionService.encrypt_data(
-                    response_data,
-                    settings.encryption_key
-                )
+                # Encrypt the rendered JSON as is (no parse and re-encode)
+                with timed('crypto'):
+                    encrypted_string = EncryptionService.encrypt_bytes(
+                        response.content,
+                        settings.encryption_key
+                    )
                 
                 # Create encrypted response
                 encrypted_response = JsonResponse({
@@ -108,8 +279,9 @@ class EncryptionMiddleware(MiddlewareMixin):
                 
                 return encrypted_response
                 
-            except Exception as e:
+            except Exception:
                 # If encryption fails, return original response
+                logger.exception('Response encryption failed')
                 return response
         
         return response
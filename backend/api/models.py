@@ -1,5 +1,7 @@
 from django.db import models
 from django.contrib.auth.models import AbstractUser
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
 
 # Create your models here.
 
@@ -78,6 +80,15 @@ class User(AbstractUser):
     phone_number = models.CharField(max_length=15, blank=True, null=True)
     address = models.TextField(blank=True, null=True)
     
+    location = models.ForeignKey(
+        'Location',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='users',
+        help_text='Store the user works at; their checkouts without a terminal deduct its stock'
+    )
+    
     class Meta:
         db_table = 'users'
         verbose_name = 'User'
@@ -99,12 +110,80 @@ class User(AbstractUser):
         return self.role == 'CASHIER'
 
 
+DEFAULT_LOCATION_CODE = 'MAIN'
+
+
+class Location(models.Model):
+    """Store or warehouse holding its own stock"""
+    
+    KIND_CHOICES = [
+        ('STORE', 'Store'),
+        ('WAREHOUSE', 'Warehouse'),
+    ]
+    
+    name = models.CharField(max_length=100)
+    code = models.CharField(max_length=20, unique=True, help_text='Short unique code, e.g. MAIN')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, default='STORE')
+    address = models.TextField(blank=True)
+    is_active = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        db_table = 'locations'
+        verbose_name = 'Location'
+        verbose_name_plural = 'Locations'
+        ordering = ['name']
+    
+    def __str__(self):
+        return f"{self.name} ({self.code})"
+    
+    @classmethod
+    def get_default(cls):
+        """Get or create the location of stock not assigned to any other"""
+        location, created = cls.objects.get_or_create(
+            code=DEFAULT_LOCATION_CODE,
+            defaults={'name': 'Main store'}
+        )
+        return location
+
+
+class Terminal(models.Model):
+    """Checkout terminal; its sales deduct the stock of its location"""
+    
+    code = models.CharField(
+        max_length=50,
+        unique=True,
+        help_text='Identifier the terminal sends in the X-Terminal header'
+    )
+    name = models.CharField(max_length=100)
+    location = models.ForeignKey(Location, on_delete=models.PROTECT, related_name='terminals')
+    is_active = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        db_table = 'terminals'
+        verbose_name = 'Terminal'
+        verbose_name_plural = 'Terminals'
+        ordering = ['location', 'name']
+    
+    def __str__(self):
+        return f"{self.name} ({self.code})"
+
+
 class Category(models.Model):
     """Product category model"""
     
     name = models.CharField(max_length=100, unique=True)
     description = models.TextField(blank=True)
     image = models.ImageField(upload_to='categories/', blank=True, null=True)
+    image_variants = models.JSONField(
+        default=dict,
+        blank=True,
+        editable=False,
+        help_text='Resized derivatives of image (api.images)'
+    )
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -127,6 +206,12 @@ class Product(models.Model):
     category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='products')
     base_price = models.DecimalField(max_digits=10, decimal_places=2)
     image = models.ImageField(upload_to='products/', blank=True, null=True)
+    image_variants = models.JSONField(
+        default=dict,
+        blank=True,
+        editable=False,
+        help_text='Resized derivatives of image (api.images)'
+    )
     sku = models.CharField(max_length=50, unique=True, help_text='Stock Keeping Unit')
     is_taxable = models.BooleanField(default=True, help_text='Whether VAT/tax applies')
     is_active = models.BooleanField(default=True)
@@ -206,8 +291,10 @@ class AddOn(models.Model):
 
 
 class Inventory(models.Model):
-    """Inventory tracking model"""
+    """Inventory tracking model (stock of one product/variant at one location)"""
     
+    # No model default: callers pass the location (Location.get_default() for the main store)
+    location = models.ForeignKey(Location, on_delete=models.PROTECT, related_name='inventories')
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='inventories')
     variant = models.ForeignKey(
         Variant, 
@@ -230,7 +317,12 @@ class Inventory(models.Model):
         db_table = 'inventory'
         verbose_name = 'Inventory'
         verbose_name_plural = 'Inventories'
-        unique_together = ['product', 'variant']
+        # Location first: each store's rows form their own range of the index
+        unique_together = ['location', 'product', 'variant']
+        indexes = [
+            # Cross-location availability of a product
+            models.Index(fields=['product', 'location']),
+        ]
     
     def __str__(self):
         variant_str = f" - {self.variant.name}" if self.variant else ""
@@ -247,6 +339,74 @@ class Inventory(models.Model):
         return self.quantity <= 0
 
 
+class InventoryCheckpoint(models.Model):
+    """Compacted stock of one inventory record (api.ledger)"""
+    
+    inventory = models.ForeignKey(Inventory, on_delete=models.CASCADE, related_name='checkpoints')
+    quantity = models.IntegerField(help_text='Stock including every movement stamped with this or an earlier checkpoint')
+    as_of = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        db_table = 'inventory_checkpoints'
+        verbose_name = 'Inventory Checkpoint'
+        verbose_name_plural = 'Inventory Checkpoints'
+        indexes = [models.Index(fields=['inventory', 'as_of'])]
+    
+    def __str__(self):
+        return f"{self.inventory_id} @ {self.as_of}: {self.quantity}"
+
+
+class InventoryMovement(models.Model):
+    """Append-only stock change of one inventory record (api.ledger)"""
+    
+    KIND_CHOICES = [
+        ('SALE', 'Sale'),
+        ('REFUND', 'Refund'),
+        ('EXCHANGE', 'Exchange'),
+        ('RESTOCK', 'Restock'),
+        ('ADJUSTMENT', 'Adjustment'),
+    ]
+    
+    inventory = models.ForeignKey(Inventory, on_delete=models.CASCADE, related_name='movements')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    quantity = models.IntegerField(help_text='Signed change in stock')
+    reference = models.CharField(
+        max_length=100,
+        blank=True,
+        help_text='Transaction/refund number or other origin of the change'
+    )
+    user = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='inventory_movements'
+    )
+    # Set by compaction; null while the movement is newer than the last checkpoint
+    checkpoint = models.ForeignKey(
+        InventoryCheckpoint,
+        on_delete=models.RESTRICT,
+        null=True,
+        blank=True,
+        related_name='movements'
+    )
+    created_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        db_table = 'inventory_movements'
+        verbose_name = 'Inventory Movement'
+        verbose_name_plural = 'Inventory Movements'
+        ordering = ['-created_at', '-id']
+        indexes = [
+            models.Index(fields=['inventory', 'created_at']),
+            models.Index(fields=['inventory', 'checkpoint']),
+            models.Index(fields=['reference']),
+        ]
+    
+    def __str__(self):
+        return f"{self.get_kind_display()} {self.quantity:+d} ({self.inventory_id})"
+
+
 class Transaction(models.Model):
     """Transaction/Order model for completed purchases"""
     
@@ -254,6 +414,7 @@ class Transaction(models.Model):
         ('PENDING', 'Pending'),
         ('COMPLETED', 'Completed'),
         ('CANCELLED', 'Cancelled'),
+        ('PARTIALLY_REFUNDED', 'Partially Refunded'),
         ('REFUNDED', 'Refunded'),
     ]
     
@@ -272,6 +433,24 @@ class Transaction(models.Model):
         help_text='Cashier who processed the transaction'
     )
     
+    location = models.ForeignKey(
+        Location,
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        related_name='transactions',
+        help_text='Location whose stock the sale deducted'
+    )
+    
+    terminal = models.ForeignKey(
+        Terminal,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='transactions',
+        help_text='Terminal the sale was made on'
+    )
+    
     # Store cart items as JSON (snapshot at time of purchase)
     cart_items = models.JSONField(
         help_text='JSON snapshot of cart items at time of purchase'
@@ -309,7 +488,16 @@ class Transaction(models.Model):
     
     notes = models.TextField(blank=True, help_text='Additional notes')
     
-    created_at = models.DateTimeField(auto_now_add=True)
+    client_id = models.CharField(
+        max_length=100,
+        unique=True,
+        null=True,
+        blank=True,
+        help_text='Terminal-generated id of a sale recorded offline'
+    )
+    
+    # Not auto_now_add: offline sales keep the time they were made
+    created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
@@ -317,19 +505,157 @@ class Transaction(models.Model):
         verbose_name = 'Transaction'
         verbose_name_plural = 'Transactions'
         ordering = ['-created_at']
+        indexes = [
+            # Newest-first lists and date ranges (per partition once partitioned, api.partitions)
+            models.Index(fields=['created_at']),
+        ]
     
     def __str__(self):
         return f"Transaction {self.transaction_number} - ${self.total}"
     
+    @staticmethod
+    def generate_number(when=None):
+        """Receipt number for a sale made at ``when`` (default: now)"""
+        import datetime
+        import secrets
+        when = timezone.localtime(when) if when else datetime.datetime.now()
+        # Random suffix keeps numbers unique when several sales land in the same second
+        return f"TXN-{when.strftime('%Y%m%d%H%M%S')}-{secrets.token_hex(3).upper()}"
+    
     def save(self, *args, **kwargs):
         # Auto-generate transaction number if not set
         if not self.transaction_number:
-            import datetime
-            timestamp = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
-            self.transaction_number = f"TXN-{timestamp}"
+            self.transaction_number = self.generate_number()
         
         # Calculate change
         if self.amount_paid:
             self.change_given = max(0, self.amount_paid - self.total)
         
         super().save(*args, **kwargs)
+    
+    def refunded_quantities(self):
+        """Quantity already returned per cart line index, across all refunds"""
+        returned = {}
+        for refund in self.refunds.all():
+            for line in refund.items:
+                returned[line['line']] = returned.get(line['line'], 0) + line['quantity']
+        return returned
+
+
+class Refund(models.Model):
+    """Partial or full refund / exchange of lines of a transaction"""
+    
+    KIND_CHOICES = [
+        ('REFUND', 'Refund'),
+        ('EXCHANGE', 'Exchange'),
+    ]
+    
+    refund_number = models.CharField(max_length=50, unique=True)
+    transaction = models.ForeignKey(Transaction, on_delete=models.CASCADE, related_name='refunds')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, default='REFUND')
+    processed_by = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='refunds',
+        help_text='User who processed the refund'
+    )
+    
+    # Returned lines: [{line, product_id, variant_id, quantity, amount}]
+    items = models.JSONField(help_text='Returned cart lines and quantities')
+    # Replacement cart items handed out in an exchange
+    exchange_items = models.JSONField(default=list, blank=True)
+    
+    amount = models.DecimalField(
+        max_digits=10,
+        decimal_places=2,
+        help_text='Net amount returned to the customer (negative if the customer paid a difference)'
+    )
+    reason = models.TextField(blank=True)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        db_table = 'refunds'
+        verbose_name = 'Refund'
+        verbose_name_plural = 'Refunds'
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f"Refund {self.refund_number} of {self.transaction.transaction_number}"
+    
+    def save(self, *args, **kwargs):
+        if not self.refund_number:
+            import datetime
+            import secrets
+            timestamp = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
+            self.refund_number = f"RFD-{timestamp}-{secrets.token_hex(3).upper()}"
+        
+        super().save(*args, **kwargs)
+
+
+class IdempotencyKey(models.Model):
+    """Stored outcome of a request sent with an Idempotency-Key header"""
+    
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='idempotency_keys')
+    key = models.CharField(max_length=255)
+    scope = models.CharField(max_length=100, help_text='Endpoint the key was used on')
+    request_hash = models.CharField(max_length=64, help_text='SHA-256 of the request payload')
+    
+    # Null while the first request is still being processed
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+    
+    class Meta:
+        db_table = 'idempotency_keys'
+        verbose_name = 'Idempotency Key'
+        verbose_name_plural = 'Idempotency Keys'
+        unique_together = ['user', 'scope', 'key']
+    
+    def __str__(self):
+        return f"{self.scope} {self.key}"
+
+
+class Task(models.Model):
+    """Background task queued in the database and run by run_tasks workers (api.tasks)"""
+    
+    STATUS_CHOICES = [
+        ('PENDING', 'Pending'),
+        ('RUNNING', 'Running'),
+        ('SUCCEEDED', 'Succeeded'),
+        ('FAILED', 'Failed'),
+    ]
+    
+    name = models.CharField(max_length=100, help_text='Registered task name')
+    args = models.JSONField(default=list, blank=True, encoder=DjangoJSONEncoder)
+    kwargs = models.JSONField(default=dict, blank=True, encoder=DjangoJSONEncoder)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='PENDING')
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now, help_text='Not run before this time (retries back off)')
+    
+    # Worker (and claim) running the task; guards against a stale worker finishing it twice
+    locked_by = models.CharField(max_length=100, blank=True)
+    last_error = models.TextField(blank=True)
+    
+    created_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    duration = models.FloatField(null=True, blank=True, help_text='Seconds the last attempt ran')
+    
+    class Meta:
+        db_table = 'tasks'
+        verbose_name = 'Task'
+        verbose_name_plural = 'Tasks'
+        ordering = ['-created_at', '-id']
+        indexes = [
+            models.Index(fields=['status', 'run_at']),
+            models.Index(fields=['finished_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.name} #{self.pk} ({self.status})"
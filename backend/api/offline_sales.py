@@ -0,0 +1,198 @@
+"""
+Bulk import of sales recorded by terminals while they were offline
+
+Sales are processed in chunks, each in its own database transaction: one
+query finds client ids that were already uploaded, every sale is re-priced
+with api.pricing (products come from the catalog cache) and rejected when
+its total differs from the server price, as checkout does, the new
+transactions are inserted with a single bulk INSERT and the stock of the
+whole chunk is deducted set-based through api.stock, at the uploading
+terminal's location. The goods of an offline sale have already left the
+store, so insufficient stock does not reject a sale: the inventory goes
+negative, as it does for checkout.
+"""
+import datetime
+from decimal import Decimal, InvalidOperation
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .alerts import queue_low_stock_alert
+from .models import Transaction
+from .pricing import PRICE_TOLERANCE, PricingError, quote_cart
+from .stock import adjust_stock
+
+
+MAX_SALES = 500
+CHUNK_SIZE = 100
+
+# Terminal clocks drift; sales further in the future than this are rejected
+MAX_CLOCK_SKEW = datetime.timedelta(minutes=5)
+
+
+class SaleRejected(Exception):
+    """The uploaded sale is malformed and cannot be recorded"""
+
+
+def _decimal(value, field):
+    try:
+        amount = Decimal(str(value))
+        if not amount.is_finite():
+            raise InvalidOperation
+        return amount.quantize(Decimal('0.01'))
+    except (InvalidOperation, TypeError, ValueError):
+        raise SaleRejected(f'Invalid {field}')
+
+
+def _parse_sale(sale, now):
+    """Validate one uploaded sale and return the values of its Transaction"""
+    if not isinstance(sale, dict):
+        raise SaleRejected('Sale must be an object')
+
+    client_id = sale.get('client_id')
+    if not client_id or not isinstance(client_id, str) or len(client_id) > 100:
+        raise SaleRejected('client_id is required (at most 100 characters)')
+
+    cart_items = sale.get('cart_items')
+    if not cart_items or not isinstance(cart_items, list):
+        raise SaleRejected('cart_items must be a non-empty list')
+
+    created_at = now
+    if sale.get('created_at'):
+        created_at = parse_datetime(str(sale['created_at']))
+        if created_at is None:
+            raise SaleRejected('created_at must be an ISO 8601 timestamp')
+        if timezone.is_naive(created_at):
+            created_at = timezone.make_aware(created_at)
+        if created_at > now + MAX_CLOCK_SKEW:
+            raise SaleRejected('created_at is in the future')
+
+    if sale.get('total') is None:
+        raise SaleRejected('total is required')
+
+    return {
+        'client_id': client_id,
+        'cart_items': cart_items,
+        # Compared with the server price; subtotal and tax are recomputed
+        'total': _decimal(sale['total'], 'total'),
+        'amount_paid': _decimal(sale.get('amount_paid', 0), 'amount_paid'),
+        'payment_method': str(sale.get('payment_method') or 'CASH')[:50],
+        'notes': str(sale.get('notes') or ''),
+        'created_at': created_at,
+    }
+
+
+def _result(client_id, status, txn=None, error=None):
+    result = {'client_id': client_id, 'status': status}
+    if txn is not None:
+        result['transaction_id'] = txn.id
+        result['transaction_number'] = txn.transaction_number
+    if error is not None:
+        result['error'] = error
+    return result
+
+
+def _price(sale):
+    """Server quote of a parsed sale, checked against what the terminal charged"""
+    try:
+        quote = quote_cart(sale['cart_items'])
+    except PricingError as e:
+        raise SaleRejected(str(e))
+    if abs(sale['total'] - quote.total) > PRICE_TOLERANCE:
+        raise SaleRejected(f'Total {sale["total"]} does not match the server price {quote.total}')
+    if sale['amount_paid'] < quote.total:
+        raise SaleRejected('Insufficient payment amount')
+    return quote
+
+
+def _import_chunk(parsed, cashier, location_id, terminal):
+    """
+    Record the parsed sales of one chunk atomically and return
+    {client_id: result} for every sale that was created or already existed.
+    """
+    with transaction.atomic():
+        existing = {
+            txn.client_id: txn
+            for txn in Transaction.objects.filter(client_id__in=[sale['client_id'] for sale in parsed])
+            .only('id', 'client_id', 'transaction_number')
+        }
+        results = {client_id: _result(client_id, 'duplicate', txn) for client_id, txn in existing.items()}
+        new_sales = [sale for sale in parsed if sale['client_id'] not in existing]
+
+        to_create = []
+        deltas = {}
+        # One ledger movement per sale and stock pair, referencing the sale's receipt
+        itemized = []
+        for sale in new_sales:
+            try:
+                quote = _price(sale)
+            except SaleRejected as e:
+                results[sale['client_id']] = _result(sale['client_id'], 'rejected', error=str(e))
+                continue
+            # Store the server line subtotals and taxes, as checkout does
+            for item, line in zip(sale['cart_items'], quote.lines):
+                item['subtotal'] = float(line.subtotal)
+                item['tax'] = float(line.tax)
+            transaction_number = Transaction.generate_number(sale['created_at'])
+            for line in quote.lines:
+                deltas[line.stock_key] = deltas.get(line.stock_key, 0) - line.quantity
+                itemized.append((line.stock_key, -line.quantity, transaction_number))
+            to_create.append(Transaction(
+                cashier=cashier,
+                location_id=location_id,
+                terminal=terminal,
+                status='COMPLETED',
+                transaction_number=transaction_number,
+                subtotal=quote.subtotal,
+                tax=quote.tax,
+                change_given=sale['amount_paid'] - quote.total,
+                **dict(sale, total=quote.total),
+            ))
+
+        for txn in Transaction.objects.bulk_create(to_create):
+            results[txn.client_id] = _result(txn.client_id, 'created', txn)
+        adjust_stock(deltas, 'SALE', create_missing=True, user=cashier, itemized=itemized, location_id=location_id)
+        queue_low_stock_alert(deltas, location_id)
+        return results
+
+
+def import_sales(sales, cashier, location_id, terminal=None):
+    """Record uploaded offline sales at ``location_id``; returns one result per sale, in order"""
+    now = timezone.now()
+    results = [None] * len(sales)
+    seen = {}
+    valid = []
+    for index, sale in enumerate(sales):
+        try:
+            parsed = _parse_sale(sale, now)
+        except SaleRejected as e:
+            client_id = sale.get('client_id') if isinstance(sale, dict) else None
+            results[index] = _result(client_id, 'rejected', error=str(e))
+            continue
+        if parsed['client_id'] in seen:
+            # Same sale listed twice in one upload: resolved after its first copy
+            seen[parsed['client_id']].append(index)
+            continue
+        seen[parsed['client_id']] = [index]
+        valid.append((index, parsed))
+
+    for start in range(0, len(valid), CHUNK_SIZE):
+        chunk = valid[start:start + CHUNK_SIZE]
+        parsed = [sale for _, sale in chunk]
+        try:
+            chunk_results = _import_chunk(parsed, cashier, location_id, terminal)
+        except IntegrityError:
+            # A concurrent upload inserted some of these client ids first;
+            # the retry sees them as duplicates
+            chunk_results = _import_chunk(parsed, cashier, location_id, terminal)
+
+        for index, sale in chunk:
+            client_id = sale['client_id']
+            result = chunk_results[client_id]
+            results[index] = result
+            for duplicate_index in seen[client_id][1:]:
+                results[duplicate_index] = dict(
+                    result, status='duplicate' if result['status'] != 'rejected' else 'rejected'
+                )
+    return results
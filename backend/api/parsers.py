@@ -0,0 +1,24 @@
+"""
+Parsers for the REST API
+"""
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+
+from . import fast_json
+from .renderers import FastJSONRenderer
+
+
+class FastJSONParser(JSONParser):
+    """JSONParser decoding with orjson (api.fast_json); other charsets use the standard library"""
+    
+    renderer_class = FastJSONRenderer
+    
+    def parse(self, stream, media_type=None, parser_context=None):
+        encoding = (parser_context or {}).get('encoding', settings.DEFAULT_CHARSET)
+        if not self.strict or encoding.lower().replace('-', '') != 'utf8':
+            return super().parse(stream, media_type, parser_context)
+        try:
+            return fast_json.loads(stream.read())
+        except ValueError as exc:
+            raise ParseError('JSON parse error - %s' % str(exc))
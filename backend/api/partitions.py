@@ -0,0 +1,283 @@
+"""
+Monthly range partitioning of the transactions table (PostgreSQL)
+
+``manage.py partition_transactions --convert`` turns ``transactions`` into a
+table declaratively partitioned by RANGE (created_at). There is one partition
+per calendar month (UTC), ``transactions_p2024_05``, plus
+``transactions_default`` for rows outside every month partition (e.g. an
+offline sale dated in an archived month). Queries with a created_at range
+(TransactionViewSet's ?date=, ?since=, ?until=) only scan the partitions it
+overlaps. Vacuum and index maintenance work partition by partition, and
+old months are detached and archived instead of deleted row by row.
+
+PostgreSQL requires every unique constraint of a partitioned table to contain
+the partition key, which changes what the database enforces:
+
+- the primary key becomes (id, created_at); ids still come from one
+  sequence and stay unique in practice;
+- ``transaction_number`` and ``client_id`` are unique per partition. A
+  receipt number encodes its day and offline sales keep their time, so the
+  copies a retry could create land in the same partition;
+- foreign keys cannot reference ``transactions(id)`` alone, so the
+  refunds.transaction_id constraint is dropped (Django still joins and
+  cascades on it);
+- Django migrations that alter those constraints must be written by hand.
+
+``ensure_partitions`` creates the partitions of the coming months. It runs
+after ``migrate`` and should also run from cron. ``archive_partition`` detaches
+one month, stores it and its refunds as gzipped CSV in the
+``ARCHIVE_STORAGE`` storage (api.management.commands.archive_transactions),
+then drops it.
+"""
+import datetime
+import gzip
+import re
+import tempfile
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import storages
+from django.db import connections, transaction
+
+from .models import Refund, Transaction
+
+DEFAULTS = {
+    # Month partitions created ahead of the current month
+    'MONTHS_AHEAD': 3,
+    # archive_transactions default: months kept in the live table
+    'ARCHIVE_AFTER_MONTHS': 24,
+    # Alias in settings.STORAGES receiving archived partitions
+    'ARCHIVE_STORAGE': 'transaction_archive',
+}
+
+TABLE = Transaction._meta.db_table
+PARTITION_KEY = 'created_at'
+DEFAULT_PARTITION = f'{TABLE}_default'
+_PARTITION_NAME = re.compile(rf'^{re.escape(TABLE)}_p(\d{{4}})_(\d{{2}})$')
+
+
+class PartitionError(Exception):
+    """The database or table cannot be (re)partitioned as requested"""
+
+
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'TRANSACTION_PARTITIONS', {}))
+    return config
+
+
+def month_start(when):
+    """First instant (UTC) of the month of ``when``"""
+    when = when.astimezone(datetime.timezone.utc)
+    return when.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_months(start, months):
+    index = start.year * 12 + start.month - 1 + months
+    return start.replace(year=index // 12, month=index % 12 + 1)
+
+
+def partition_name(start):
+    return f'{TABLE}_p{start:%Y_%m}'
+
+
+def _bound(when):
+    return f"'{when:%Y-%m-%d %H:%M:%S}+00'"
+
+
+def _unique_columns():
+    """Columns Django declares unique, enforced per partition"""
+    return [field.column for field in Transaction._meta.local_fields if field.unique and not field.primary_key]
+
+
+def is_partitioned(using='default'):
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relkind FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace "
+            "WHERE c.relname = %s AND n.nspname = current_schema()",
+            [TABLE],
+        )
+        row = cursor.fetchone()
+    return row is not None and row[0] == 'p'
+
+
+def partitions(using='default'):
+    """[(name, month start)] of the month partitions, oldest first"""
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = %s::regclass",
+            [TABLE],
+        )
+        names = [row[0] for row in cursor.fetchall()]
+    months = []
+    for name in names:
+        match = _PARTITION_NAME.match(name)
+        if match:
+            start = datetime.datetime(int(match[1]), int(match[2]), 1, tzinfo=datetime.timezone.utc)
+            months.append((name, start))
+    return sorted(months, key=lambda item: item[1])
+
+
+def _create_unique_indexes(cursor, name):
+    for column in _unique_columns():
+        cursor.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS "{name}_{column}_uniq" ON "{name}" ("{column}")')
+
+
+def _create_partition(cursor, start):
+    """
+    Create and attach the partition of the month starting at ``start``,
+    moving in its rows from the default partition; False if it exists
+    """
+    name = partition_name(start)
+    cursor.execute('SELECT to_regclass(%s)', [name])
+    if cursor.fetchone()[0] is not None:
+        return False
+    lower, upper = _bound(start), _bound(add_months(start, 1))
+    cursor.execute(f'CREATE TABLE "{name}" (LIKE "{TABLE}" INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+    # Attaching fails while the default partition holds rows of this month
+    cursor.execute(
+        f'WITH moved AS (DELETE FROM "{DEFAULT_PARTITION}" '
+        f'WHERE "{PARTITION_KEY}" >= {lower} AND "{PARTITION_KEY}" < {upper} RETURNING *) '
+        f'INSERT INTO "{name}" SELECT * FROM moved'
+    )
+    cursor.execute(f'ALTER TABLE "{TABLE}" ATTACH PARTITION "{name}" FOR VALUES FROM ({lower}) TO ({upper})')
+    _create_unique_indexes(cursor, name)
+    return True
+
+
+def ensure_partitions(months_ahead=None, now=None, using='default'):
+    """Create the partitions of this month and the next ``months_ahead``; returns the names created"""
+    if months_ahead is None:
+        months_ahead = get_config()['MONTHS_AHEAD']
+    current = month_start(now or datetime.datetime.now(datetime.timezone.utc))
+    created = []
+    with transaction.atomic(using=using), connections[using].cursor() as cursor:
+        for offset in range(months_ahead + 1):
+            start = add_months(current, offset)
+            if _create_partition(cursor, start):
+                created.append(partition_name(start))
+    return created
+
+
+def convert(months_ahead=None, using='default'):
+    """
+    Rebuild ``transactions`` as a partitioned table holding the same rows,
+    indexes and outgoing foreign keys; returns the partitions created.
+    Holds an exclusive lock on the table until done.
+    """
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        raise PartitionError('Transaction partitioning needs PostgreSQL')
+    if is_partitioned(using):
+        raise PartitionError(f'{TABLE} is already partitioned')
+    if months_ahead is None:
+        months_ahead = get_config()['MONTHS_AHEAD']
+    old = f'{TABLE}_unpartitioned'
+
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        cursor.execute(f'LOCK TABLE "{TABLE}" IN ACCESS EXCLUSIVE MODE')
+
+        cursor.execute(
+            "SELECT conname, conrelid::regclass::text FROM pg_constraint "
+            "WHERE contype = 'f' AND confrelid = %s::regclass",
+            [TABLE],
+        )
+        referencing = cursor.fetchall()
+        cursor.execute(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE contype = 'f' AND conrelid = %s::regclass",
+            [TABLE],
+        )
+        foreign_keys = cursor.fetchall()
+        # Unique indexes (and the primary key) cannot exist on the parent without created_at
+        cursor.execute(
+            "SELECT pg_get_indexdef(indexrelid) FROM pg_index "
+            "WHERE indrelid = %s::regclass AND NOT indisunique",
+            [TABLE],
+        )
+        indexes = [row[0] for row in cursor.fetchall()]
+        cursor.execute(
+            f'SELECT DISTINCT date_trunc(\'month\', "{PARTITION_KEY}" AT TIME ZONE \'UTC\') FROM "{TABLE}"'
+        )
+        months = {row[0].replace(tzinfo=datetime.timezone.utc) for row in cursor.fetchall()}
+
+        for constraint, table in referencing:
+            cursor.execute(f'ALTER TABLE {table} DROP CONSTRAINT "{constraint}"')
+        cursor.execute(f'ALTER TABLE "{TABLE}" RENAME TO "{old}"')
+        cursor.execute(
+            f'CREATE TABLE "{TABLE}" (LIKE "{old}" INCLUDING DEFAULTS INCLUDING CONSTRAINTS '
+            f'INCLUDING STORAGE INCLUDING COMMENTS) PARTITION BY RANGE ("{PARTITION_KEY}")'
+        )
+        cursor.execute(f'CREATE TABLE "{DEFAULT_PARTITION}" PARTITION OF "{TABLE}" DEFAULT')
+        _create_unique_indexes(cursor, DEFAULT_PARTITION)
+
+        current = month_start(datetime.datetime.now(datetime.timezone.utc))
+        months.update(add_months(current, offset) for offset in range(months_ahead + 1))
+        created = [partition_name(start) for start in sorted(months) if _create_partition(cursor, start)]
+
+        cursor.execute(f'INSERT INTO "{TABLE}" SELECT * FROM "{old}"')
+        # Drops the old identity sequence and frees the index and constraint names
+        cursor.execute(f'DROP TABLE "{old}"')
+
+        sequence = f'{TABLE}_id_seq'
+        cursor.execute(f'CREATE SEQUENCE "{sequence}" OWNED BY "{TABLE}"."id"')
+        cursor.execute(f'ALTER TABLE "{TABLE}" ALTER COLUMN "id" SET DEFAULT nextval(\'"{sequence}"\')')
+        cursor.execute(f'SELECT setval(\'"{sequence}"\', COALESCE(MAX("id"), 0) + 1, false) FROM "{TABLE}"')
+        cursor.execute(f'ALTER TABLE "{TABLE}" ADD PRIMARY KEY ("id", "{PARTITION_KEY}")')
+        for definition in indexes:
+            cursor.execute(definition)
+        for constraint, definition in foreign_keys:
+            cursor.execute(f'ALTER TABLE "{TABLE}" ADD CONSTRAINT "{constraint}" {definition}')
+    return created
+
+
+def archivable(older_than_months=None, now=None, using='default'):
+    """[(name, month start)] of the partitions that ended more than ``older_than_months`` months ago"""
+    if older_than_months is None:
+        older_than_months = get_config()['ARCHIVE_AFTER_MONTHS']
+    cutoff = add_months(month_start(now or datetime.datetime.now(datetime.timezone.utc)), -older_than_months)
+    return [(name, start) for name, start in partitions(using) if add_months(start, 1) <= cutoff]
+
+
+def _copy_to_storage(cursor, query, storage, name):
+    """COPY ``query`` as gzipped CSV (with header) into ``storage``; returns the stored name"""
+    with tempfile.TemporaryFile() as buffer:
+        with gzip.GzipFile(fileobj=buffer, mode='wb') as compressed:
+            # psycopg2 (requirements.txt); COPY streams without loading the rows into Python
+            cursor.copy_expert(f'COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER)', compressed)
+        buffer.seek(0)
+        return storage.save(name, File(buffer, name=name))
+
+
+def archive_partition(name, using='default'):
+    """
+    Detach the partition ``name``, store it and the refunds of its
+    transactions in the archive storage and drop both from the database;
+    returns the stored file names
+    """
+    storage = storages[get_config()['ARCHIVE_STORAGE']]
+    refunds = Refund._meta.db_table
+    refund_filter = f'"transaction_id" IN (SELECT "id" FROM "{name}")'
+    with transaction.atomic(using=using), connections[using].cursor() as cursor:
+        cursor.execute(f'ALTER TABLE "{TABLE}" DETACH PARTITION "{name}"')
+        # Stored before anything is dropped: a failure rolls back with nothing lost
+        files = [
+            _copy_to_storage(cursor, f'SELECT * FROM "{name}" ORDER BY "id"', storage, f'{name}.csv.gz'),
+            _copy_to_storage(
+                cursor, f'SELECT * FROM "{refunds}" WHERE {refund_filter} ORDER BY "id"',
+                storage, f'{name}_{refunds}.csv.gz',
+            ),
+        ]
+        cursor.execute(f'DELETE FROM "{refunds}" WHERE {refund_filter}')
+        cursor.execute(f'DROP TABLE "{name}"')
+    return files
+
+
+def ensure_after_migrate(sender, using='default', **kwargs):
+    """post_migrate receiver: keep future partitions in place after deploys"""
+    if is_partitioned(using):
+        ensure_partitions(using=using)
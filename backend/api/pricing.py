@@ -0,0 +1,166 @@
+"""
+Server-side cart pricing
+
+Prices carts with the same rules as the Angular PricingService, in Decimal:
+unit price = product base price + variant price adjustment + add-on prices,
+line subtotal = unit price x quantity, and 10% tax on taxable products,
+rounded half-up to cents on the cart totals.
+
+Products, variants and add-ons are resolved for the whole cart at once
+through the process-local catalog cache (api.catalog_cache): at most one
+query per model on cache misses and none in steady state, whatever the
+number of lines.
+"""
+from decimal import Decimal, ROUND_HALF_UP
+
+from .catalog_cache import catalog
+
+
+TAX_RATE = Decimal('0.10')
+CENT = Decimal('0.01')
+# Largest difference between a client's total and the server's that is accepted
+PRICE_TOLERANCE = Decimal('0.01')
+
+
+class PricingError(Exception):
+    """A cart line cannot be priced"""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class QuoteLine:
+    __slots__ = ('product', 'variant', 'addons', 'quantity', 'unit_price', 'subtotal', 'tax')
+
+    def __init__(self, product, variant, addons, quantity):
+        self.product = product
+        self.variant = variant
+        self.addons = addons
+        self.quantity = quantity
+        self.unit_price = (
+            product.base_price
+            + (variant.price_adjustment if variant else Decimal('0'))
+            + sum((addon.price for addon in addons), Decimal('0'))
+        )
+        self.subtotal = self.unit_price * quantity
+        self.tax = self.subtotal * TAX_RATE if product.is_taxable else Decimal('0')
+
+    @property
+    def stock_key(self):
+        return self.product.id, self.variant.id if self.variant else None
+
+    def as_cart_item(self):
+        """The line in the checkout cart shape stored with transactions"""
+        return {
+            'product': {'id': self.product.id, 'name': self.product.name, 'sku': self.product.sku},
+            'variant': {'id': self.variant.id, 'name': self.variant.name} if self.variant else None,
+            'addons': [{'id': addon.id, 'name': addon.name, 'price': float(addon.price)} for addon in self.addons],
+            'quantity': self.quantity,
+            'subtotal': float(self.subtotal),
+            'tax': float(self.tax),
+        }
+
+    def as_dict(self):
+        return {
+            'product_id': self.product.id,
+            'product_name': self.product.name,
+            'variant_id': self.variant.id if self.variant else None,
+            'addon_ids': [addon.id for addon in self.addons],
+            'quantity': self.quantity,
+            'unit_price': str(self.unit_price),
+            'subtotal': str(self.subtotal.quantize(CENT, ROUND_HALF_UP)),
+            'tax': str(self.tax.quantize(CENT, ROUND_HALF_UP)),
+        }
+
+
+class CartQuote:
+    """Priced cart: lines plus subtotal, tax and total rounded to cents"""
+
+    def __init__(self, lines):
+        self.lines = lines
+        self.subtotal = sum((line.subtotal for line in lines), Decimal('0')).quantize(CENT, ROUND_HALF_UP)
+        self.tax = sum((line.tax for line in lines), Decimal('0')).quantize(CENT, ROUND_HALF_UP)
+        self.total = self.subtotal + self.tax
+        self.item_count = sum(line.quantity for line in lines)
+
+    def as_dict(self):
+        return {
+            'items': [line.as_dict() for line in self.lines],
+            'subtotal': str(self.subtotal),
+            'tax': str(self.tax),
+            'total': str(self.total),
+            'item_count': self.item_count,
+        }
+
+
+def _id(value):
+    if isinstance(value, dict):
+        value = value.get('id')
+    if value in (None, ''):
+        return None
+    return int(value)
+
+
+def parse_cart_item(item):
+    """
+    (product, variant_id, addon_ids, quantity) of a cart line, accepting
+    both the checkout cart shape ({product: {id}, variant: {id}, addons:
+    [{id}]}) and the QR payload shape ({productId, variantId, addonIds}).
+    ``product`` is the product id, or its SKU string for lines that only
+    carry one ({sku} or {product: {sku}}, e.g. from a barcode scanner).
+    """
+    if not isinstance(item, dict):
+        raise PricingError('Cart items must be objects')
+    try:
+        product = item.get('product', item.get('productId', item.get('product_id')))
+        sku = product.get('sku') if isinstance(product, dict) else item.get('sku')
+        product = _id(product)
+        if product is None and sku:
+            product = str(sku)
+        variant_id = _id(item.get('variant', item.get('variantId', item.get('variant_id'))))
+        addons = item.get('addons', item.get('addonIds', item.get('addon_ids'))) or []
+        addon_ids = [_id(addon) for addon in addons]
+        quantity = int(item.get('quantity', 1))
+    except (TypeError, ValueError, AttributeError):
+        raise PricingError('Invalid cart item')
+    if product is None:
+        raise PricingError('Cart item without product')
+    if quantity < 1:
+        raise PricingError('Quantities must be positive')
+    return product, variant_id, addon_ids, quantity
+
+
+def quote_cart(items):
+    """Price ``items`` with records from the catalog cache"""
+    parsed = [parse_cart_item(item) for item in items]
+
+    products = catalog.products({product for product, _, _, _ in parsed if isinstance(product, int)})
+    skus = {product for product, _, _, _ in parsed if isinstance(product, str)}
+    by_sku = catalog.products_by_sku(skus) if skus else {}
+    variants = catalog.variants({variant_id for _, variant_id, _, _ in parsed if variant_id is not None})
+    addons = catalog.addons({addon_id for _, _, addon_ids, _ in parsed for addon_id in addon_ids})
+
+    lines = []
+    for key, variant_id, addon_ids, quantity in parsed:
+        product = by_sku.get(key) if isinstance(key, str) else products.get(key)
+        if product is None:
+            raise PricingError(f'Product {key} not found', status_code=404)
+        if not product.is_active:
+            raise PricingError(f'{product.name} is no longer available')
+
+        variant = None
+        if variant_id is not None:
+            variant = variants.get(variant_id)
+            if variant is None or variant.product_id != product.id or not variant.is_active:
+                raise PricingError(f'Variant {variant_id} is not available for {product.name}')
+
+        line_addons = []
+        for addon_id in addon_ids:
+            addon = addons.get(addon_id)
+            if addon is None or not addon.is_active or not addon.applies_to(product.id):
+                raise PricingError(f'Add-on {addon_id} is not available for {product.name}')
+            line_addons.append(addon)
+
+        lines.append(QuoteLine(product, variant, line_addons, quantity))
+    return CartQuote(lines)
@@ -0,0 +1,188 @@
+"""
+N+1 and slow query detection
+
+Fingerprints every SQL statement issued while a request (or an explicit
+``inspect_queries()`` block) is active, flags structurally identical queries
+repeated more than ``DUPLICATE_THRESHOLD`` times together with the Python
+call site that issued them, and logs queries slower than ``SLOW_QUERY_MS``
+with their EXPLAIN output. Configured through ``settings.QUERY_INSPECTOR``.
+"""
+import logging
+import os
+import re
+import time
+import traceback
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import transaction
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': False,
+    'DUPLICATE_THRESHOLD': 3,
+    'SLOW_QUERY_MS': 100,
+    'EXPLAIN_SLOW_QUERIES': True,
+    'RAISE': False,
+    'IGNORE_PATTERNS': [],
+}
+
+TRACKED_STATEMENTS = ('SELECT', 'INSERT', 'UPDATE', 'DELETE')
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PLACEHOLDER_LIST = re.compile(r'\(\s*(?:(?:%s|\?)\s*,\s*)*(?:%s|\?)\s*\)')
+_WHITESPACE = re.compile(r'\s+')
+
+_PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Execute wrappers whose frames sit between the ORM and the caller
+_WRAPPER_FILES = {
+    os.path.abspath(__file__),
+    os.path.join(_PACKAGE_DIR, 'metrics.py'),
+}
+
+_current_inspection = ContextVar('query_inspection', default=None)
+
+
+class NPlusOneQueryError(Exception):
+    """Raised when repeated queries are detected and QUERY_INSPECTOR['RAISE'] is on"""
+
+
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'QUERY_INSPECTOR', {}))
+    return config
+
+
+def fingerprint(sql):
+    """Reduce a SQL statement to its structure by stripping literals and parameter lists"""
+    sql = _STRING_LITERAL.sub('?', sql)
+    sql = _NUMBER_LITERAL.sub('?', sql)
+    sql = _PLACEHOLDER_LIST.sub('(...)', sql.replace('%s', '?'))
+    return _WHITESPACE.sub(' ', sql).strip()
+
+
+def _call_site():
+    """Innermost stack frame that belongs to project code rather than Django or this module"""
+    base_dir = str(settings.BASE_DIR)
+    for frame in reversed(traceback.extract_stack()[:-2]):
+        filename = os.path.abspath(frame.filename)
+        if not filename.startswith(base_dir) or filename in _WRAPPER_FILES:
+            continue
+        if 'site-packages' in filename or os.sep + 'migrations' + os.sep in filename:
+            continue
+        return f'{os.path.relpath(filename, base_dir)}:{frame.lineno} in {frame.name}'
+    return 'unknown'
+
+
+class QueryInspection:
+    """Queries seen during one request or inspect_queries() block"""
+
+    def __init__(self, config, label):
+        self.config = config
+        self.label = label
+        self.counts = {}
+        self.call_sites = {}
+        self.slow_queries = []
+        self.explaining = False
+        self._ignore = [re.compile(pattern) for pattern in config['IGNORE_PATTERNS']]
+
+    def record(self, sql, params, duration, connection):
+        statement = sql.lstrip()[:6].upper()
+        if statement not in TRACKED_STATEMENTS:
+            return
+        if any(pattern.search(sql) for pattern in self._ignore):
+            return
+
+        key = fingerprint(sql)
+        count = self.counts.get(key, 0) + 1
+        self.counts[key] = count
+        if count == 1:
+            self.call_sites[key] = _call_site()
+
+        if duration * 1000 >= self.config['SLOW_QUERY_MS']:
+            plan = None
+            if self.config['EXPLAIN_SLOW_QUERIES'] and statement == 'SELECT':
+                plan = self._explain(sql, params, connection)
+            site = _call_site()
+            self.slow_queries.append((duration, sql, plan, site))
+            logger.warning(
+                'Slow query (%.1f ms) during %s at %s: %s%s',
+                duration * 1000, self.label, site, sql,
+                f'\n{plan}' if plan else '',
+            )
+
+    def _explain(self, sql, params, connection):
+        self.explaining = True
+        try:
+            # Savepoint so a failing EXPLAIN cannot break the surrounding transaction
+            with transaction.atomic(using=connection.alias):
+                with connection.cursor() as cursor:
+                    cursor.execute(f'EXPLAIN {sql}', params)
+                    return '\n'.join(' '.join(str(col) for col in row) for row in cursor.fetchall())
+        except Exception as e:
+            return f'EXPLAIN failed: {e}'
+        finally:
+            self.explaining = False
+
+    def duplicates(self):
+        """(count, fingerprint, call site) for every query repeated beyond the threshold"""
+        threshold = self.config['DUPLICATE_THRESHOLD']
+        return sorted(
+            ((count, key, self.call_sites[key]) for key, count in self.counts.items() if count > threshold),
+            reverse=True,
+        )
+
+    def report(self):
+        """Log repeated queries and raise NPlusOneQueryError if configured to"""
+        duplicates = self.duplicates()
+        if not duplicates:
+            return
+
+        lines = [f'{count}x at {site}: {key}' for count, key, site in duplicates]
+        message = f'Possible N+1 queries during {self.label}:\n  ' + '\n  '.join(lines)
+        logger.warning(message)
+        if self.config['RAISE']:
+            raise NPlusOneQueryError(message)
+
+
+def inspect_query(execute, sql, params, many, context):
+    """Database execute wrapper feeding the active QueryInspection"""
+    inspection = _current_inspection.get()
+    if inspection is None or inspection.explaining:
+        return execute(sql, params, many, context)
+
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        inspection.record(sql, params, time.perf_counter() - started, context['connection'])
+
+
+def install_query_inspector(sender=None, connection=None, **kwargs):
+    """connection_created receiver attaching inspect_query to every new connection"""
+    if inspect_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(inspect_query)
+
+
+@contextmanager
+def inspect_queries(label='block', **overrides):
+    """
+    Inspect all queries issued inside the block, e.g. in tests:
+
+        with inspect_queries(RAISE=True):
+            client.get('/api/products/')
+    """
+    config = get_config()
+    config.update(overrides)
+    inspection = QueryInspection(config, label)
+    token = _current_inspection.set(inspection)
+    try:
+        yield inspection
+    finally:
+        _current_inspection.reset(token)
+    inspection.report()
@@ -0,0 +1,32 @@
+"""
+Renderers for the REST API
+"""
+from rest_framework.renderers import JSONRenderer
+
+from . import fast_json
+from .metrics import timed
+
+
+class TimedJSONRenderer(JSONRenderer):
+    """JSONRenderer that reports its rendering time to the request metrics"""
+    
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with timed('render'):
+            return super().render(data, accepted_media_type, renderer_context)
+
+
+class FastJSONRenderer(TimedJSONRenderer):
+    """
+    TimedJSONRenderer encoding with orjson (api.fast_json), same bytes.
+    Indented output (``?format=json`` with ``indent``, the browsable API) and
+    non-default UNICODE_JSON/COMPACT_JSON settings use the standard library.
+    """
+    
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if (self.ensure_ascii or not self.compact
+                or self.get_indent(accepted_media_type, renderer_context or {}) is not None):
+            return super().render(data, accepted_media_type, renderer_context)
+        with timed('render'):
+            return fast_json.dumps(data)
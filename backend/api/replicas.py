@@ -0,0 +1,182 @@
+"""
+Read-replica routing with read-your-writes stickiness
+
+``settings.READ_REPLICAS['ALIASES']`` names database aliases that stream
+from ``default``. GET/HEAD requests to the read-only actions a ViewSet lists
+in ``replica_read_actions`` (catalog, inventory and transaction history
+lists and details, stock availability) read from one of them, picked per
+request. Authentication and permission checks run before the switch, so
+users are always looked up on the primary. Everything else stays on
+``default``:
+
+- every write (ReplicaRouter.db_for_write), and every read after the first
+  INSERT/UPDATE/DELETE of a request or inside an atomic block on ``default``;
+- checkout, pricing and the other POST endpoints (only GETs are routed);
+- code running outside a request (management commands, background threads).
+
+Replicas lag the primary. A client that just changed something must not
+read the old state back, so a request that wrote (or any successful unsafe
+request) answers with a short-lived ``pos_read_primary`` cookie and an
+``X-Read-Primary: <seconds>`` header. Requests carrying either the cookie or
+an ``X-Read-Primary`` header read from the primary until it expires, and
+skip the response cache, which may hold a body computed on a lagging replica.
+
+Locally, point a second alias at a copy of the database (or at the same
+one) and list it in READ_REPLICAS to exercise the routing.
+"""
+import random
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DEFAULT_DB_ALIAS, connections
+
+DEFAULTS = {
+    # Database aliases of the replicas; routing is off without any
+    'ALIASES': [],
+    # How long a client reads from the primary after a write
+    'STICKY_SECONDS': 5,
+    'COOKIE_NAME': 'pos_read_primary',
+    'HEADER': 'X-Read-Primary',
+}
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# Statements that make a request stick to the primary (get_or_create and
+# select_for_update also route through db_for_write, but may only read)
+WRITE_STATEMENTS = ('INSERT', 'UPDATE', 'DELETE')
+
+# Routing state of the request being handled: {'replica': alias or None, 'wrote': bool}.
+# A dict rather than separate variables so writes seen in sync_to_async threads,
+# which run in a copy of the context, reach the middleware.
+_request_state = ContextVar('replica_routing', default=None)
+
+
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'READ_REPLICAS', {}))
+    return config
+
+
+def read_primary_requested(request):
+    """Whether the client asked (cookie or header) to read from the primary"""
+    config = get_config()
+    return bool(request.COOKIES.get(config['COOKIE_NAME']) or request.headers.get(config['HEADER']))
+
+
+def route_reads_to_replica(request):
+    """
+    Send the remaining reads of a GET/HEAD request to a replica, unless
+    replication is off, the client is pinned to the primary or the request
+    already wrote. Call once the request is authenticated and permitted.
+    """
+    state = _request_state.get()
+    if state is None or state['wrote'] or request.method not in ('GET', 'HEAD'):
+        return
+    aliases = get_config()['ALIASES']
+    if aliases and not read_primary_requested(request):
+        state['replica'] = random.choice(aliases)
+
+
+def record_write(execute, sql, params, many, context):
+    """Execute wrapper of the primary: note that the current request wrote"""
+    state = _request_state.get()
+    if state is not None and not state['wrote'] and sql.lstrip()[:6].upper() in WRITE_STATEMENTS:
+        state['wrote'] = True
+    return execute(sql, params, many, context)
+
+
+def install_write_hook(sender=None, connection=None, **kwargs):
+    """connection_created receiver attaching record_write to primary connections"""
+    if connection.alias == DEFAULT_DB_ALIAS and record_write not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_write)
+
+
+class ReplicaRouter:
+    """Database router for api.replicas (see module docstring)"""
+
+    def db_for_read(self, model, **hints):
+        state = _request_state.get()
+        if state is None or state['replica'] is None or state['wrote']:
+            return DEFAULT_DB_ALIAS
+        # Reads inside a transaction on the primary must see its uncommitted rows
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return state['replica']
+
+    def db_for_write(self, model, **hints):
+        # Explicit, so instances loaded from a replica are saved on the primary
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *get_config()['ALIASES']}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+
+class ReplicaReadMixin:
+    """
+    ViewSet mixin: GET/HEAD requests for ``replica_read_actions`` read from a
+    replica once authenticated and permitted (api.replicas)
+    """
+
+    replica_read_actions = ('list', 'retrieve')
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if self.action in self.replica_read_actions:
+            route_reads_to_replica(request)
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Track the replica routing of each request and pin clients that wrote
+    to the primary for STICKY_SECONDS. Removed from the middleware chain
+    unless READ_REPLICAS['ALIASES'] names at least one alias.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not get_config()['ALIASES']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        state = {'replica': None, 'wrote': False}
+        token = _request_state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_state.reset(token)
+        return self._finish(request, response, state)
+
+    async def __acall__(self, request):
+        state = {'replica': None, 'wrote': False}
+        token = _request_state.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_state.reset(token)
+        return self._finish(request, response, state)
+
+    @staticmethod
+    def _finish(request, response, state):
+        succeeded = response.status_code < 400 and request.method not in SAFE_METHODS
+        if state['wrote'] or succeeded:
+            config = get_config()
+            seconds = config['STICKY_SECONDS']
+            response.set_cookie(
+                config['COOKIE_NAME'], '1', max_age=seconds,
+                secure=settings.SESSION_COOKIE_SECURE, httponly=True, samesite='Lax',
+            )
+            response[config['HEADER']] = str(seconds)
+        return response
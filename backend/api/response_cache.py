@@ -0,0 +1,453 @@
+"""
+Rendered-response cache for catalog GET endpoints
+
+Catalog reads (products, categories, variants, add-ons) return the same
+bytes to every terminal until something in the catalog changes, yet each
+request re-runs the queries, the serializers and, with payload encryption
+on, the encryption. ResponseCacheMiddleware stores the final response bytes
+(after EncryptionMiddleware) keyed by the absolute URL (path and query
+string) and the caller's visibility class: anonymous, staff (Admin and
+Super Admin, who also see inactive rows) or other authenticated users.
+
+Only responses whose view opted in are stored. Views mark a response
+cacheable with ``mark_cacheable(request, tags)`` (ViewSets do this through
+ResponseCacheMixin.response_cache_tags), naming the entities it contains:
+
+- ``product``, ``category``, ... for "any row of that model", used by lists;
+- ``product:12``, ``category:3``, ... for a single row, used by details;
+- ``addon:global`` for the add-ons offered with every product.
+
+Model signals (and api.stock for set-based stock updates) invalidate the
+tags of every row they touch once the change commits. Invalidation bumps a
+per-tag version token; an entry is served only while all of its tags still
+have the version it was stored with, so backends need no tag enumeration:
+
+- ``locmem``: per process (other workers see changes after TTL seconds);
+- ``file``: shared by the processes of one host through a directory;
+- ``django``: a Django cache alias (e.g. Redis), shared by every host.
+
+A response computed while a change commits can still be stored with the new
+tag versions; such entries are bounded by the TTL.
+"""
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import transaction
+from django.http import HttpResponse
+from rest_framework.exceptions import AuthenticationFailed
+
+from .replicas import read_primary_requested
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': True,
+    # 'locmem', 'file' or 'django'
+    'BACKEND': 'locmem',
+    'TTL': 30,
+    # locmem: entries kept per process
+    'MAX_ENTRIES': 2000,
+    # file: directory shared by the processes of one host
+    'LOCATION': os.path.join(tempfile.gettempdir(), 'pos-response-cache'),
+    # django: name of the CACHES alias
+    'CACHE_ALIAS': 'default',
+}
+
+# Headers stored with the body; the rest are added by outer middleware on every request
+STORED_HEADERS = ('Content-Type', 'Vary', 'Allow')
+
+# Added to every entry: changing the encryption settings changes every body
+ENCRYPTION_TAG = 'encryption'
+
+
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'RESPONSE_CACHE', {}))
+    return config
+
+
+class LocMemStore:
+    """Thread-safe LRU dictionary with per-key expiry"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get_many(self, keys):
+        found = {}
+        now = time.monotonic()
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+                if entry[0] is not None and entry[0] <= now:
+                    del self._entries[key]
+                    continue
+                self._entries.move_to_end(key)
+                found[key] = entry[1]
+        return found
+
+    def set(self, key, value, ttl=None):
+        expires = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class FileStore:
+    """One pickle file per key in a directory, replaced atomically"""
+
+    def __init__(self, location):
+        self.location = location
+        os.makedirs(location, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.location, hashlib.sha256(key.encode('utf-8')).hexdigest())
+
+    def get_many(self, keys):
+        found = {}
+        now = time.time()
+        for key in keys:
+            try:
+                with open(self._path(key), 'rb') as f:
+                    expires, value = pickle.load(f)
+            except (OSError, EOFError, pickle.UnpicklingError):
+                continue
+            if expires is None or expires > now:
+                found[key] = value
+        return found
+
+    def set(self, key, value, ttl=None):
+        expires = time.time() + ttl if ttl else None
+        fd, temp_path = tempfile.mkstemp(dir=self.location)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump((expires, value), f, pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, self._path(key))
+        except OSError:
+            logger.warning('Could not write response cache file', exc_info=True)
+            try:
+                os.unlink(temp_path)
+            except OSError:
+                pass
+
+
+class DjangoCacheStore:
+    """A Django cache alias (Redis, memcached, ...) shared by every process"""
+
+    def __init__(self, alias):
+        from django.core.cache import caches
+        self.cache = caches[alias]
+
+    def get_many(self, keys):
+        return self.cache.get_many(list(keys))
+
+    def set(self, key, value, ttl=None):
+        self.cache.set(key, value, timeout=ttl)
+
+
+def _build_store(config):
+    backend = config['BACKEND']
+    if backend == 'locmem':
+        return LocMemStore(config['MAX_ENTRIES'])
+    if backend == 'file':
+        return FileStore(config['LOCATION'])
+    if backend == 'django':
+        return DjangoCacheStore(config['CACHE_ALIAS'])
+    raise ValueError(f'Unknown RESPONSE_CACHE backend: {backend}')
+
+
+class ResponseCache:
+    """Tag-versioned response store on top of a pluggable backend"""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.invalidations = 0
+        self._store = None
+        self._store_lock = threading.Lock()
+
+    @property
+    def store(self):
+        if self._store is None:
+            with self._store_lock:
+                if self._store is None:
+                    self._store = _build_store(get_config())
+        return self._store
+
+    def reset(self):
+        """Drop the backend (and with locmem every entry); rebuilt from settings on next use"""
+        with self._store_lock:
+            self._store = None
+
+    @staticmethod
+    def _tag_key(tag):
+        return f'pos:rc:tag:{tag}'
+
+    @staticmethod
+    def _entry_key(key):
+        return f'pos:rc:entry:{hashlib.sha256(key.encode("utf-8")).hexdigest()}'
+
+    def get(self, key):
+        """The stored (status, content, headers) for ``key`` if none of its tags changed since"""
+        entry_key = self._entry_key(key)
+        entry = self.store.get_many([entry_key]).get(entry_key)
+        if entry is not None:
+            tag_versions = entry['tags']
+            current = self.store.get_many([self._tag_key(tag) for tag in tag_versions])
+            if all(current.get(self._tag_key(tag)) == version for tag, version in tag_versions.items()):
+                self.hits += 1
+                return entry['status'], entry['content'], entry['headers']
+        self.misses += 1
+        return None
+
+    def set(self, key, response, tags):
+        tags = set(tags) | {ENCRYPTION_TAG}
+        tag_keys = {tag: self._tag_key(tag) for tag in tags}
+        current = self.store.get_many(tag_keys.values())
+        versions = {}
+        for tag, tag_key in tag_keys.items():
+            version = current.get(tag_key)
+            if version is None:
+                # Tags are never expired deliberately; an evicted tag just gets a new version
+                version = uuid.uuid4().hex[:12]
+                self.store.set(tag_key, version)
+            versions[tag] = version
+        self.store.set(self._entry_key(key), {
+            'status': response.status_code,
+            'content': response.content,
+            'headers': [(name, response[name]) for name in STORED_HEADERS if response.has_header(name)],
+            'tags': versions,
+        }, get_config()['TTL'])
+        self.stores += 1
+
+    def invalidate(self, *tags):
+        """Make every entry tagged with any of ``tags`` stale"""
+        for tag in set(tags):
+            self.store.set(self._tag_key(tag), uuid.uuid4().hex[:12])
+        self.invalidations += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'stores': self.stores,
+            'invalidations': self.invalidations,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+        }
+
+
+response_cache = ResponseCache()
+
+
+def mark_cacheable(request, tags):
+    """Let ResponseCacheMiddleware store this request's response, tagged with ``tags``"""
+    request = getattr(request, '_request', request)
+    request.response_cache_tags = set(tags)
+
+
+def invalidate_on_commit(*tags):
+    """Invalidate ``tags`` once the current transaction commits (at once outside one)"""
+    if tags and get_config()['ENABLED']:
+        transaction.on_commit(lambda: response_cache.invalidate(*tags))
+
+
+class ResponseCacheMixin:
+    """
+    ViewSet mixin: successful GET responses are stored by the response cache,
+    tagged with ``response_cache_tags(data)`` (which views must implement)
+    """
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        if request.method == 'GET' and response.status_code == 200 and response.data is not None:
+            mark_cacheable(request, self.response_cache_tags(response.data))
+        return super().finalize_response(request, response, *args, **kwargs)
+
+    def response_cache_tags(self, data):
+        raise NotImplementedError
+
+
+def visibility(request):
+    """
+    'anonymous', 'staff' or 'user', or None when the request must not be
+    served from the cache (invalid credentials, session authentication)
+    """
+    from .authentication import CachedJWTAuthentication
+
+    if request.COOKIES.get(settings.SESSION_COOKIE_NAME):
+        return None
+    try:
+        result = CachedJWTAuthentication().authenticate(request)
+    except AuthenticationFailed:
+        return None
+    if result is None:
+        return None if request.headers.get('Authorization') else 'anonymous'
+    user = result[0]
+    return 'staff' if user.is_super_admin or user.is_admin else 'user'
+
+
+class ResponseCacheMiddleware:
+    """
+    Serve cached catalog GET responses (see module docstring). Sits just
+    outside EncryptionMiddleware so stored bodies are already encrypted.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not get_config()['ENABLED']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        key, cached = self._lookup(request)
+        if cached is not None:
+            return cached
+        return self._store(request, key, self.get_response(request))
+
+    async def __acall__(self, request):
+        key, cached = await sync_to_async(self._lookup)(request)
+        if cached is not None:
+            return cached
+        response = await self.get_response(request)
+        return await sync_to_async(self._store)(request, key, response)
+
+    @staticmethod
+    def _cache_key(request):
+        if request.method != 'GET' or not request.path.startswith('/api/'):
+            return None
+        # Browsable API and ?format= responses are not cached
+        if 'format' in request.GET or 'text/html' in request.headers.get('Accept', ''):
+            return None
+        # Clients that just wrote read from the primary, not from bodies a replica produced
+        if read_primary_requested(request):
+            return None
+        role = visibility(request)
+        if role is None:
+            return None
+        return f'{role} {request.build_absolute_uri()}'
+
+    def _lookup(self, request):
+        try:
+            key = self._cache_key(request)
+            entry = response_cache.get(key) if key else None
+        except Exception:
+            logger.warning('Response cache lookup failed', exc_info=True)
+            return None, None
+        if entry is None:
+            return key, None
+
+        status_code, content, headers = entry
+        response = HttpResponse(content, status=status_code)
+        for name, value in headers:
+            response[name] = value
+        response['X-Cache'] = 'HIT'
+        return key, response
+
+    def _store(self, request, key, response):
+        tags = getattr(request, 'response_cache_tags', None)
+        if key is None or tags is None or response.status_code != 200 or response.streaming:
+            return response
+        try:
+            response_cache.set(key, response, tags)
+        except Exception:
+            logger.warning('Response cache store failed', exc_info=True)
+            return response
+        response['X-Cache'] = 'MISS'
+        return response
+
+
+def _instance_tags(sender, instance):
+    from .catalog_cache import addon_index
+    from .models import AddOn, Category, EncryptionSettings, Inventory, Product, Variant
+
+    if sender is Category:
+        return {'category', f'category:{instance.pk}'}
+    if sender is Product:
+        tags = {'product', f'product:{instance.pk}', f'category:{instance.category_id}'}
+        # The active product count of the category it moved out of changes too
+        previous = getattr(instance, '_response_cache_previous_category', None)
+        if previous:
+            tags.add(f'category:{previous}')
+        return tags
+    if sender is Variant:
+        return {'variant', f'variant:{instance.pk}', f'product:{instance.product_id}'}
+    if sender is Inventory:
+        return {'inventory', f'product:{instance.product_id}'}
+    if sender is AddOn:
+        tags = {'addon', f'addon:{instance.pk}'}
+        record = addon_index.get_many([instance.pk]).get(instance.pk)
+        if record is None or not record.product_ids:
+            tags.add('addon:global')
+        else:
+            tags.update(f'product:{product_id}' for product_id in record.product_ids)
+        return tags
+    if sender is EncryptionSettings:
+        return {ENCRYPTION_TAG}
+    return set()
+
+
+def remember_previous_category(sender, instance, **kwargs):
+    """pre_save receiver for Product"""
+    if instance.pk and not kwargs.get('raw'):
+        instance._response_cache_previous_category = (
+            sender.objects.filter(pk=instance.pk).values_list('category_id', flat=True).first()
+        )
+
+
+def invalidate_cached_responses(sender, instance, **kwargs):
+    """post_save/post_delete receiver for the catalog models and EncryptionSettings"""
+    invalidate_on_commit(*_instance_tags(sender, instance))
+
+
+def invalidate_cached_addon_responses(sender, instance, action, reverse, pk_set, **kwargs):
+    """m2m_changed receiver for AddOn.applicable_products"""
+    from .catalog_cache import addon_index
+
+    if not action.startswith('post_'):
+        return
+    # Which add-ons are global may have changed either way
+    tags = {'addon', 'addon:global'}
+    if reverse:
+        tags.add(f'product:{instance.pk}')
+        addon_ids = pk_set or addon_index.product_specific_ids(instance.pk)
+    else:
+        addon_ids = [instance.pk]
+        tags.update(f'product:{product_id}' for product_id in pk_set or ())
+    tags.update(f'addon:{addon_id}' for addon_id in addon_ids)
+    invalidate_on_commit(*tags)
+
+
+def collect_metrics():
+    """Response cache statistics for the Prometheus endpoint (api.metrics)"""
+    stats = response_cache.stats()
+    return [
+        ('pos_response_cache_lookups_total', 'counter', 'Response cache lookups by result',
+         [({'result': 'hit'}, stats['hits']), ({'result': 'miss'}, stats['misses'])]),
+        ('pos_response_cache_stores_total', 'counter', 'Responses stored in the response cache',
+         [({}, stats['stores'])]),
+        ('pos_response_cache_invalidations_total', 'counter', 'Tag invalidations applied',
+         [({}, stats['invalidations'])]),
+    ]
@@ -0,0 +1,277 @@
+"""
+values()-based serialization for hot list endpoints
+
+At 100+ rows a page, a ModelSerializer spends more CPU than the SQL takes:
+it instantiates a model per row, resolves every field through
+``get_attribute`` and formats each value with the field class. A
+RowSerializer produces the same JSON from ``QuerySet.values()`` dicts
+instead. The columns are derived from the ModelSerializer's field sources
+(``category.name`` becomes ``category__name``). Model properties
+(``current_stock``, ``is_low_stock``) are replaced by annotations. Each
+field gets its converter once per class.
+
+Only field types whose output is reproduced exactly have fast converters;
+any other field falls back to its own ``to_representation``. Viewsets opt in
+through RowListMixin, and ``manage.py benchmark_serializers`` checks that both
+paths render identical bytes.
+"""
+import decimal
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import BooleanField, ExpressionWrapper, F, IntegerField, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from rest_framework import fields as drf_fields
+from rest_framework import serializers
+from rest_framework.fields import empty
+from rest_framework.relations import PrimaryKeyRelatedField
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+from .metrics import timed
+from .models import Inventory
+from .serializers import InventorySerializer, ProductListSerializer, RefundSerializer, TransactionSerializer
+
+# Marks a field DRF leaves out of the output (SkipField) when its relation is null
+SKIP = object()
+
+
+def _identity(value):
+    return value
+
+
+class RowSerializer:
+    """
+    Reproduce ``serializer_class``'s read output from values() rows.
+
+    ``annotations`` maps field names backed by model properties to query
+    expressions computing the same value. ``nested`` maps many=True nested
+    serializer fields to (RowSerializer class, foreign key on the child);
+    children are loaded with one query per page.
+    """
+
+    serializer_class = None
+    annotations = {}
+    nested = {}
+
+    def __init__(self, context=None):
+        self.context = context or {}
+        self.request = self.context.get('request')
+        self.plan = self._plan()
+        # Resolved per instance: the current timezone and the request differ between
+        # requests, and fallback fields read the request from their serializer's context
+        fields = self.serializer_class(context=self.context).fields
+        self.converters = [self._converter(fields[name]) for name, _, _, _, _ in self.plan]
+
+    @classmethod
+    def _plan(cls):
+        """(name, column, fk column, value when the relation is null, field) per output field"""
+        plan = cls.__dict__.get('_cached_plan')
+        if plan is not None:
+            return plan
+
+        plan = []
+        for field in cls.serializer_class()._readable_fields:
+            name = field.field_name
+            if name in cls.nested:
+                plan.append((name, 'id', None, None, field))
+                continue
+            if name in cls.annotations:
+                plan.append((name, name, None, None, field))
+                continue
+            if isinstance(field, (serializers.SerializerMethodField, serializers.ManyRelatedField,
+                                  serializers.BaseSerializer)):
+                raise ImproperlyConfigured(
+                    f'{cls.__name__} cannot build {field.__class__.__name__} {name!r} from values()'
+                )
+            attrs = field.source_attrs
+            fk_column = missing = None
+            if len(attrs) > 1:
+                # DRF's get_attribute fails on a null relation: default, null or left out
+                fk_column = attrs[0]
+                if field.default is not empty:
+                    missing = field.get_default()
+                elif field.allow_null:
+                    missing = None
+                else:
+                    missing = SKIP
+            plan.append((name, '__'.join(attrs), fk_column, missing, field))
+
+        cls._cached_plan = plan
+        return plan
+
+    def _converter(self, field):
+        if field.field_name in self.nested:
+            return None
+        if isinstance(field, (drf_fields.CharField, drf_fields.ChoiceField, drf_fields.JSONField,
+                              drf_fields.ReadOnlyField, PrimaryKeyRelatedField)):
+            return _identity
+        if isinstance(field, drf_fields.BooleanField):
+            return bool
+        if isinstance(field, drf_fields.IntegerField):
+            return int
+        if isinstance(field, drf_fields.DecimalField):
+            return self._decimal_converter(field)
+        if isinstance(field, drf_fields.DateTimeField):
+            return self._datetime_converter(field)
+        if isinstance(field, drf_fields.FileField):
+            return self._file_converter(field)
+        return field.to_representation
+
+    @staticmethod
+    def _decimal_converter(field):
+        if (field.decimal_places is None or field.normalize_output or field.localize
+                or not getattr(field, 'coerce_to_string', api_settings.COERCE_DECIMAL_TO_STRING)):
+            return field.to_representation
+
+        exponent = decimal.Decimal('.1') ** field.decimal_places
+        context = decimal.getcontext().copy()
+        if field.max_digits is not None:
+            context.prec = field.max_digits
+        rounding = field.rounding
+
+        def convert(value):
+            if not isinstance(value, decimal.Decimal):
+                value = decimal.Decimal(str(value).strip())
+            return f'{value.quantize(exponent, rounding=rounding, context=context):f}'
+        return convert
+
+    @staticmethod
+    def _datetime_converter(field):
+        output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+        tz = field.timezone if hasattr(field, 'timezone') else field.default_timezone()
+        if output_format is None or output_format.lower() != drf_fields.ISO_8601 or tz is None:
+            return field.to_representation
+
+        def convert(value):
+            value = value.astimezone(tz).isoformat()
+            if value.endswith('+00:00'):
+                value = value[:-6] + 'Z'
+            return value
+        return convert
+
+    def _file_converter(self, field):
+        if not getattr(field, 'use_url', api_settings.UPLOADED_FILES_USE_URL):
+            return _identity
+        model = self.serializer_class.Meta.model
+        storage = model._meta.get_field(field.source).storage
+        request = self.request
+
+        def convert(value):
+            if not value:
+                return None
+            url = storage.url(value)
+            return request.build_absolute_uri(url) if request is not None else url
+        return convert
+
+    def columns(self):
+        columns = {column for _, column, _, _, _ in self.plan}
+        columns.update(fk_column for _, _, fk_column, _, _ in self.plan if fk_column)
+        return sorted(columns)
+
+    def values(self, queryset, *extra):
+        """``queryset`` as the dict rows this serializer reads (plus ``extra`` columns)"""
+        return (
+            queryset.prefetch_related(None)
+            .annotate(**self.annotations)
+            .values(*self.columns(), *extra)
+        )
+
+    def _children(self, rows):
+        children = {}
+        parent_ids = [row['id'] for row in rows]
+        for name, (row_serializer_class, fk) in self.nested.items():
+            child = row_serializer_class(self.context)
+            model = child.serializer_class.Meta.model
+            grouped = children[name] = {parent_id: [] for parent_id in parent_ids}
+            if not parent_ids:
+                continue
+            queryset = child.values(model._default_manager.filter(**{f'{fk}__in': parent_ids}), fk)
+            for child_row in queryset:
+                grouped[child_row[fk]].append(child.to_representation(child_row))
+        return children
+
+    def to_representation(self, row, children=None):
+        data = {}
+        for (name, column, fk_column, missing, _), convert in zip(self.plan, self.converters):
+            if convert is None:
+                data[name] = children[name][row['id']]
+                continue
+            if fk_column is not None and row[fk_column] is None:
+                if missing is SKIP:
+                    continue
+                value = missing
+            else:
+                value = row[column]
+            data[name] = None if value is None else convert(value)
+        return data
+
+    def serialize(self, rows):
+        """The list ``serializer_class(many=True).data`` would return for these rows"""
+        with timed('serialize'):
+            rows = list(rows)
+            children = self._children(rows) if self.nested else None
+            return [self.to_representation(row, children) for row in rows]
+
+
+class ProductRowSerializer(RowSerializer):
+    serializer_class = ProductListSerializer
+    annotations = {
+        # Product.current_stock sums the product's inventories (0 without any)
+        'current_stock': Coalesce(
+            Subquery(
+                Inventory.objects.filter(product=OuterRef('pk'))
+                .order_by()
+                .values('product')
+                .annotate(total=Sum('quantity'))
+                .values('total')
+            ),
+            Value(0),
+            output_field=IntegerField(),
+        ),
+    }
+
+
+class InventoryRowSerializer(RowSerializer):
+    serializer_class = InventorySerializer
+    annotations = {
+        'is_low_stock': ExpressionWrapper(Q(quantity__lte=F('low_stock_threshold')), output_field=BooleanField()),
+        'is_out_of_stock': ExpressionWrapper(Q(quantity__lte=0), output_field=BooleanField()),
+    }
+
+
+class RefundRowSerializer(RowSerializer):
+    serializer_class = RefundSerializer
+
+
+class TransactionRowSerializer(RowSerializer):
+    serializer_class = TransactionSerializer
+    nested = {'refunds': (RefundRowSerializer, 'transaction')}
+
+
+class RowListMixin:
+    """
+    ViewSet mixin: ``list`` builds its response with ``row_serializer_class``
+    (off with ROW_SERIALIZERS=False)
+    """
+
+    row_serializer_class = None
+
+    def get_row_serializer(self):
+        if not settings.ROW_SERIALIZERS:
+            return None
+        return self.row_serializer_class(self.get_serializer_context())
+
+    def list_rows(self, queryset, row_serializer):
+        """Paginated response of ``queryset`` rendered from values() rows"""
+        rows = row_serializer.values(queryset)
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(row_serializer.serialize(page))
+        return Response(row_serializer.serialize(rows))
+
+    def list(self, request, *args, **kwargs):
+        row_serializer = self.get_row_serializer()
+        if row_serializer is None:
+            return super().list(request, *args, **kwargs)
+        return self.list_rows(self.filter_queryset(self.get_queryset()), row_serializer)
@@ -1,12 +1,25 @@
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
 from django.contrib.auth.password_validation import validate_password
-from .models import Category, Product, Variant, AddOn, Inventory, Transaction
+from .models import (
+    Category, Product, Variant, AddOn, Inventory, InventoryMovement, Location, Terminal, Transaction, Refund
+)
+from .catalog_cache import addon_index
+from .images import derivative_urls
+from .metrics import timed
 
 User = get_user_model()
 
 
-class UserSerializer(serializers.ModelSerializer):
+class TimedSerializerMixin:
+    """Report representation time to the request metrics"""
+    
+    def to_representation(self, instance):
+        with timed('serialize'):
+            return super().to_representation(instance)
+
+
+class UserSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """Serializer for User model"""
     
     class Meta:
@@ -14,9 +27,10 @@ class UserSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'username', 'email', 'first_name', 'last_name',
             'role', 'is_verified', 'phone_number', 'address',
-            'date_joined', 'is_active'
+            'location', 'date_joined', 'is_active'
         ]
-        read_only_fields = ['id', 'date_joined', 'is_verified']
+        # Locations are assigned by an admin
+        read_only_fields = ['id', 'date_joined', 'is_verified', 'location']
 
 
 class RegisterSerializer(serializers.ModelSerializer):
@@ -94,24 +108,67 @@ class VerifyUserSerializer(serializers.Serializer):
     is_verified = serializers.BooleanField(required=True)
 
 
+# Location Serializers
+
+class LocationSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    """Serializer for Location model"""
+    
+    class Meta:
+        model = Location
+        fields = ['id', 'name', 'code', 'kind', 'address', 'is_active', 'created_at', 'updated_at']
+        read_only_fields = ['id', 'created_at', 'updated_at']
+
+
+class TerminalSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    """Serializer for Terminal model"""
+    
+    location_name = serializers.CharField(source='location.name', read_only=True)
+    
+    class Meta:
+        model = Terminal
+        fields = ['id', 'code', 'name', 'location', 'location_name', 'is_active', 'created_at', 'updated_at']
+        read_only_fields = ['id', 'location_name', 'created_at', 'updated_at']
+
+
 # Product Management Serializers
 
-class CategorySerializer(serializers.ModelSerializer):
+class ImageVariantsField(serializers.Field):
+    """
+    URLs of the resized derivatives of ``image`` (api.images): one size, or
+    every size by name when ``size`` is None. None until they are generated.
+    """
+    
+    def __init__(self, size=None, **kwargs):
+        self.size = size
+        kwargs.setdefault('source', 'image_variants')
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+    
+    def to_representation(self, value):
+        return derivative_urls(value, self.size, self.context.get('request'))
+
+
+class CategorySerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """Serializer for Category model"""
     
     product_count = serializers.SerializerMethodField()
+    thumbnail = ImageVariantsField(size='thumb')
     
     class Meta:
         model = Category
-        fields = ['id', 'name', 'description', 'image', 'is_active', 'product_count', 'created_at', 'updated_at']
+        fields = ['id', 'name', 'description', 'image', 'thumbnail', 'is_active', 'product_count', 'created_at', 'updated_at']
         read_only_fields = ['id', 'created_at', 'updated_at']
     
     def get_product_count(self, obj):
         """Get count of active products in category"""
+        # Annotated by CategoryViewSet to avoid one COUNT query per category
+        count = getattr(obj, 'active_product_count', None)
+        if count is not None:
+            return count
         return obj.products.filter(is_active=True).count()
 
 
-class VariantSerializer(serializers.ModelSerializer):
+class VariantSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """Serializer for Variant model"""
     
     final_price = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
@@ -122,7 +179,7 @@ class VariantSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'final_price', 'created_at', 'updated_at']
 
 
-class AddOnSerializer(serializers.ModelSerializer):
+class AddOnSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """Serializer for AddOn model"""
     
     class Meta:
@@ -131,33 +188,58 @@ class AddOnSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'created_at', 'updated_at']
 
 
-class InventorySerializer(serializers.ModelSerializer):
+class InventorySerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """Serializer for Inventory model"""
     
     is_low_stock = serializers.BooleanField(read_only=True)
     is_out_of_stock = serializers.BooleanField(read_only=True)
     product_name = serializers.CharField(source='product.name', read_only=True)
     variant_name = serializers.CharField(source='variant.name', read_only=True, allow_null=True)
+    # Records created without a location go to the default one
+    location = serializers.PrimaryKeyRelatedField(queryset=Location.objects.all(), default=Location.get_default)
+    location_name = serializers.CharField(source='location.name', read_only=True)
     
     class Meta:
         model = Inventory
-        fields = ['id', 'product', 'product_name', 'variant', 'variant_name', 'quantity', 'low_stock_threshold', 'is_low_stock', 'is_out_of_stock', 'last_restocked', 'created_at', 'updated_at']
-        read_only_fields = ['id', 'is_low_stock', 'is_out_of_stock', 'product_name', 'variant_name', 'created_at', 'updated_at']
+        fields = ['id', 'location', 'location_name', 'product', 'product_name', 'variant', 'variant_name', 'quantity', 'low_stock_threshold', 'is_low_stock', 'is_out_of_stock', 'last_restocked', 'created_at', 'updated_at']
+        read_only_fields = ['id', 'is_low_stock', 'is_out_of_stock', 'location_name', 'product_name', 'variant_name', 'created_at', 'updated_at']
+
+
+class InventoryMovementSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    """Serializer for InventoryMovement model (ledger entries are never edited)"""
+    
+    user_name = serializers.CharField(source='user.username', read_only=True, default=None)
+    
+    class Meta:
+        model = InventoryMovement
+        fields = ['id', 'inventory', 'kind', 'quantity', 'reference', 'user', 'user_name', 'created_at']
+        read_only_fields = fields
+
+
+def applicable_addons(product_id):
+    """Queryset of the add-ons applicable to a product, looked up by primary key"""
+    return (
+        AddOn.objects.filter(id__in=addon_index.ids_for_product(product_id))
+        .prefetch_related('applicable_products')
+        .order_by('name', 'id')
+    )
 
 
-class ProductListSerializer(serializers.ModelSerializer):
+class ProductListSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """Serializer for Product list view"""
     
     category_name = serializers.CharField(source='category.name', read_only=True)
     current_stock = serializers.IntegerField(read_only=True)
+    # Grid tiles: 480px covers the card width on 2x screens
+    thumbnail = ImageVariantsField(size='medium')
     
     class Meta:
         model = Product
-        fields = ['id', 'name', 'sku', 'category', 'category_name', 'base_price', 'image', 'is_taxable', 'is_active', 'current_stock', 'created_at']
+        fields = ['id', 'name', 'sku', 'category', 'category_name', 'base_price', 'image', 'thumbnail', 'is_taxable', 'is_active', 'current_stock', 'created_at']
         read_only_fields = ['id', 'category_name', 'current_stock', 'created_at']
 
 
-class ProductDetailSerializer(serializers.ModelSerializer):
+class ProductDetailSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """Serializer for Product detail view with related data"""
     
     category = CategorySerializer(read_only=True)
@@ -167,27 +249,51 @@ class ProductDetailSerializer(serializers.ModelSerializer):
         write_only=True
     )
     variants = VariantSerializer(many=True, read_only=True)
-    available_addons = AddOnSerializer(many=True, read_only=True)
+    available_addons = serializers.SerializerMethodField()
     inventories = InventorySerializer(many=True, read_only=True)
     current_stock = serializers.IntegerField(read_only=True)
+    images = ImageVariantsField()
     
     class Meta:
         model = Product
-        fields = ['id', 'name', 'description', 'category', 'category_id', 'base_price', 'image', 'sku', 'is_taxable', 'is_active', 'variants', 'available_addons', 'inventories', 'current_stock', 'created_at', 'updated_at']
+        fields = ['id', 'name', 'description', 'category', 'category_id', 'base_price', 'image', 'images', 'sku', 'is_taxable', 'is_active', 'variants', 'available_addons', 'inventories', 'current_stock', 'created_at', 'updated_at']
         read_only_fields = ['id', 'current_stock', 'created_at', 'updated_at']
+    
+    def get_available_addons(self, obj):
+        """Global add-ons (no applicable products) and those restricted to this product"""
+        addons = getattr(obj, 'applicable_addons', None)
+        if addons is None:
+            addons = applicable_addons(obj.id)
+        return AddOnSerializer(addons, many=True, context=self.context).data
+
+
+class RefundSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    """Serializer for Refund model"""
+    
+    processed_by_name = serializers.CharField(source='processed_by.username', read_only=True, default=None)
+    
+    class Meta:
+        model = Refund
+        fields = [
+            'id', 'refund_number', 'kind', 'processed_by', 'processed_by_name',
+            'items', 'exchange_items', 'amount', 'reason', 'created_at'
+        ]
+        read_only_fields = fields
 
 
-class TransactionSerializer(serializers.ModelSerializer):
+class TransactionSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """Serializer for Transaction model"""
     
     cashier_name = serializers.CharField(source='cashier.username', read_only=True)
+    refunds = RefundSerializer(many=True, read_only=True)
     
     class Meta:
         model = Transaction
         fields = [
             'id', 'transaction_number', 'cashier', 'cashier_name',
+            'location', 'terminal',
             'cart_items', 'subtotal', 'tax', 'total',
             'amount_paid', 'change_given', 'payment_method',
-            'status', 'notes', 'created_at', 'updated_at'
+            'status', 'notes', 'refunds', 'client_id', 'created_at', 'updated_at'
         ]
-        read_only_fields = ['id', 'transaction_number', 'change_given', 'created_at', 'updated_at']
+        read_only_fields = ['id', 'transaction_number', 'location', 'terminal', 'change_given', 'client_id', 'created_at', 'updated_at']
@@ -0,0 +1,141 @@
+"""
+Set-based stock adjustments
+
+Applies quantity changes for many (product, variant) pairs of one location
+with a constant number of statements instead of one lookup and save per cart
+line. Every change is recorded in the inventory ledger (api.ledger); in its
+deferred mode recording it is all that happens here.
+"""
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Q, Value, When
+from django.utils import timezone
+
+from . import ledger
+from .models import Inventory, InventoryMovement, Location
+from .response_cache import invalidate_on_commit
+
+
+def stock_key(item):
+    """(product_id, variant_id) of a cart item as sent by the POS frontend"""
+    variant = item.get('variant') or {}
+    variant_id = variant.get('id')
+    return int(item['product']['id']), int(variant_id) if variant_id else None
+
+
+def _match(product_id, variant_id):
+    if variant_id:
+        return Q(product_id=product_id, variant_id=variant_id)
+    return Q(product_id=product_id, variant__isnull=True)
+
+
+def _movement(inventory_id, quantity, kind, reference, user):
+    return InventoryMovement(
+        inventory_id=inventory_id, kind=kind, quantity=quantity, reference=reference[:100], user=user,
+    )
+
+
+def adjust_stock(deltas, kind, create_missing=False, reference='', user=None, itemized=None, location_id=None):
+    """
+    Add ``deltas`` ({(product_id, variant_id): quantity}) to the inventory of
+    ``location_id`` (default: the default location, api.locations) and
+    record them as ``kind`` movements (InventoryMovement.KIND_CHOICES).
+
+    Runs inside the caller's transaction: one SELECT ... FOR UPDATE that locks
+    the affected rows in id order (so concurrent adjustments cannot deadlock),
+    one UPDATE and, with ``create_missing``, one INSERT for pairs without an
+    inventory row (mirroring checkout, which tracks oversold stock as negative
+    quantities). Pairs without a row are otherwise skipped. In the ledger's
+    deferred mode there is no lock and no UPDATE.
+
+    ``itemized`` ([(key, quantity, reference)], summing to ``deltas``) records
+    one movement per item instead of one per pair, e.g. per offline sale.
+    """
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    deferred = ledger.is_deferred()
+    if location_id is None:
+        location_id = Location.get_default().pk
+
+    condition = Q()
+    for product_id, variant_id in deltas:
+        condition |= _match(product_id, variant_id)
+
+    queryset = Inventory.objects.filter(condition, location_id=location_id)
+    if not deferred:
+        queryset = queryset.select_for_update().order_by('id')
+    existing = {
+        (product_id, variant_id): inventory_id
+        for inventory_id, product_id, variant_id in queryset.values_list('id', 'product_id', 'variant_id')
+    }
+
+    if existing and not deferred:
+        whens = [
+            When(_match(product_id, variant_id), then=Value(deltas[(product_id, variant_id)]))
+            for product_id, variant_id in existing
+        ]
+        Inventory.objects.filter(condition, location_id=location_id).update(
+            quantity=F('quantity') + Case(*whens, default=Value(0), output_field=IntegerField()),
+            updated_at=timezone.now(),
+        )
+
+    if create_missing:
+        # Deferred mode: the movement brings the new row to its quantity at compaction
+        created = Inventory.objects.bulk_create([
+            Inventory(location_id=location_id, product_id=product_id, variant_id=variant_id,
+                      quantity=0 if deferred else delta, low_stock_threshold=10)
+            for (product_id, variant_id), delta in deltas.items()
+            if (product_id, variant_id) not in existing
+        ])
+        existing.update({(inventory.product_id, inventory.variant_id): inventory.id for inventory in created})
+
+    items = itemized if itemized is not None else [(key, delta, reference) for key, delta in deltas.items()]
+    ledger.record([
+        _movement(existing[key], quantity, kind, item_reference, user)
+        for key, quantity, item_reference in items
+        if quantity and key in existing
+    ])
+
+    # update() and bulk_create() send no signals
+    if not deferred:
+        invalidate_on_commit('inventory', *{f'product:{product_id}' for product_id, _ in deltas})
+
+
+def _locked_stock(inventory):
+    """(queryset of ``inventory``, its current stock); locks the row unless the ledger is deferred"""
+    queryset = Inventory.objects.filter(pk=inventory.pk)
+    if not ledger.is_deferred():
+        queryset = queryset.select_for_update()
+    quantity = queryset.values_list('quantity', flat=True).get()
+    return queryset, quantity + ledger.pending_by_inventory([inventory.pk]).get(inventory.pk, 0)
+
+
+def _apply(inventory, queryset, delta, kind, reference, user):
+    if not delta:
+        return
+    if not ledger.is_deferred():
+        queryset.update(quantity=F('quantity') + delta, updated_at=timezone.now())
+        invalidate_on_commit('inventory', f'product:{inventory.product_id}')
+    ledger.record([_movement(inventory.pk, delta, kind, reference, user)])
+
+
+def adjust_inventory(inventory, delta, kind, reference='', user=None, allow_negative=True):
+    """
+    Add ``delta`` to one inventory record and record it as a ``kind``
+    movement; returns the new stock, or None (and changes nothing) if it
+    would fall below zero without ``allow_negative``
+    """
+    with transaction.atomic():
+        queryset, quantity = _locked_stock(inventory)
+        if quantity + delta < 0 and not allow_negative:
+            return None
+        _apply(inventory, queryset, delta, kind, reference, user)
+    return quantity + delta
+
+
+def set_inventory_quantity(inventory, quantity, kind='ADJUSTMENT', reference='', user=None):
+    """Bring one inventory record to ``quantity`` (e.g. after a stock count) through the ledger"""
+    with transaction.atomic():
+        queryset, current = _locked_stock(inventory)
+        _apply(inventory, queryset, quantity - current, kind, reference, user)
+    return quantity
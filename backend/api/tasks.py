@@ -0,0 +1,315 @@
+"""
+Database-backed background task queue
+
+Work that does not have to finish before the response (low-stock alerts;
+later rollups, receipts or push notifications) is queued as a Task row and
+run by ``manage.py run_tasks`` workers. The tasks table is the queue, so
+there is no broker to deploy.
+
+- ``enqueue(name, *args, **kwargs)`` inserts the row inside the caller's
+  transaction: workers only see it once that commits, and a rolled back
+  checkout leaves no task behind. Arguments must be JSON serializable and
+  arrive as their JSON round trip (tuples become lists).
+- Workers claim due tasks with ``SELECT ... FOR UPDATE SKIP LOCKED`` on
+  PostgreSQL (elsewhere the claim's conditional UPDATE decides), so
+  concurrent workers never take the same task. Each worker runs up to
+  CONCURRENCY tasks at a time, each in its own thread and transaction.
+- A task that raises is retried until it has run ``max_attempts`` times,
+  BACKOFF * 2**(attempt - 1) seconds later (capped at BACKOFF_MAX, with
+  jitter), then left FAILED with its traceback. Tasks of a worker that died
+  run again once they have been RUNNING for LOCK_TIMEOUT seconds, so
+  LOCK_TIMEOUT must exceed the longest task.
+- Every attempt records when it started and how long it ran. Workers log
+  one record per attempt; ``collect_metrics`` exports queue depth, lag and
+  the durations of the last hour on /api/metrics/.
+
+Tasks are functions registered with ``@task('name')``, which also adds
+``func.enqueue(*args, **kwargs)``. With SYNCHRONOUS (tests, development
+without a worker) a task runs in-process right after its transaction
+commits.
+"""
+import logging
+import os
+import random
+import socket
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections, connection, transaction
+from django.db.models import Avg, Count, F, Max, Min
+from django.utils import timezone
+
+from .models import Task
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    # Tasks one worker runs at a time (threads)
+    'CONCURRENCY': 4,
+    # Seconds an idle worker waits before looking for due tasks again
+    'POLL_INTERVAL': 1.0,
+    'MAX_ATTEMPTS': 5,
+    # Retry delay: BACKOFF * 2**(attempt - 1) seconds, at most BACKOFF_MAX
+    'BACKOFF': 2.0,
+    'BACKOFF_MAX': 600.0,
+    # Seconds after which a RUNNING task is taken to be abandoned by its worker
+    'LOCK_TIMEOUT': 300,
+    # Hours succeeded tasks are kept (failed ones stay until deleted)
+    'KEEP_SUCCEEDED_HOURS': 24,
+    # Run tasks in-process after commit instead of in a worker
+    'SYNCHRONOUS': False,
+}
+
+# Seconds between a worker's sweeps for abandoned and expired tasks
+MAINTENANCE_INTERVAL = 60
+
+PRUNE_BATCH_SIZE = 1000
+
+# name -> (function, max_attempts or None for the configured default)
+_registry = {}
+
+
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'TASK_QUEUE', {}))
+    return config
+
+
+def task(name, max_attempts=None):
+    """Register the decorated function as task ``name`` and add ``func.enqueue``"""
+    def decorator(func):
+        _registry[name] = (func, max_attempts)
+        func.enqueue = lambda *args, **kwargs: enqueue(name, *args, **kwargs)
+        return func
+    return decorator
+
+
+def enqueue(name, *args, **kwargs):
+    """Queue task ``name``; it runs once the current transaction commits"""
+    if name not in _registry:
+        raise LookupError(f'Unknown task {name}')
+    config = get_config()
+    queued = Task.objects.create(
+        name=name,
+        args=list(args),
+        kwargs=kwargs,
+        max_attempts=_registry[name][1] or config['MAX_ATTEMPTS'],
+    )
+    if config['SYNCHRONOUS']:
+        transaction.on_commit(lambda: run_task(queued.pk))
+    return queued
+
+
+def worker_name():
+    return f'{socket.gethostname()[:60]}:{os.getpid()}'
+
+
+def claim(worker, limit, ids=None):
+    """Mark up to ``limit`` due PENDING tasks RUNNING for ``worker`` and return them"""
+    now = timezone.now()
+    # Unique per claim, so a worker never finishes a task it no longer holds
+    lock = f'{worker}:{uuid.uuid4().hex[:8]}'
+    with transaction.atomic():
+        due = Task.objects.filter(status='PENDING', run_at__lte=now)
+        if ids is not None:
+            due = due.filter(id__in=ids)
+        if connection.features.has_select_for_update_skip_locked:
+            due = due.select_for_update(skip_locked=True)
+        candidates = list(due.order_by('run_at', 'id').values_list('id', flat=True)[:limit])
+        if not candidates:
+            return []
+        Task.objects.filter(id__in=candidates, status='PENDING').update(
+            status='RUNNING',
+            locked_by=lock,
+            attempts=F('attempts') + 1,
+            started_at=now,
+            finished_at=None,
+        )
+    return list(Task.objects.filter(id__in=candidates, status='RUNNING', locked_by=lock).order_by('run_at', 'id'))
+
+
+def backoff(attempt):
+    """Seconds before retrying a task whose ``attempt``-th run failed"""
+    config = get_config()
+    delay = min(config['BACKOFF_MAX'], config['BACKOFF'] * 2 ** (attempt - 1))
+    # Jitter spreads the retries of tasks that failed together
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def execute(claimed):
+    """Run a claimed task in a transaction and record the attempt; returns its new status"""
+    func = _registry.get(claimed.name, (None, None))[0]
+    error = ''
+    started = time.perf_counter()
+    try:
+        if func is None:
+            raise LookupError(f'Unknown task {claimed.name}')
+        with transaction.atomic():
+            func(*claimed.args, **claimed.kwargs)
+    except Exception:
+        error = traceback.format_exc()
+    duration = time.perf_counter() - started
+
+    finished = timezone.now()
+    run_at = claimed.run_at
+    if not error:
+        status = 'SUCCEEDED'
+    elif claimed.attempts < claimed.max_attempts:
+        status = 'PENDING'
+        run_at = finished + timedelta(seconds=backoff(claimed.attempts))
+    else:
+        status = 'FAILED'
+    Task.objects.filter(pk=claimed.pk, status='RUNNING', locked_by=claimed.locked_by).update(
+        status=status,
+        run_at=run_at,
+        finished_at=finished,
+        duration=duration,
+        last_error=error,
+    )
+
+    logger.log(
+        logging.WARNING if error else logging.INFO,
+        'Task %s %s', claimed.name, 'retry scheduled' if status == 'PENDING' else status.lower(),
+        extra={
+            'task': claimed.name,
+            'task_id': claimed.pk,
+            'status': status,
+            'attempt': claimed.attempts,
+            'duration_ms': round(duration * 1000, 2),
+            'wait_ms': round((claimed.started_at - claimed.run_at).total_seconds() * 1000, 2),
+            'error': error.strip().splitlines()[-1] if error else None,
+        },
+    )
+    return status
+
+
+def run_task(task_id):
+    """Claim and run one task in this process (SYNCHRONOUS mode)"""
+    for claimed in claim(worker_name(), 1, ids=[task_id]):
+        execute(claimed)
+
+
+def recover_abandoned():
+    """Retry (or fail, if out of attempts) tasks RUNNING for longer than LOCK_TIMEOUT"""
+    now = timezone.now()
+    abandoned = Task.objects.filter(
+        status='RUNNING',
+        started_at__lt=now - timedelta(seconds=get_config()['LOCK_TIMEOUT']),
+    )
+    failed = abandoned.filter(attempts__gte=F('max_attempts')).update(
+        status='FAILED', finished_at=now, last_error='Abandoned by its worker',
+    )
+    retried = abandoned.update(status='PENDING', run_at=now)
+    return retried + failed
+
+
+def prune_succeeded():
+    """Delete succeeded tasks older than KEEP_SUCCEEDED_HOURS, in batches"""
+    cutoff = timezone.now() - timedelta(hours=get_config()['KEEP_SUCCEEDED_HOURS'])
+    expired = Task.objects.filter(status='SUCCEEDED', finished_at__lt=cutoff)
+    deleted = 0
+    while True:
+        ids = list(expired.values_list('id', flat=True)[:PRUNE_BATCH_SIZE])
+        if not ids:
+            return deleted
+        deleted += Task.objects.filter(id__in=ids).delete()[0]
+
+
+class Worker:
+    """Claims due tasks and runs up to ``concurrency`` of them at a time in threads"""
+
+    def __init__(self, concurrency=None, poll_interval=None):
+        config = get_config()
+        self.concurrency = concurrency or config['CONCURRENCY']
+        self.poll_interval = poll_interval if poll_interval is not None else config['POLL_INTERVAL']
+        self.name = worker_name()
+        self.counts = {}
+        self._stopping = threading.Event()
+
+    def stop(self):
+        """Stop claiming; run() returns once the running tasks are done"""
+        self._stopping.set()
+
+    def run(self, once=False):
+        """Run tasks until stop() (or, with ``once``, until none is due); returns {status: count}"""
+        executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='task-worker')
+        running = set()
+        last_maintenance = None
+        try:
+            while not self._stopping.is_set():
+                try:
+                    if last_maintenance is None or time.monotonic() - last_maintenance >= MAINTENANCE_INTERVAL:
+                        recover_abandoned()
+                        prune_succeeded()
+                        last_maintenance = time.monotonic()
+                    free = self.concurrency - len(running)
+                    claimed = claim(self.name, free) if free else []
+                except DatabaseError:
+                    logger.exception('Could not claim tasks')
+                    connection.close()
+                    self._stopping.wait(self.poll_interval)
+                    continue
+
+                for item in claimed:
+                    running.add(executor.submit(self._execute, item))
+
+                if running:
+                    done, running = wait(running, timeout=self.poll_interval, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        status = future.result()
+                        self.counts[status] = self.counts.get(status, 0) + 1
+                elif once:
+                    break
+                else:
+                    self._stopping.wait(self.poll_interval)
+        finally:
+            executor.shutdown(wait=True)
+            for future in running:
+                status = future.result()
+                self.counts[status] = self.counts.get(status, 0) + 1
+            connection.close()
+        return self.counts
+
+    @staticmethod
+    def _execute(claimed):
+        # Each task gets a fresh connection, as a request would (CONN_MAX_AGE)
+        close_old_connections()
+        try:
+            return execute(claimed)
+        finally:
+            close_old_connections()
+
+
+def collect_metrics():
+    """Queue depth, lag and last-hour task durations for the Prometheus endpoint (api.metrics)"""
+    now = timezone.now()
+    try:
+        by_status = dict(Task.objects.order_by().values_list('status').annotate(count=Count('id')))
+        oldest_due = Task.objects.filter(status='PENDING', run_at__lte=now).aggregate(oldest=Min('run_at'))['oldest']
+        recent = list(
+            Task.objects.filter(finished_at__gte=now - timedelta(hours=1))
+            .order_by()
+            .values('name', 'status')
+            .annotate(count=Count('id'), average=Avg('duration'), longest=Max('duration'))
+        )
+    except DatabaseError:
+        logger.warning('Could not read task queue metrics', exc_info=True)
+        return []
+
+    return [
+        ('pos_tasks', 'gauge', 'Queued tasks by status',
+         [({'status': status}, by_status.get(status, 0)) for status, _ in Task.STATUS_CHOICES]),
+        ('pos_task_queue_lag_seconds', 'gauge', 'Age of the oldest due task not yet started',
+         [({}, round((now - oldest_due).total_seconds(), 3) if oldest_due else 0)]),
+        ('pos_task_runs_last_hour', 'gauge', 'Task attempts finished in the last hour',
+         [({'task': row['name'], 'status': row['status']}, row['count']) for row in recent]),
+        ('pos_task_duration_seconds_avg', 'gauge', 'Mean duration of task attempts finished in the last hour',
+         [({'task': row['name'], 'status': row['status']}, round(row['average'] or 0, 6)) for row in recent]),
+        ('pos_task_duration_seconds_max', 'gauge', 'Longest task attempt finished in the last hour',
+         [({'task': row['name'], 'status': row['status']}, round(row['longest'] or 0, 6)) for row in recent]),
+    ]
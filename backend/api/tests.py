@@ -1,3 +1,957 @@
-from django.test import TestCase
+import base64
+import datetime
+import io
+import math
+import threading
+import uuid
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connection, transaction
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from . import fast_json, ledger
+from .catalog_cache import catalog
+from .encryption import CartQRCodec, EncryptionService
+from .locations import LocationError, request_location_id
+from .models import (
+    AddOn, Category, IdempotencyKey, Inventory, Location, Product, Refund, Task, Terminal, Transaction, User,
+    Variant,
+)
+from .parsers import FastJSONParser
+from .replicas import ReplicaRouter, _request_state
+from .renderers import FastJSONRenderer
+from .tasks import enqueue, get_config as task_config, recover_abandoned, run_task, task
+from .tokens import BlacklistFilter, RefreshToken
+
+
+class IdempotentPaymentTests(TestCase):
+    """process-payment retried with the same Idempotency-Key takes effect once"""
+
+    @classmethod
+    def setUpTestData(cls):
+        # Evictions wait for commits, which test transactions never reach
+        catalog.clear()
+        cls.cashier = User.objects.create_user('cashier', password='secret', role='CASHIER', is_verified=True)
+        category = Category.objects.create(name='Drinks')
+        cls.product = Product.objects.create(name='Tea', category=category, base_price=Decimal('2.50'), sku='TEA-1')
+        cls.inventory = Inventory.objects.create(location=Location.get_default(), product=cls.product, quantity=20)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.cashier)
+
+    def pay(self, key, quantity=2):
+        return self.client.post('/api/transactions/process-payment/', {
+            'cart_items': [{'product': {'id': self.product.id}, 'quantity': quantity}],
+            'amount_paid': '20.00',
+            'payment_method': 'CASH',
+        }, format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retries_replay_the_first_response(self):
+        first = self.pay('retry-storm')
+        self.assertEqual(first.status_code, 201)
+
+        for _ in range(5):
+            retry = self.pay('retry-storm')
+            self.assertEqual(retry.status_code, 201)
+            self.assertEqual(retry['Idempotent-Replayed'], 'true')
+            self.assertEqual(retry.json(), first.json())
+
+        self.assertEqual(Transaction.objects.count(), 1)
+        self.assertEqual(IdempotencyKey.objects.count(), 1)
+        self.inventory.refresh_from_db()
+        self.assertEqual(self.inventory.quantity, 18)
+
+    def test_key_reused_with_another_payload_is_rejected(self):
+        self.assertEqual(self.pay('reused', quantity=1).status_code, 201)
+
+        response = self.pay('reused', quantity=3)
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Transaction.objects.count(), 1)
+
+    def test_key_still_being_processed_conflicts(self):
+        first = self.pay('in-flight')
+        # As seen by a duplicate while the first request has not finished
+        IdempotencyKey.objects.filter(key='in-flight').update(status_code=None, response_body=None)
+
+        response = self.pay('in-flight')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(Transaction.objects.count(), 1)
+
+    def test_expired_key_runs_again(self):
+        self.pay('expired')
+        IdempotencyKey.objects.filter(key='expired').update(expires_at=timezone.now())
+
+        response = self.pay('expired')
+        self.assertEqual(response.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertEqual(Transaction.objects.count(), 2)
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class ConcurrentIdempotentPaymentTests(TransactionTestCase):
+    """Simultaneous retries of one keyed payment record a single sale"""
+
+    CLIENTS = 6
+
+    def setUp(self):
+        catalog.clear()
+        self.cashier = User.objects.create_user('cashier', password='secret', role='CASHIER', is_verified=True)
+        category = Category.objects.create(name='Drinks')
+        self.product = Product.objects.create(name='Tea', category=category, base_price=Decimal('2.50'), sku='TEA-1')
+        self.inventory = Inventory.objects.create(location=Location.get_default(), product=self.product, quantity=20)
+
+    def test_concurrent_retries_take_effect_once(self):
+        barrier = threading.Barrier(self.CLIENTS)
+        responses = []
+
+        def pay():
+            client = APIClient()
+            client.force_authenticate(self.cashier)
+            try:
+                barrier.wait()
+                responses.append(client.post('/api/transactions/process-payment/', {
+                    'cart_items': [{'product': {'id': self.product.id}, 'quantity': 2}],
+                    'amount_paid': '20.00',
+                }, format='json', HTTP_IDEMPOTENCY_KEY='double-tap'))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=pay) for _ in range(self.CLIENTS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(responses), self.CLIENTS)
+        # Retries either replay the sale or find it still in flight
+        self.assertTrue(all(response.status_code in (201, 409) for response in responses))
+        self.assertEqual(sum(1 for response in responses if response.status_code == 201
+                             and 'Idempotent-Replayed' not in response), 1)
+        self.assertEqual(Transaction.objects.count(), 1)
+        self.assertEqual(IdempotencyKey.objects.count(), 1)
+        self.inventory.refresh_from_db()
+        self.assertEqual(self.inventory.quantity, 18)
+
+
+class CartQRCodecTests(TestCase):
+    """Compact checkout QR payloads (api.encryption.CartQRCodec)"""
+
+    KEY = 'test-cart-qr-key'
+
+    CART = {
+        'items': [
+            {'productId': 12, 'variantId': None, 'addonIds': [], 'quantity': 2},
+            {'productId': 4097, 'variantId': 300, 'addonIds': [7, 150], 'quantity': 1},
+        ],
+        'total': 23.45,
+        'itemCount': 3,
+        'timestamp': 1760000000000,
+    }
+
+    def test_round_trip(self):
+        for text in ('base45', 'base64url'):
+            with self.subTest(text=text):
+                self.assertEqual(CartQRCodec.decode(CartQRCodec.encode(self.CART, self.KEY, text=text), self.KEY), self.CART)
+
+    def test_legacy_payloads_still_decode(self):
+        legacy = EncryptionService.encrypt_data(self.CART, self.KEY)
+        self.assertEqual(CartQRCodec.decode(legacy, self.KEY), self.CART)
+
+    def test_size_is_bounded_by_the_packed_cart(self):
+        cart = dict(self.CART, items=[
+            {'productId': 5000 + i, 'variantId': 20000 + i if i % 2 else None, 'addonIds': [199], 'quantity': 5}
+            for i in range(30)
+        ])
+        # Version, nonce and truncated tag around the packed cart, nothing else
+        sealed_size = 1 + CartQRCodec.NONCE_SIZE + len(CartQRCodec.pack(cart)) + CartQRCodec.TAG_SIZE
+        text = CartQRCodec.encode(cart, self.KEY)
+
+        self.assertTrue(text.startswith(CartQRCodec.BASE45_PREFIX))
+        self.assertLessEqual(len(text), len(CartQRCodec.BASE45_PREFIX) + math.ceil(sealed_size / 2) * 3)
+        self.assertLess(len(text), len(EncryptionService.encrypt_data(cart, self.KEY)) / 2)
+
+    def test_tampered_payload_is_rejected(self):
+        text = CartQRCodec.encode(self.CART, self.KEY, text='base64url')
+        body = text[len(CartQRCodec.BASE64_PREFIX):]
+        sealed = bytearray(base64.urlsafe_b64decode(body + '=' * (-len(body) % 4)))
+
+        for index in (len(sealed) - 1, 1 + CartQRCodec.NONCE_SIZE):
+            with self.subTest(byte=index):
+                tampered = bytearray(sealed)
+                tampered[index] ^= 0x01
+                tampered = CartQRCodec.BASE64_PREFIX + base64.urlsafe_b64encode(bytes(tampered)).rstrip(b'=').decode()
+                with self.assertRaisesMessage(ValueError, 'failed authentication'):
+                    CartQRCodec.decode(tampered, self.KEY)
+
+    def test_other_key_is_rejected(self):
+        with self.assertRaisesMessage(ValueError, 'failed authentication'):
+            CartQRCodec.decode(CartQRCodec.encode(self.CART, self.KEY), 'another-key')
+
+
+class RowSerializerTests(TestCase):
+    """List endpoints render the same bytes from values() rows as from their ModelSerializers"""
+
+    @classmethod
+    def setUpTestData(cls):
+        catalog.clear()
+        cls.admin = User.objects.create_user('admin', password='secret', role='SUPER_ADMIN', is_verified=True)
+        location = Location.get_default()
+        drinks = Category.objects.create(name='Drinks')
+        snacks = Category.objects.create(name='Snacks')
+        coffee = Product.objects.create(
+            name='Coffee', category=drinks, base_price=Decimal('3.20'), sku='COF-1', image='products/coffee.jpg',
+        )
+        chips = Product.objects.create(name='Chips', category=snacks, base_price=Decimal('1.99'), sku='CHP-1',
+                                       is_taxable=False)
+        retired = Product.objects.create(name='Retired', category=snacks, base_price=Decimal('5'), sku='OLD-1',
+                                         is_active=False)
+        large = Variant.objects.create(product=coffee, name='Large', price_adjustment=Decimal('0.80'), sku_suffix='-LG')
+        AddOn.objects.create(name='Oat milk', price=Decimal('0.50'))
+        Inventory.objects.create(location=location, product=coffee, quantity=30)
+        Inventory.objects.create(location=location, product=coffee, variant=large, quantity=4)
+        Inventory.objects.create(location=location, product=chips, quantity=3, low_stock_threshold=5)
+        Inventory.objects.create(location=location, product=retired, quantity=0)
+
+        client = APIClient()
+        client.force_authenticate(cls.admin)
+        for items in ([{'product': {'id': coffee.id}, 'variant': {'id': large.id}, 'quantity': 2}],
+                      [{'product': {'id': coffee.id}, 'quantity': 1}, {'product': {'id': chips.id}, 'quantity': 1}]):
+            response = client.post('/api/transactions/process-payment/', {
+                'cart_items': items, 'amount_paid': '50', 'payment_method': 'CARD',
+            }, format='json')
+            assert response.status_code == 201, response.content
+        refunded = Transaction.objects.order_by('id').first()
+        response = client.post(f'/api/transactions/{refunded.id}/refund/', {
+            'lines': [{'line': 0, 'quantity': 1}], 'reason': 'Spilled',
+        }, format='json')
+        assert response.status_code == 200, response.content
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def test_lists_match_model_serializers(self):
+        for path in ('/api/products/', '/api/inventory/', '/api/transactions/'):
+            with self.subTest(path=path):
+                with override_settings(ROW_SERIALIZERS=False):
+                    expected = self.client.get(path)
+                with override_settings(ROW_SERIALIZERS=True):
+                    actual = self.client.get(path)
+                self.assertEqual(expected.status_code, 200)
+                self.assertEqual(actual.status_code, 200)
+                self.assertGreater(len(expected.json()['results']), 0)
+                self.assertEqual(actual.content, expected.content)
+
+
+class FastJSONTests(TestCase):
+    """orjson rendering and parsing (api.fast_json) match DRF's JSONRenderer and JSONParser"""
+
+    DATA = {
+        'count': 2,
+        'next': None,
+        'results': [
+            {
+                'id': 1,
+                'price': Decimal('12.50'),
+                'precise': Decimal('0.1000000000000000055511151231257827'),
+                'created_at': datetime.datetime(2026, 1, 2, 3, 4, 5, 678901, tzinfo=datetime.timezone.utc),
+                'local': datetime.datetime(2026, 1, 2, 3, 4, 5, tzinfo=datetime.timezone(datetime.timedelta(hours=2))),
+                'naive': datetime.datetime(2026, 1, 2, 3, 4, 5),
+                'day': datetime.date(2026, 1, 2),
+                'opens': datetime.time(8, 30),
+                'uuid': uuid.UUID('12345678-1234-5678-1234-567812345678'),
+                'name': 'Café “deluxe” – 北京 \u2028\u2029 😀',
+                'label': gettext_lazy('Cash'),
+            },
+            {
+                'id': 2,
+                'floats': [0.1, 1.5, -2.25, 123456.789],
+                'big': 2 ** 70,
+                'flags': [True, False, None],
+                'nested': {'a': [{'b': []}], 3: 'int key'},
+            },
+        ],
+    }
+
+    def test_render_matches_json_renderer(self):
+        expected = JSONRenderer().render(self.DATA)
+        self.assertEqual(fast_json.dumps(self.DATA), expected)
+        self.assertEqual(FastJSONRenderer().render(self.DATA), expected)
+
+    def test_parse_matches_json_parser(self):
+        body = JSONRenderer().render(self.DATA)
+        self.assertEqual(FastJSONParser().parse(io.BytesIO(body)), JSONParser().parse(io.BytesIO(body)))
+
+    def test_api_response_is_unchanged(self):
+        user = User.objects.create_user('admin', password='secret', role='SUPER_ADMIN', is_verified=True)
+        Category.objects.create(name='Drinks – “hot”')
+        client = APIClient()
+        client.force_authenticate(user)
+
+        response = client.get('/api/categories/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, JSONRenderer().render(response.data))
+
+
+class CatalogCacheInvalidationTests(TestCase):
+    """Edited products leave the catalog cache when the edit commits (api.catalog_cache)"""
+
+    def setUp(self):
+        catalog.clear()
+        self.addCleanup(catalog.clear)
+        category = Category.objects.create(name='Drinks')
+        self.product = Product.objects.create(name='Tea', category=category, base_price=Decimal('3.00'), sku='TEA-1')
+        catalog.products([self.product.id])
+
+    def price(self):
+        return catalog.products([self.product.id])[self.product.id].base_price
+
+    def test_edit_is_evicted_once_committed(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.base_price = Decimal('4.00')
+            self.product.save()
+            # Other connections still read the committed row until then
+            self.assertEqual(self.price(), Decimal('3.00'))
+        self.assertEqual(self.price(), Decimal('4.00'))
+
+    def test_rolled_back_edit_is_not_cached(self):
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                self.product.base_price = Decimal('9.00')
+                self.product.save()
+                self.price()
+                raise RuntimeError
+        self.assertEqual(self.price(), Decimal('3.00'))
+
+
+class BlacklistFilterTests(TestCase):
+    """Per-process Bloom filter of blacklisted refresh tokens (api.tokens)"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('cashier', password='secret', role='CASHIER', is_verified=True)
+        self.filter = BlacklistFilter()
+
+    def test_blacklisted_tokens_are_found(self):
+        token = RefreshToken.for_user(self.user)
+        token.blacklist()
+
+        self.assertTrue(self.filter.might_contain(token['jti']))
+        self.assertFalse(self.filter.might_contain(RefreshToken.for_user(self.user)['jti']))
+
+    def test_rebuild_reads_the_database_without_the_lock(self):
+        build = BlacklistFilter._build
+
+        def unlocked_build(blacklist_filter, config):
+            self.assertFalse(blacklist_filter._lock.locked())
+            # Blacklisted by another thread while the rebuild reads
+            blacklist_filter.add('rotated-meanwhile')
+            return build(blacklist_filter, config)
+
+        with mock.patch.object(BlacklistFilter, '_build', unlocked_build):
+            self.assertFalse(self.filter.might_contain('unknown'))
+        self.assertTrue(self.filter.might_contain('rotated-meanwhile'))
+
+
+class OfflineSalesUploadTests(TestCase):
+    """bulk-upload records queued offline sales once each (api.offline_sales)"""
+
+    @classmethod
+    def setUpTestData(cls):
+        catalog.clear()
+        cls.cashier = User.objects.create_user('cashier', password='secret', role='CASHIER', is_verified=True)
+        category = Category.objects.create(name='Drinks')
+        cls.product = Product.objects.create(name='Tea', category=category, base_price=Decimal('2.50'), sku='TEA-1')
+        cls.inventory = Inventory.objects.create(location=Location.get_default(), product=cls.product, quantity=20)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.cashier)
+
+    def sale(self, client_id, quantity=2, total=None):
+        return {
+            'client_id': client_id,
+            'cart_items': [{'product': {'id': self.product.id}, 'quantity': quantity}],
+            # 2.50 plus 10% tax per unit
+            'total': total or str(Decimal('2.75') * quantity),
+            'amount_paid': '20.00',
+            'payment_method': 'CASH',
+        }
+
+    def upload(self, *sales):
+        # The api loggers run at INFO in production
+        with self.assertLogs('api', 'INFO'):
+            return self.client.post('/api/transactions/bulk-upload/', {'sales': list(sales)}, format='json')
+
+    def test_upload_records_sales_and_deducts_stock(self):
+        response = self.upload(self.sale('offline-1'), self.sale('offline-2', quantity=3))
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual((data['created'], data['duplicate'], data['rejected']), (2, 0, 0))
+        self.assertEqual(Transaction.objects.count(), 2)
+        self.inventory.refresh_from_db()
+        self.assertEqual(self.inventory.quantity, 15)
+
+    def test_reupload_reports_duplicates(self):
+        self.upload(self.sale('offline-1'))
+
+        response = self.upload(self.sale('offline-1'), self.sale('offline-2'))
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual((data['created'], data['duplicate'], data['rejected']), (1, 1, 0))
+        self.assertEqual([result['status'] for result in data['results']], ['duplicate', 'created'])
+        self.inventory.refresh_from_db()
+        self.assertEqual(self.inventory.quantity, 16)
+
+    def test_sales_are_priced_on_the_server(self):
+        response = self.upload(self.sale('offline-1', total='5.00'), self.sale('offline-2'))
+
+        data = response.json()
+        self.assertEqual((data['created'], data['duplicate'], data['rejected']), (1, 0, 1))
+        self.assertEqual(data['results'][0]['status'], 'rejected')
+        self.assertIn('5.50', data['results'][0]['error'])
+        txn = Transaction.objects.get(client_id='offline-2')
+        self.assertEqual((txn.subtotal, txn.tax, txn.total), (Decimal('5.00'), Decimal('0.50'), Decimal('5.50')))
+        self.assertEqual(txn.change_given, Decimal('14.50'))
+        self.assertEqual(txn.cart_items[0]['tax'], 0.5)
+        self.inventory.refresh_from_db()
+        self.assertEqual(self.inventory.quantity, 18)
+
+    def test_non_finite_amounts_are_rejected(self):
+        response = self.upload(self.sale('offline-1', total='NaN'), self.sale('offline-2', total='Infinity'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['rejected'], 2)
+        self.assertEqual(Transaction.objects.count(), 0)
+
+
+class RedeemQRTests(TestCase):
+    """Customer checkout QR codes are priced on the server and paid for once"""
+
+    @classmethod
+    def setUpTestData(cls):
+        catalog.clear()
+        cls.cashier = User.objects.create_user('cashier', password='secret', role='CASHIER', is_verified=True)
+        category = Category.objects.create(name='Drinks')
+        cls.product = Product.objects.create(name='Tea', category=category, base_price=Decimal('2.50'), sku='TEA-1')
+        cls.inventory = Inventory.objects.create(location=Location.get_default(), product=cls.product, quantity=20)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.cashier)
+
+    def qr(self, total=5.50):
+        return CartQRCodec.encode({
+            'items': [{'productId': self.product.id, 'variantId': None, 'addonIds': [], 'quantity': 2}],
+            'total': total,
+            'itemCount': 2,
+            'timestamp': 1760000000000,
+        }, settings.CART_QR_KEY)
+
+    def redeem(self, qr, **data):
+        return self.client.post('/api/transactions/redeem-qr/', {'qr': qr, **data}, format='json')
+
+    def test_preview_prices_the_cart_without_writing(self):
+        response = self.redeem(self.qr())
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['cart']['total'], '5.50')
+        self.assertEqual(data['cart']['items'][0]['available'], 20)
+        self.assertFalse(data['price_changed'])
+        self.assertIsNone(data['redeemed_transaction'])
+        self.assertEqual(Transaction.objects.count(), 0)
+
+    def test_completion_records_the_sale_once(self):
+        qr = self.qr()
+        response = self.redeem(qr, complete=True, amount_paid='10.00')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['change'], 4.5)
+        self.inventory.refresh_from_db()
+        self.assertEqual(self.inventory.quantity, 18)
+
+        again = self.redeem(qr, complete=True, amount_paid='10.00')
+        self.assertEqual(again.status_code, 409)
+        self.assertEqual(again.json()['redeemed_transaction'], Transaction.objects.get().transaction_number)
+        self.assertEqual(Transaction.objects.count(), 1)
+
+    def test_changed_prices_are_not_completed(self):
+        qr = self.qr(total=5.00)
+        self.assertTrue(self.redeem(qr).json()['price_changed'])
+
+        response = self.redeem(qr, complete=True, amount_paid='10.00')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['cart']['total'], '5.50')
+        self.assertEqual(Transaction.objects.count(), 0)
+
+    def test_non_finite_amounts_are_rejected(self):
+        for amount_paid in ('NaN', 'Infinity', '-Infinity'):
+            with self.subTest(amount_paid=amount_paid):
+                response = self.redeem(self.qr(), complete=True, amount_paid=amount_paid)
+                self.assertEqual(response.status_code, 400)
+
+        # Legacy QR payloads are JSON and can carry any total
+        for total in ('NaN', 'Infinity'):
+            with self.subTest(total=total):
+                legacy = EncryptionService.encrypt_data({
+                    'items': [{'productId': self.product.id, 'quantity': 1}], 'total': total,
+                }, settings.CART_QR_KEY)
+                self.assertEqual(self.redeem(legacy).status_code, 400)
+        self.assertEqual(Transaction.objects.count(), 0)
+
+
+class ReturnTests(TestCase):
+    """Refunds and exchanges of recorded sales, line by line"""
+
+    @classmethod
+    def setUpTestData(cls):
+        catalog.clear()
+        cls.cashier = User.objects.create_user('cashier', password='secret', role='CASHIER', is_verified=True)
+        category = Category.objects.create(name='Food')
+        cls.tea = Product.objects.create(name='Tea', category=category, base_price=Decimal('2.50'), sku='TEA-1')
+        cls.bread = Product.objects.create(
+            name='Bread', category=category, base_price=Decimal('4.00'), sku='BREAD-1', is_taxable=False
+        )
+        location = Location.get_default()
+        cls.tea_stock = Inventory.objects.create(location=location, product=cls.tea, quantity=20)
+        cls.bread_stock = Inventory.objects.create(location=location, product=cls.bread, quantity=20)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.cashier)
+        # Tea x3 (taxed) and bread x1 (untaxed): 7.50 + 0.75 tax + 4.00
+        response = self.client.post('/api/transactions/process-payment/', {
+            'cart_items': [
+                {'product': {'id': self.tea.id}, 'quantity': 3},
+                {'product': {'id': self.bread.id}, 'quantity': 1},
+            ],
+            'amount_paid': '20.00',
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.transaction_id = response.json()['transaction']['id']
+
+    def post(self, action, data):
+        return self.client.post(f'/api/transactions/{self.transaction_id}/{action}/', data, format='json')
+
+    def stock(self, inventory):
+        inventory.refresh_from_db()
+        return inventory.quantity
+
+    def test_part_of_a_line_is_refunded(self):
+        response = self.post('refund', {'lines': [{'line': 0, 'quantity': 1}]})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Refund.objects.get().amount, Decimal('2.75'))
+        self.assertEqual(response.json()['transaction']['status'], 'PARTIALLY_REFUNDED')
+        self.assertEqual(self.stock(self.tea_stock), 18)
+
+    def test_fully_returned_line_cannot_be_refunded_again(self):
+        self.assertEqual(self.post('refund', {'lines': [{'line': 0, 'quantity': 2}]}).status_code, 200)
+        self.assertEqual(self.post('refund', {'lines': [{'line': 0, 'quantity': 1}]}).status_code, 200)
+
+        response = self.post('refund', {'lines': [{'line': 0, 'quantity': 1}]})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('0 unit(s) can be returned', response.json()['error'])
+        self.assertEqual(Refund.objects.count(), 2)
+        self.assertEqual(self.stock(self.tea_stock), 20)
+
+    def test_refund_gives_back_each_lines_own_tax(self):
+        response = self.post('refund', {})
+
+        self.assertEqual(response.status_code, 200)
+        refund = Refund.objects.get()
+        # A cart-wide tax ratio would give part of the tea's tax back on the bread
+        self.assertEqual([line['amount'] for line in refund.items], ['8.25', '4.00'])
+        self.assertEqual(refund.amount, Decimal('12.25'))
+        self.assertEqual(response.json()['transaction']['status'], 'REFUNDED')
+        self.assertEqual(self.post('refund', {}).status_code, 400)
+
+    def test_exchange_replacements_are_priced_on_the_server(self):
+        response = self.post('exchange', {
+            'lines': [{'line': 1, 'quantity': 1}],
+            # Figures sent by the client are ignored
+            'exchange_items': [{'product': {'id': self.tea.id}, 'quantity': 1, 'subtotal': 0.01}],
+        })
+
+        self.assertEqual(response.status_code, 200)
+        refund = Refund.objects.get()
+        self.assertEqual(refund.amount, Decimal('1.25'))
+        self.assertEqual(refund.exchange_items[0]['subtotal'], 2.5)
+        self.assertEqual(refund.exchange_items[0]['tax'], 0.25)
+        self.assertEqual(self.stock(self.bread_stock), 20)
+        self.assertEqual(self.stock(self.tea_stock), 16)
+
+    def test_unknown_replacement_is_rejected(self):
+        response = self.post('exchange', {
+            'lines': [{'line': 1, 'quantity': 1}],
+            'exchange_items': [{'product': {'id': 999999}, 'quantity': 1}],
+        })
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Refund.objects.count(), 0)
+
+
+class CartPricingTests(TestCase):
+    """Carts are priced on the server (api.pricing), for quotes and at checkout"""
+
+    @classmethod
+    def setUpTestData(cls):
+        catalog.clear()
+        cls.cashier = User.objects.create_user('cashier', password='secret', role='CASHIER', is_verified=True)
+        category = Category.objects.create(name='Drinks')
+        cls.tea = Product.objects.create(name='Tea', category=category, base_price=Decimal('2.50'), sku='TEA-1')
+        cls.mint = Product.objects.create(name='Mint', category=category, base_price=Decimal('0.05'), sku='MINT-1')
+        cls.large = Variant.objects.create(
+            product=cls.tea, name='Large', price_adjustment=Decimal('0.50'), sku_suffix='-LG'
+        )
+        cls.honey = AddOn.objects.create(name='Honey', price=Decimal('0.30'))
+        cls.lemon = AddOn.objects.create(name='Lemon', price=Decimal('0.20'), is_active=False)
+        cls.cup = AddOn.objects.create(name='Cup', price=Decimal('0.10'))
+        cls.cup.applicable_products.set([cls.mint])
+        Inventory.objects.create(location=Location.get_default(), product=cls.tea, quantity=20)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.cashier)
+
+    def quote(self, *items):
+        return self.client.post('/api/cart/quote/', {'cart_items': list(items)}, format='json')
+
+    def test_tax_is_rounded_half_up(self):
+        response = self.quote({'product': {'id': self.mint.id}, 'quantity': 1})
+
+        self.assertEqual(response.status_code, 200)
+        # 0.005 of tax; rounding half to even would drop it
+        self.assertEqual((response.json()['tax'], response.json()['total']), ('0.01', '0.06'))
+
+    def test_variants_and_addons_are_priced(self):
+        response = self.quote({
+            'product': {'id': self.tea.id}, 'variant': {'id': self.large.id},
+            'addons': [{'id': self.honey.id}], 'quantity': 2,
+        })
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['items'][0]['unit_price'], '3.30')
+        self.assertEqual((data['subtotal'], data['tax'], data['total']), ('6.60', '0.66', '7.26'))
+        self.assertEqual(data['item_count'], 2)
+
+    def test_unavailable_addons_are_rejected(self):
+        for addon in (self.lemon, self.cup):
+            with self.subTest(addon=addon.name):
+                response = self.quote({'product': {'id': self.tea.id}, 'addons': [{'id': addon.id}], 'quantity': 1})
+                self.assertEqual(response.status_code, 400)
+
+    def test_unknown_product_is_not_found(self):
+        self.assertEqual(self.quote({'product': {'id': 999999}, 'quantity': 1}).status_code, 404)
+
+    def test_checkout_rejects_a_stale_client_total(self):
+        cart = [{'product': {'id': self.tea.id}, 'quantity': 2}]
+
+        response = self.client.post('/api/transactions/process-payment/', {
+            'cart_items': cart, 'total': '5.00', 'amount_paid': '10.00',
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['quote']['total'], '5.50')
+        self.assertEqual(Transaction.objects.count(), 0)
+
+        response = self.client.post('/api/transactions/process-payment/', {
+            'cart_items': cart, 'total': '5.50', 'amount_paid': '10.00',
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Transaction.objects.get().total, Decimal('5.50'))
+
+
+@override_settings(READ_REPLICAS={'ALIASES': ['replica'], 'STICKY_SECONDS': 5})
+class ReplicaRoutingTests(TransactionTestCase):
+    """GET lists read from a replica until the client writes (api.replicas)"""
+
+    def setUp(self):
+        catalog.clear()
+        self.admin = User.objects.create_user('admin', password='secret', role='SUPER_ADMIN', is_verified=True)
+        Category.objects.create(name='Drinks')
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+        # Record where the router sends each read, but run it on the test
+        # database, which is the only one there is
+        self.routed = []
+        db_for_read = ReplicaRouter.db_for_read
+
+        def recording_db_for_read(router, model, **hints):
+            self.routed.append(db_for_read(router, model, **hints))
+            return DEFAULT_DB_ALIAS
+
+        patcher = mock.patch.object(ReplicaRouter, 'db_for_read', recording_db_for_read)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get_categories(self, **headers):
+        self.routed.clear()
+        response = self.client.get('/api/categories/', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        return set(self.routed)
+
+    def test_lists_read_from_the_replica(self):
+        self.assertEqual(self.get_categories(), {'replica'})
+
+    def test_clients_that_wrote_read_from_the_primary(self):
+        response = self.client.post('/api/categories/', {'name': 'Snacks'}, format='json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response['X-Read-Primary'], '5')
+        self.assertEqual(response.cookies['pos_read_primary']['max-age'], 5)
+        # The client sends the cookie back
+        self.assertEqual(self.get_categories(), {DEFAULT_DB_ALIAS})
+
+        self.client.cookies.clear()
+        self.assertEqual(self.get_categories(), {'replica'})
+        self.assertEqual(self.get_categories(**{'X-Read-Primary': '5'}), {DEFAULT_DB_ALIAS})
+
+    def test_reads_inside_atomic_blocks_stay_on_the_primary(self):
+        token = _request_state.set({'replica': 'replica', 'wrote': False})
+        self.addCleanup(_request_state.reset, token)
+        router = ReplicaRouter()
+
+        self.routed.clear()
+        router.db_for_read(Category)
+        with transaction.atomic():
+            router.db_for_read(Category)
+        self.assertEqual(self.routed, ['replica', DEFAULT_DB_ALIAS])
+
+
+# Arguments of every run of the test tasks below
+task_calls = []
+
+
+@task('tests.record')
+def record_task(*args, **kwargs):
+    task_calls.append((args, kwargs))
+
+
+@task('tests.fail', max_attempts=3)
+def failing_task():
+    task_calls.append(((), {}))
+    raise RuntimeError('printer offline')
+
+
+class TaskQueueTests(TestCase):
+    """Database-backed background tasks (api.tasks)"""
+
+    def setUp(self):
+        task_calls.clear()
+
+    def test_rolled_back_enqueue_leaves_no_task(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(RuntimeError):
+                with transaction.atomic():
+                    record_task.enqueue(1)
+                    raise RuntimeError
+
+        self.assertFalse(Task.objects.exists())
+        self.assertEqual(task_calls, [])
+
+    @override_settings(TASK_QUEUE={'SYNCHRONOUS': True})
+    def test_synchronous_tasks_run_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            queued = record_task.enqueue(1, 'two', three=[3])
+            self.assertEqual(task_calls, [])
+
+        self.assertEqual(task_calls, [((1, 'two'), {'three': [3]})])
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, queued.attempts), ('SUCCEEDED', 1))
+
+    @override_settings(TASK_QUEUE={'SYNCHRONOUS': False, 'BACKOFF': 2.0})
+    def test_failing_task_backs_off_then_fails(self):
+        queued = enqueue('tests.fail')
+
+        for attempt in (1, 2):
+            with self.assertLogs('api.tasks', 'WARNING'):
+                run_task(queued.pk)
+            queued.refresh_from_db()
+            self.assertEqual((queued.status, queued.attempts), ('PENDING', attempt))
+            self.assertIn('printer offline', queued.last_error)
+            # 2 * 2**(attempt - 1) seconds, less up to half of it in jitter
+            delay = (queued.run_at - queued.finished_at).total_seconds()
+            self.assertTrue(2 ** attempt / 2 <= delay <= 2 ** attempt)
+            # Not due before then
+            run_task(queued.pk)
+            self.assertEqual(len(task_calls), attempt)
+            Task.objects.filter(pk=queued.pk).update(run_at=timezone.now())
+
+        with self.assertLogs('api.tasks', 'WARNING'):
+            run_task(queued.pk)
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, queued.attempts), ('FAILED', 3))
+        self.assertEqual(len(task_calls), 3)
+
+    def test_abandoned_tasks_are_requeued(self):
+        stale = timezone.now() - datetime.timedelta(seconds=task_config()['LOCK_TIMEOUT'] + 1)
+        abandoned = Task.objects.create(name='tests.record', status='RUNNING', attempts=1, started_at=stale)
+        exhausted = Task.objects.create(
+            name='tests.record', status='RUNNING', attempts=5, max_attempts=5, started_at=stale
+        )
+        running = Task.objects.create(name='tests.record', status='RUNNING', attempts=1, started_at=timezone.now())
+
+        self.assertEqual(recover_abandoned(), 2)
+        statuses = dict(Task.objects.values_list('pk', 'status'))
+        self.assertEqual(
+            [statuses[abandoned.pk], statuses[exhausted.pk], statuses[running.pk]],
+            ['PENDING', 'FAILED', 'RUNNING'],
+        )
+
+
+class InventoryLedgerTests(TestCase):
+    """Stock movements and point-in-time stock from the ledger (api.ledger)"""
+
+    @classmethod
+    def setUpTestData(cls):
+        catalog.clear()
+        cls.admin = User.objects.create_user('admin', password='secret', role='SUPER_ADMIN', is_verified=True)
+        category = Category.objects.create(name='Drinks')
+        cls.product = Product.objects.create(name='Tea', category=category, base_price=Decimal('2.50'), sku='TEA-1')
+        cls.inventory = Inventory.objects.create(location=Location.get_default(), product=cls.product, quantity=10)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def sell_and_restock(self):
+        """Sell 3 then restock 5; returns the times before, between and after"""
+        times = [timezone.now()]
+        response = self.client.post('/api/transactions/process-payment/', {
+            'cart_items': [{'product': {'id': self.product.id}, 'quantity': 3}],
+            'amount_paid': '10.00',
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.receipt = response.json()['transaction']['transaction_number']
+        times.append(timezone.now())
+        response = self.client.post(f'/api/inventory/{self.inventory.id}/restock/', {'quantity': 5}, format='json')
+        self.assertEqual(response.status_code, 200)
+        times.append(timezone.now())
+        return times
+
+    def stock_as_of(self, when):
+        response = self.client.get(f'/api/inventory/{self.inventory.id}/stock-as-of/', {'at': when.isoformat()})
+        self.assertEqual(response.status_code, 200)
+        return response.json()['quantity']
+
+    def assert_history(self, times):
+        response = self.client.get(f'/api/inventory/{self.inventory.id}/movements/')
+        movements = [(row['kind'], row['quantity'], row['reference']) for row in response.json()['results']]
+        self.assertEqual(movements, [('RESTOCK', 5, ''), ('SALE', -3, self.receipt)])
+        self.assertEqual([self.stock_as_of(when) for when in times], [10, 7, 12])
+
+    def quantity(self):
+        self.inventory.refresh_from_db()
+        return self.inventory.quantity
+
+    def test_immediate_mode(self):
+        times = self.sell_and_restock()
+
+        self.assertEqual(self.quantity(), 12)
+        self.assert_history(times)
+        # Answered from the checkpoint once compacted
+        self.assertEqual(ledger.compact(), 1)
+        self.assert_history(times)
+
+    @override_settings(INVENTORY_LEDGER={'DEFERRED': True})
+    def test_deferred_mode(self):
+        times = self.sell_and_restock()
+
+        # Not applied until compaction
+        self.assertEqual(self.quantity(), 10)
+        self.assert_history(times)
+        self.assertEqual(ledger.compact(), 1)
+        self.assertEqual(self.quantity(), 12)
+        self.assert_history(times)
+
+
+class RequestLocationTests(TestCase):
+    """Sales and returns use the terminal's location, then the cashier's, then the default"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.north = Location.objects.create(name='North', code='NORTH')
+        cls.south = Location.objects.create(name='South', code='SOUTH')
+        Terminal.objects.create(code='north-1', name='Till 1', location=cls.north)
+        Terminal.objects.create(code='north-2', name='Till 2', location=cls.north, is_active=False)
+        cls.cashier = User.objects.create_user(
+            'cashier', password='secret', role='CASHIER', is_verified=True, location=cls.south
+        )
+        cls.roaming = User.objects.create_user('roaming', password='secret', role='CASHIER', is_verified=True)
+
+    def location_id(self, user, terminal=None):
+        request = RequestFactory().get('/', headers={'X-Terminal': terminal} if terminal else {})
+        request.user = user
+        return request_location_id(request)
+
+    def test_terminal_comes_first(self):
+        self.assertEqual(self.location_id(self.cashier, 'north-1'), self.north.pk)
+
+    def test_then_the_cashiers_location(self):
+        self.assertEqual(self.location_id(self.cashier), self.south.pk)
+
+    def test_then_the_default_location(self):
+        self.assertEqual(self.location_id(self.roaming), Location.get_default().pk)
+
+    def test_unknown_or_inactive_terminals_are_errors(self):
+        for terminal in ('north-2', 'nowhere'):
+            with self.subTest(terminal=terminal):
+                with self.assertRaises(LocationError):
+                    self.location_id(self.cashier, terminal)
+
+
+class LocationAdminTests(TestCase):
+    """Only admins can change locations and terminals"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.cashier = User.objects.create_user('cashier', password='secret', role='CASHIER', is_verified=True)
+        cls.admin = User.objects.create_user('admin', password='secret', role='ADMIN', is_verified=True)
+        cls.location = Location.objects.create(name='North', code='NORTH')
+        cls.terminal = Terminal.objects.create(code='north-1', name='Till 1', location=cls.location)
+
+    def client_for(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def test_cashiers_can_read_but_not_write(self):
+        client = self.client_for(self.cashier)
+        self.assertEqual(client.get('/api/locations/').status_code, 200)
+        self.assertEqual(client.get(f'/api/terminals/{self.terminal.pk}/').status_code, 200)
+
+        requests = [
+            ('post', '/api/locations/', {'name': 'South', 'code': 'SOUTH'}),
+            ('patch', f'/api/locations/{self.location.pk}/', {'name': 'Renamed'}),
+            ('delete', f'/api/locations/{self.location.pk}/', None),
+            ('post', '/api/terminals/', {'code': 'north-2', 'name': 'Till 2', 'location': self.location.pk}),
+            ('put', f'/api/terminals/{self.terminal.pk}/', {'code': 'north-1', 'name': 'X', 'location': self.location.pk}),
+            ('delete', f'/api/terminals/{self.terminal.pk}/', None),
+        ]
+        for method, url, data in requests:
+            with self.subTest(method=method, url=url):
+                self.assertEqual(getattr(client, method)(url, data, format='json').status_code, 403)
+        self.location.refresh_from_db()
+        self.assertEqual(self.location.name, 'North')
+        self.assertEqual((Location.objects.count(), Terminal.objects.count()), (1, 1))
+
+    def test_admins_can_write(self):
+        client = self.client_for(self.admin)
+        response = client.post('/api/locations/', {'name': 'South', 'code': 'SOUTH'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        response = client.patch(f'/api/terminals/{self.terminal.pk}/', {'location': response.json()['id']}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(client.delete(f'/api/locations/{self.location.pk}/').status_code, 204)
@@ -0,0 +1,231 @@
+"""
+Refresh tokens with an in-process blacklist pre-check
+
+With ROTATE_REFRESH_TOKENS and BLACKLIST_AFTER_ROTATION every refresh looks
+the token up in simplejwt's BlacklistedToken table. BlacklistFilter keeps a
+Bloom filter of blacklisted JTIs per process: a negative answer skips the
+query, a (possibly false) positive falls back to it. The filter is synced
+incrementally every SYNC_INTERVAL seconds and rebuilt every REBUILD_INTERVAL
+seconds so pruned entries drop out. Configured through
+``settings.TOKEN_BLACKLIST_FILTER``.
+
+Rotation stays authoritative regardless of how fresh the filter is: the
+refresh serializer rejects a token whose blacklist row already existed.
+"""
+import hashlib
+import logging
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+from rest_framework_simplejwt.tokens import RefreshToken as BaseRefreshToken
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': True,
+    'SYNC_INTERVAL': 5,
+    'REBUILD_INTERVAL': 3600,
+    'FALSE_POSITIVE_RATE': 0.01,
+    'MIN_CAPACITY': 10000,
+}
+
+# Blacklist ids below the high-water mark re-read on every sync, covering rows
+# whose transaction committed after a row with a higher id was already seen
+SYNC_OVERLAP = 100
+
+
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'TOKEN_BLACKLIST_FILTER', {}))
+    return config
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings using double hashing"""
+
+    __slots__ = ('capacity', 'size', 'hashes', 'count', '_bits')
+
+    def __init__(self, capacity, false_positive_rate):
+        self.capacity = capacity
+        self.size = max(8, int(-capacity * math.log(false_positive_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, value):
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, value):
+        for position in self._positions(value):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, value):
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
+
+
+class BlacklistFilter:
+    """
+    Per-process Bloom filter of blacklisted JTIs kept in step with the database
+
+    Syncs and rebuilds read the database outside the lock, one thread at a
+    time, while other threads keep answering from the current filter; the
+    result is swapped in under the lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._bloom = None
+        self._high_water = 0
+        self._built_at = 0.0
+        self._synced_at = 0.0
+        # Set while a thread reads the database; JTIs added meanwhile are
+        # replayed into a rebuilt filter, which may not have read them
+        self._refreshing = False
+        self._added = []
+        self._generation = 0
+        self.skipped = 0
+        self.checked = 0
+
+    def might_contain(self, jti):
+        """False only if ``jti`` is certainly not blacklisted as of the last sync"""
+        self._refresh(get_config())
+        with self._lock:
+            # Without a filter yet (first build running elsewhere) ask the database
+            if self._bloom is None or jti in self._bloom:
+                self.checked += 1
+                return True
+            self.skipped += 1
+            return False
+
+    def add(self, jti):
+        with self._lock:
+            if self._bloom is not None:
+                self._bloom.add(jti)
+            if self._refreshing:
+                self._added.append(jti)
+
+    def reset(self):
+        with self._lock:
+            self._bloom = None
+            self._generation += 1
+
+    def _refresh(self, config):
+        now = time.monotonic()
+        with self._lock:
+            if self._refreshing:
+                return
+            bloom = self._bloom
+            if (
+                bloom is None
+                or now - self._built_at >= config['REBUILD_INTERVAL']
+                or bloom.count > bloom.capacity
+            ):
+                rebuild = True
+            elif now - self._synced_at >= config['SYNC_INTERVAL']:
+                rebuild = False
+            else:
+                return
+            self._refreshing = True
+            self._added = []
+            generation = self._generation
+            high_water = self._high_water
+
+        try:
+            if rebuild:
+                bloom, high_water = self._build(config)
+            else:
+                # Added to the shared filter under the lock below
+                rows = list(self._rows(BlacklistedToken.objects.filter(id__gt=high_water - SYNC_OVERLAP)))
+
+            with self._lock:
+                if generation != self._generation:
+                    return
+                if rebuild:
+                    for jti in self._added:
+                        bloom.add(jti)
+                    self._bloom = bloom
+                    self._high_water = high_water
+                    self._built_at = self._synced_at = now
+                elif self._bloom is not None:
+                    for blacklisted_id, jti in rows:
+                        self._bloom.add(jti)
+                        self._high_water = max(self._high_water, blacklisted_id)
+                    self._synced_at = now
+        finally:
+            with self._lock:
+                self._refreshing = False
+                self._added = []
+
+    def _build(self, config):
+        """A new filter of the whole blacklist and its highest id"""
+        capacity = max(config['MIN_CAPACITY'], 2 * BlacklistedToken.objects.count())
+        bloom = BloomFilter(capacity, config['FALSE_POSITIVE_RATE'])
+        high_water = 0
+        for blacklisted_id, jti in self._rows(BlacklistedToken.objects.all()):
+            bloom.add(jti)
+            high_water = max(high_water, blacklisted_id)
+        return bloom, high_water
+
+    @staticmethod
+    def _rows(queryset):
+        return queryset.order_by('id').values_list('id', 'token__jti').iterator(chunk_size=10000)
+
+
+blacklist_filter = BlacklistFilter()
+
+
+class RefreshToken(BaseRefreshToken):
+    """RefreshToken consulting blacklist_filter before the blacklist table"""
+
+    def check_blacklist(self):
+        if get_config()['ENABLED']:
+            if not blacklist_filter.might_contain(self.payload[api_settings.JTI_CLAIM]):
+                return
+        super().check_blacklist()
+
+    def blacklist(self):
+        result = super().blacklist()
+        blacklist_filter.add(self.payload[api_settings.JTI_CLAIM])
+        return result
+
+
+class BlacklistCheckedTokenRefreshSerializer(TokenRefreshSerializer):
+    """
+    Refresh serializer treating the rotation blacklist insert as the
+    authoritative check, so a replayed token is rejected even if this
+    process's filter has not seen it being blacklisted yet.
+    """
+    token_class = RefreshToken
+
+    def validate(self, attrs):
+        refresh = self.token_class(attrs['refresh'])
+        data = {'access': str(refresh.access_token)}
+
+        if api_settings.ROTATE_REFRESH_TOKENS:
+            if api_settings.BLACKLIST_AFTER_ROTATION:
+                _blacklisted, created = refresh.blacklist()
+                if not created:
+                    logger.warning('Rejected replayed refresh token', extra={
+                        'user_id': refresh.payload.get(api_settings.USER_ID_CLAIM),
+                    })
+                    raise TokenError(_('Token is blacklisted'))
+
+            refresh.set_jti()
+            refresh.set_exp()
+            refresh.set_iat()
+
+            data['refresh'] = str(refresh)
+
+        return data
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from rest_framework_simplejwt.views import TokenRefreshView
@@ -11,6 +12,7 @@ from .views import (
     UserListView,
     CustomTokenObtainPairView,
     EncryptionSettingsView,
+    MetricsView,
 )
 from .views_products import (
     CategoryViewSet,
@@ -19,7 +21,9 @@ from .views_products import (
     AddOnViewSet,
     InventoryViewSet,
 )
-from .views_transactions import TransactionViewSet
+from .views_locations import LocationViewSet, TerminalViewSet
+from .views_transactions import CartQuoteView, TransactionViewSet
+from .views_async import async_read_urlpatterns
 
 # Create router for product management
 router = DefaultRouter()
@@ -29,6 +33,8 @@ router.register(r'variants', VariantViewSet, basename='variant')
 router.register(r'addons', AddOnViewSet, basename='addon')
 router.register(r'inventory', InventoryViewSet, basename='inventory')
 router.register(r'transactions', TransactionViewSet, basename='transaction')
+router.register(r'locations', LocationViewSet, basename='location')
+router.register(r'terminals', TerminalViewSet, basename='terminal')
 
 urlpatterns = [
     # Authentication endpoints
@@ -46,9 +52,21 @@ urlpatterns = [
     path('users/unverified/', UnverifiedUsersView.as_view(), name='unverified-users'),
     path('users/verify/', VerifyUserView.as_view(), name='verify-user'),
     
+    # Server-side cart pricing
+    path('cart/quote/', CartQuoteView.as_view(), name='cart-quote'),
+    
     # Encryption settings
     path('encryption/settings/', EncryptionSettingsView.as_view(), name='encryption-settings'),
     
+    # Performance metrics (Prometheus text format)
+    path('metrics/', MetricsView.as_view(), name='metrics'),
+]
+
+# Async read paths shadowing the router's GET endpoints (ASGI deployments)
+if settings.ASYNC_READ_VIEWS:
+    urlpatterns += async_read_urlpatterns(router)
+
+urlpatterns += [
     # Product management endpoints
     path('', include(router.urls)),
 ]
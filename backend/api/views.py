@@ -3,9 +3,9 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from django.contrib.auth import authenticate, get_user_model
-from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework_simplejwt.views import TokenObtainPairView
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from .tokens import RefreshToken
 from .serializers import (
     UserSerializer, 
     RegisterSerializer, 
@@ -213,3 +213,23 @@ class EncryptionSettingsView(APIView):
             'encryption_key': settings.encryption_key,
             'excluded_routes': settings.excluded_routes
         }, status=status.HTTP_200_OK)
+
+
+class MetricsView(APIView):
+    """Prometheus metrics for this process (Admin and Super Admin only)"""
+    
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def get(self, request):
+        if not request.user.is_admin:
+            return Response({
+                'error': 'Only Admin can view metrics'
+            }, status=status.HTTP_403_FORBIDDEN)
+        
+        from django.http import HttpResponse
+        from .metrics import registry
+        
+        return HttpResponse(
+            registry.render_prometheus(),
+            content_type='text/plain; version=0.0.4; charset=utf-8'
+        )
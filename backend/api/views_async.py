@@ -0,0 +1,236 @@
+"""
+Async read paths for the catalog and transaction endpoints
+
+Under an ASGI server these views serve GET list/retrieve requests with
+Django's async ORM instead of holding a worker thread while Postgres answers.
+They reuse the DRF ViewSets for filtering, permissions and serialization so
+the JSON is identical to the synchronous endpoints. Anything that is not the
+plain JSON happy path (writes, invalid tokens, session auth, the browsable
+API, invalid pages, 404s) is delegated to the synchronous ViewSet.
+"""
+import math
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.http import HttpResponse
+from django.urls import re_path
+from django.utils.cache import patch_vary_headers
+from rest_framework.exceptions import APIException
+from rest_framework.request import ForcedAuthentication, Request
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+
+from .authentication import user_cache
+from .log import bind
+from .models import Product
+from .replicas import route_reads_to_replica
+from .response_cache import ResponseCacheMixin, mark_cacheable
+from .row_serializers import RowListMixin
+from .serializers import applicable_addons
+from .views_products import CategoryViewSet, ProductViewSet, VariantViewSet, AddOnViewSet
+from .views_transactions import TransactionViewSet
+
+User = get_user_model()
+
+
+class Delegate(Exception):
+    """Raised to hand a request over to the synchronous ViewSet"""
+
+
+async def authenticate(request):
+    """Resolve the JWT user with the async ORM, mirroring JWTAuthentication"""
+    authentication = JWTAuthentication()
+    header = authentication.get_header(request)
+    if header is None:
+        # Session-authenticated (browsable API / admin) requests stay synchronous
+        if request.COOKIES.get('sessionid'):
+            raise Delegate
+        return AnonymousUser()
+
+    raw_token = authentication.get_raw_token(header)
+    if raw_token is None:
+        raise Delegate
+    try:
+        validated_token = authentication.get_validated_token(raw_token)
+        user_id = validated_token[jwt_settings.USER_ID_CLAIM]
+    except (InvalidToken, TokenError, KeyError):
+        raise Delegate
+    if jwt_settings.CHECK_REVOKE_TOKEN:
+        raise Delegate
+
+    user = user_cache.get(user_id)
+    if user is None:
+        generation = user_cache.generation
+        user = await User.objects.filter(**{jwt_settings.USER_ID_FIELD: user_id}).afirst()
+        if user is None or not user.is_active:
+            raise Delegate
+        user_cache.set(user_id, user, generation)
+
+    bind(role=user.role)
+    return user
+
+
+def build_view(viewset_class, action, request, user, kwargs):
+    """Instantiate a ViewSet the way DRF's dispatch would, without running it"""
+    drf_request = Request(request, authenticators=[ForcedAuthentication(user, None)])
+    view = viewset_class(
+        request=drf_request,
+        action=action,
+        args=(),
+        kwargs=kwargs,
+        format_kwarg=None,
+    )
+    try:
+        view.check_permissions(drf_request)
+    except APIException:
+        raise Delegate
+    # As ReplicaReadMixin.initial does for the synchronous ViewSet
+    if action in getattr(viewset_class, 'replica_read_actions', ()):
+        route_reads_to_replica(request)
+    return view
+
+
+async def serialize_list(view, row_serializer, objects):
+    """Serialize a list page with the row serializer when the view has one"""
+    if row_serializer is None:
+        return view.get_serializer(objects, many=True).data
+    if row_serializer.nested:
+        # Nested rows are loaded with the synchronous ORM
+        return await sync_to_async(row_serializer.serialize)(objects)
+    return row_serializer.serialize(objects)
+
+
+async def list_data(view):
+    """Async equivalent of ListModelMixin.list including page-number pagination"""
+    request = view.request
+    queryset = view.filter_queryset(view.get_queryset())
+    row_serializer = view.get_row_serializer() if isinstance(view, RowListMixin) else None
+    if row_serializer is not None:
+        queryset = row_serializer.values(queryset)
+    paginator = view.paginator
+    page_size = paginator.get_page_size(request) if paginator is not None else None
+
+    if page_size is None:
+        objects = [obj async for obj in queryset]
+        return await serialize_list(view, row_serializer, objects)
+
+    page_number = request.query_params.get(paginator.page_query_param) or 1
+    try:
+        page_number = int(page_number)
+    except (TypeError, ValueError):
+        raise Delegate
+
+    count = await queryset.acount()
+    num_pages = max(1, math.ceil(count / page_size))
+    if page_number < 1 or page_number > num_pages:
+        raise Delegate
+
+    offset = (page_number - 1) * page_size
+    objects = [obj async for obj in queryset[offset:offset + page_size]]
+
+    url = request.build_absolute_uri()
+    next_link = None
+    if page_number < num_pages:
+        next_link = replace_query_param(url, paginator.page_query_param, page_number + 1)
+    previous_link = None
+    if page_number > 1:
+        if page_number - 1 == 1:
+            previous_link = remove_query_param(url, paginator.page_query_param)
+        else:
+            previous_link = replace_query_param(url, paginator.page_query_param, page_number - 1)
+
+    return {
+        'count': count,
+        'next': next_link,
+        'previous': previous_link,
+        'results': await serialize_list(view, row_serializer, objects),
+    }
+
+
+async def retrieve_data(view, prepare=None):
+    """Async equivalent of RetrieveModelMixin.retrieve"""
+    queryset = view.filter_queryset(view.get_queryset())
+    lookup_url_kwarg = view.lookup_url_kwarg or view.lookup_field
+    obj = await queryset.filter(**{view.lookup_field: view.kwargs[lookup_url_kwarg]}).afirst()
+    if obj is None:
+        raise Delegate
+    try:
+        view.check_object_permissions(view.request, obj)
+    except APIException:
+        raise Delegate
+    if prepare is not None:
+        await prepare(obj)
+    return view.get_serializer(obj).data
+
+
+async def prepare_product_detail(product):
+    """Load what ProductDetailSerializer would otherwise query synchronously"""
+    product.category.active_product_count = await Product.objects.filter(
+        category_id=product.category_id, is_active=True
+    ).acount()
+    addons = await sync_to_async(applicable_addons)(product.id)
+    product.applicable_addons = [addon async for addon in addons]
+
+
+def async_read_view(viewset_class, action, sync_view, prepare=None):
+    """
+    Build an async view serving GET ``action`` of ``viewset_class`` and
+    delegating every other request to ``sync_view``.
+    """
+    methods = set(sync_view.actions) | {'head', 'options'}
+    allow = ', '.join(method.upper() for method in viewset_class.http_method_names if method in methods)
+
+    async def view(request, *args, **kwargs):
+        wants_json = 'format' not in request.GET and 'text/html' not in request.headers.get('Accept', '')
+        if request.method == 'GET' and wants_json:
+            # DRF's Request assigns the authenticated user onto the Django request
+            original_user = getattr(request, 'user', None)
+            try:
+                user = await authenticate(request)
+                drf_view = build_view(viewset_class, action, request, user, kwargs)
+                if action == 'list':
+                    data = await list_data(drf_view)
+                else:
+                    data = await retrieve_data(drf_view, prepare)
+            except Delegate:
+                request.user = original_user
+            else:
+                if isinstance(drf_view, ResponseCacheMixin):
+                    mark_cacheable(request, drf_view.response_cache_tags(data))
+                # The JSON renderer content negotiation picks for these requests
+                renderer = api_settings.DEFAULT_RENDERER_CLASSES[0]()
+                response = HttpResponse(renderer.render(data), content_type='application/json')
+                response['Allow'] = allow
+                # Anonymous requests reach SessionAuthentication in DRF, which varies on Cookie
+                patch_vary_headers(response, ['Accept'] if user.is_authenticated else ['Accept', 'Cookie'])
+                return response
+
+        return await sync_to_async(sync_view)(request, *args, **kwargs)
+
+    # CSRF is enforced by DRF's SessionAuthentication in the delegated view
+    view.csrf_exempt = True
+    return view
+
+
+# (regex, ViewSet, action, router URL name, prepare hook)
+ASYNC_READ_ROUTES = [
+    (r'^products/$', ProductViewSet, 'list', 'product-list', None),
+    (r'^products/(?P<pk>\d+)/$', ProductViewSet, 'retrieve', 'product-detail', prepare_product_detail),
+    (r'^categories/$', CategoryViewSet, 'list', 'category-list', None),
+    (r'^variants/$', VariantViewSet, 'list', 'variant-list', None),
+    (r'^addons/$', AddOnViewSet, 'list', 'addon-list', None),
+    (r'^transactions/(?P<pk>\d+)/$', TransactionViewSet, 'retrieve', 'transaction-detail', None),
+]
+
+
+def async_read_urlpatterns(router):
+    """URL patterns that shadow the router's read endpoints with async views"""
+    sync_views = {pattern.name: pattern.callback for pattern in router.urls if pattern.name}
+    return [
+        re_path(regex, async_read_view(viewset_class, action, sync_views[name], prepare), name=name)
+        for regex, viewset_class, action, name, prepare in ASYNC_READ_ROUTES
+    ]
@@ -0,0 +1,105 @@
+from rest_framework import viewsets, filters, status
+from rest_framework.decorators import action
+from rest_framework.response import Response
+from rest_framework.permissions import IsAuthenticated
+from .locations import availability
+from .models import Location, Terminal
+from .replicas import ReplicaReadMixin
+from .serializers import LocationSerializer, TerminalSerializer
+
+
+def _id_list(value):
+    """[int] of a comma-separated query parameter, None if absent; raises ValueError"""
+    if not value:
+        return None
+    return [int(part) for part in value.split(',') if part.strip()]
+
+
+class AdminWriteMixin:
+    """ModelViewSet mixin: only Admin and Super Admin can create, edit or delete"""
+    
+    def _forbidden(self):
+        return Response({
+            'error': f'Only Admin can change {self.queryset.model._meta.verbose_name_plural.lower()}'
+        }, status=status.HTTP_403_FORBIDDEN)
+    
+    def create(self, request, *args, **kwargs):
+        if not request.user.is_admin:
+            return self._forbidden()
+        return super().create(request, *args, **kwargs)
+    
+    def update(self, request, *args, **kwargs):
+        if not request.user.is_admin:
+            return self._forbidden()
+        return super().update(request, *args, **kwargs)
+    
+    def destroy(self, request, *args, **kwargs):
+        if not request.user.is_admin:
+            return self._forbidden()
+        return super().destroy(request, *args, **kwargs)
+
+
+class LocationViewSet(AdminWriteMixin, ReplicaReadMixin, viewsets.ModelViewSet):
+    """ViewSet for Location (store/warehouse) CRUD operations (writes: Admin only)"""
+    
+    queryset = Location.objects.all()
+    serializer_class = LocationSerializer
+    permission_classes = [IsAuthenticated]
+    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
+    search_fields = ['name', 'code']
+    ordering_fields = ['name', 'code']
+    ordering = ['name']
+    replica_read_actions = ('list', 'retrieve', 'availability')
+    
+    def get_queryset(self):
+        """Filter locations"""
+        queryset = Location.objects.all()
+        
+        kind = self.request.query_params.get('kind', None)
+        if kind:
+            queryset = queryset.filter(kind=kind.upper())
+        
+        return queryset
+    
+    @action(detail=False, methods=['get'])
+    def availability(self, request):
+        """
+        Stock per product and active location, summed over variants
+        (?product=1,2 and/or ?location=3,4)
+        """
+        try:
+            product_ids = _id_list(request.query_params.get('product'))
+            location_ids = _id_list(request.query_params.get('location'))
+        except ValueError:
+            return Response(
+                {'error': 'product and location must be comma-separated ids'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        stock = availability(product_ids, location_ids)
+        return Response([
+            {'product': product_id, 'location': location_id, 'quantity': quantity}
+            for (product_id, location_id), quantity in sorted(stock.items())
+        ])
+
+
+class TerminalViewSet(AdminWriteMixin, ReplicaReadMixin, viewsets.ModelViewSet):
+    """ViewSet for checkout Terminal CRUD operations (writes: Admin only)"""
+    
+    queryset = Terminal.objects.all()
+    serializer_class = TerminalSerializer
+    permission_classes = [IsAuthenticated]
+    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
+    search_fields = ['name', 'code']
+    ordering_fields = ['name', 'code']
+    ordering = ['location', 'name']
+    
+    def get_queryset(self):
+        """Filter terminals"""
+        queryset = Terminal.objects.select_related('location')
+        
+        location_id = self.request.query_params.get('location', None)
+        if location_id:
+            queryset = queryset.filter(location_id=location_id)
+        
+        return queryset
@@ -0,0 +1,126 @@
+"""
+Media file serving with cache validators and byte ranges
+
+Replaces ``django.conf.urls.static`` for MEDIA_URL (enabled by
+MEDIA_STORAGE['SERVE']). Content-addressed files (api.media) never change,
+so they are served with ``Cache-Control: immutable`` and a year's max-age and
+terminals stop re-downloading product images. Any other file is revalidated
+with ETag/Last-Modified and answered with 304 when unchanged. Single
+``Range: bytes=`` requests get 206 partial content.
+"""
+import mimetypes
+import os
+import re
+
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import default_storage
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+from django.views.decorators.http import require_safe
+
+from .media import get_config, is_content_addressed
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+CHUNK_SIZE = 64 * 1024
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def byte_range(header, size):
+    """
+    (first, last) byte positions requested by a Range header, or None to
+    send the whole file (no, malformed or multi-part ranges)
+    """
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first:
+        # Suffix range: the last N bytes
+        if not last or int(last) == 0 or size == 0:
+            raise RangeNotSatisfiable
+        return max(size - int(last), 0), size - 1
+    first = int(first)
+    if last and int(last) < first:
+        return None
+    if first >= size:
+        raise RangeNotSatisfiable
+    return first, min(int(last), size - 1) if last else size - 1
+
+
+def _read(path, first, length):
+    with open(path, 'rb') as f:
+        f.seek(first)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def _if_range_matches(request, etag, last_modified):
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if if_range is None:
+        return True
+    if if_range.startswith(('"', 'W/')):
+        return if_range == etag
+    return parse_http_date_safe(if_range) == last_modified
+
+
+@require_safe
+def serve_media(request, path):
+    if any(part.startswith('.') for part in path.split('/')):
+        # Includes api.media's in-progress uploads
+        raise Http404
+    try:
+        full_path = default_storage.path(path)
+        stat = os.stat(full_path)
+    except (SuspiciousFileOperation, OSError):
+        raise Http404
+    if not os.path.isfile(full_path):
+        raise Http404
+
+    last_modified = int(stat.st_mtime)
+    if is_content_addressed(path):
+        etag = quote_etag(os.path.splitext(os.path.basename(path))[0])
+        cache_control = f'public, max-age={get_config()["MAX_AGE"]}, immutable'
+    else:
+        etag = quote_etag(f'{stat.st_mtime_ns:x}-{stat.st_size:x}')
+        cache_control = 'public, no-cache'
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(last_modified),
+        'Cache-Control': cache_control,
+        'Accept-Ranges': 'bytes',
+    }
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        for header, value in headers.items():
+            response.headers[header] = value
+        return response
+
+    content_type = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+    requested = None
+    if 'HTTP_RANGE' in request.META and _if_range_matches(request, etag, last_modified):
+        try:
+            requested = byte_range(request.META['HTTP_RANGE'], stat.st_size)
+        except RangeNotSatisfiable:
+            response = HttpResponse(status=416, headers=headers)
+            response.headers['Content-Range'] = f'bytes */{stat.st_size}'
+            return response
+
+    if requested is None:
+        return FileResponse(open(full_path, 'rb'), content_type=content_type, headers=headers)
+
+    first, last = requested
+    response = StreamingHttpResponse(
+        _read(full_path, first, last - first + 1), status=206, content_type=content_type, headers=headers,
+    )
+    response.headers['Content-Length'] = str(last - first + 1)
+    response.headers['Content-Range'] = f'bytes {first}-{last}/{stat.st_size}'
+    return response
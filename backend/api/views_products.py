@@ -2,16 +2,35 @@ from rest_framework import viewsets, filters, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny, IsAuthenticatedOrReadOnly
-from django.db.models import Q, F
-from django.db import models
+from django.db.models import Q, F, Count
+from django.db import models, transaction as db_transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from . import ledger
+from .catalog_cache import addon_index
 from .models import Category, Product, Variant, AddOn, Inventory
+from .replicas import ReplicaReadMixin
+from .response_cache import ResponseCacheMixin
+from .row_serializers import InventoryRowSerializer, ProductRowSerializer, RowListMixin
 from .serializers import (
     CategorySerializer, ProductListSerializer, ProductDetailSerializer,
-    VariantSerializer, AddOnSerializer, InventorySerializer
+    VariantSerializer, AddOnSerializer, InventorySerializer, InventoryMovementSerializer
 )
+from .stock import adjust_inventory, set_inventory_quantity
 
 
-class CategoryViewSet(viewsets.ModelViewSet):
+def _parse_datetime(value):
+    """Aware datetime of an ISO 8601 query parameter, or None if invalid"""
+    try:
+        when = parse_datetime(value)
+    except ValueError:
+        return None
+    if when is not None and timezone.is_naive(when):
+        when = timezone.make_aware(when)
+    return when
+
+
+class CategoryViewSet(ResponseCacheMixin, ReplicaReadMixin, viewsets.ModelViewSet):
     """ViewSet for Category CRUD operations"""
     
     queryset = Category.objects.all()
@@ -24,7 +43,9 @@ class CategoryViewSet(viewsets.ModelViewSet):
     
     def get_queryset(self):
         """Filter categories based on user role"""
-        queryset = Category.objects.all()
+        queryset = Category.objects.annotate(
+            active_product_count=Count('products', filter=Q(products__is_active=True))
+        )
         
         # Show only active categories to non-authenticated users
         if not self.request.user.is_authenticated:
@@ -33,9 +54,16 @@ class CategoryViewSet(viewsets.ModelViewSet):
             queryset = queryset.filter(is_active=True)
         
         return queryset
+    
+    def response_cache_tags(self, data):
+        """Cache tags of GET responses (api.response_cache)"""
+        if self.action == 'retrieve':
+            return {f'category:{data["id"]}'}
+        # Lists include each category's active product count
+        return {'category', 'product'}
 
 
-class ProductViewSet(viewsets.ModelViewSet):
+class ProductViewSet(ResponseCacheMixin, RowListMixin, ReplicaReadMixin, viewsets.ModelViewSet):
     """ViewSet for Product CRUD operations"""
     
     queryset = Product.objects.all()
@@ -44,6 +72,8 @@ class ProductViewSet(viewsets.ModelViewSet):
     search_fields = ['name', 'sku', 'description']
     ordering_fields = ['name', 'base_price', 'created_at']
     ordering = ['name']
+    row_serializer_class = ProductRowSerializer
+    replica_read_actions = ('list', 'retrieve', 'low_stock', 'out_of_stock')
     
     def get_serializer_class(self):
         """Use different serializers for list and detail views"""
@@ -54,8 +84,11 @@ class ProductViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         """Filter products with advanced filtering"""
         queryset = Product.objects.select_related('category').prefetch_related(
-            'variants', 'available_addons', 'inventories'
+            'variants', 'inventories'
         )
+        if self.action == 'retrieve':
+            # Nested relations rendered by ProductDetailSerializer (add-ons come from api.catalog_cache)
+            queryset = queryset.prefetch_related('inventories__variant', 'inventories__location')
         
         # Show only active products to non-authenticated users
         if not self.request.user.is_authenticated:
@@ -90,6 +123,9 @@ class ProductViewSet(viewsets.ModelViewSet):
             inventories__quantity__lte=F('inventories__low_stock_threshold')
         ).distinct()
         
+        row_serializer = self.get_row_serializer()
+        if row_serializer is not None:
+            return Response(row_serializer.serialize(row_serializer.values(low_stock_products)))
         serializer = self.get_serializer(low_stock_products, many=True)
         return Response(serializer.data)
     
@@ -100,11 +136,27 @@ class ProductViewSet(viewsets.ModelViewSet):
             inventories__quantity=0
         ).distinct()
         
+        row_serializer = self.get_row_serializer()
+        if row_serializer is not None:
+            return Response(row_serializer.serialize(row_serializer.values(out_of_stock_products)))
         serializer = self.get_serializer(out_of_stock_products, many=True)
         return Response(serializer.data)
+    
+    def response_cache_tags(self, data):
+        """Cache tags of GET responses (api.response_cache)"""
+        if self.action == 'retrieve':
+            # Variants and stock rows are invalidated through their product's tag
+            return {
+                f'product:{data["id"]}',
+                f'category:{data["category"]["id"]}',
+                'addon:global',
+                *(f'addon:{addon["id"]}' for addon in data['available_addons']),
+            }
+        # Lists (and low/out of stock) include category names and current stock
+        return {'product', 'category', 'inventory'}
 
 
-class VariantViewSet(viewsets.ModelViewSet):
+class VariantViewSet(ResponseCacheMixin, ReplicaReadMixin, viewsets.ModelViewSet):
     """ViewSet for Variant CRUD operations"""
     
     queryset = Variant.objects.all()
@@ -131,9 +183,16 @@ class VariantViewSet(viewsets.ModelViewSet):
             queryset = queryset.filter(is_active=True, product__is_active=True)
         
         return queryset
+    
+    def response_cache_tags(self, data):
+        """Cache tags of GET responses (api.response_cache)"""
+        # final_price depends on the product's base price
+        if self.action == 'retrieve':
+            return {f'variant:{data["id"]}', f'product:{data["product"]}'}
+        return {'variant', 'product'}
 
 
-class AddOnViewSet(viewsets.ModelViewSet):
+class AddOnViewSet(ResponseCacheMixin, ReplicaReadMixin, viewsets.ModelViewSet):
     """ViewSet for AddOn CRUD operations"""
     
     queryset = AddOn.objects.all()
@@ -146,7 +205,7 @@ class AddOnViewSet(viewsets.ModelViewSet):
     
     def get_queryset(self):
         """Filter add-ons"""
-        queryset = AddOn.objects.all()
+        queryset = AddOn.objects.prefetch_related('applicable_products')
         
         # Show only active add-ons to non-authenticated users
         if not self.request.user.is_authenticated:
@@ -154,17 +213,24 @@ class AddOnViewSet(viewsets.ModelViewSet):
         elif not (self.request.user.is_super_admin or self.request.user.is_admin):
             queryset = queryset.filter(is_active=True)
         
-        # Filter by product
+        # Filter by product: global add-ons and those restricted to it, by primary key
         product_id = self.request.query_params.get('product', None)
         if product_id:
-            queryset = queryset.filter(
-                Q(applicable_products__id=product_id) | Q(applicable_products__isnull=True)
-            ).distinct()
+            try:
+                queryset = queryset.filter(id__in=addon_index.ids_for_product(int(product_id)))
+            except ValueError:
+                queryset = queryset.none()
         
         return queryset
+    
+    def response_cache_tags(self, data):
+        """Cache tags of GET responses (api.response_cache)"""
+        if self.action == 'retrieve':
+            return {f'addon:{data["id"]}'}
+        return {'addon'}
 
 
-class InventoryViewSet(viewsets.ModelViewSet):
+class InventoryViewSet(RowListMixin, ReplicaReadMixin, viewsets.ModelViewSet):
     """ViewSet for Inventory CRUD operations"""
     
     queryset = Inventory.objects.all()
@@ -174,10 +240,17 @@ class InventoryViewSet(viewsets.ModelViewSet):
     search_fields = ['product__name', 'variant__name']
     ordering_fields = ['quantity', 'last_restocked']
     ordering = ['product']
+    row_serializer_class = InventoryRowSerializer
+    replica_read_actions = ('list', 'retrieve', 'movements', 'stock_as_of')
     
     def get_queryset(self):
         """Filter inventory"""
-        queryset = Inventory.objects.select_related('product', 'variant')
+        queryset = Inventory.objects.select_related('location', 'product', 'variant')
+        
+        # Filter by location (store/warehouse)
+        location_id = self.request.query_params.get('location', None)
+        if location_id:
+            queryset = queryset.filter(location_id=location_id)
         
         # Filter by product
         product_id = self.request.query_params.get('product', None)
@@ -196,6 +269,29 @@ class InventoryViewSet(viewsets.ModelViewSet):
         
         return queryset
     
+    def perform_create(self, serializer):
+        """The opening quantity is recorded in the inventory ledger"""
+        quantity = serializer.validated_data.get('quantity', 0)
+        with db_transaction.atomic():
+            inventory = serializer.save(quantity=0)
+            inventory.quantity = set_inventory_quantity(
+                inventory, quantity, reference='opening stock', user=self.request.user
+            )
+    
+    def perform_update(self, serializer):
+        """Quantity edits are recorded in the inventory ledger as adjustments"""
+        quantity = serializer.validated_data.pop('quantity', None)
+        with db_transaction.atomic():
+            # save() writes every column: re-read the stock under lock so it is written back unchanged
+            serializer.instance.quantity = (
+                Inventory.objects.select_for_update()
+                .values_list('quantity', flat=True)
+                .get(pk=serializer.instance.pk)
+            )
+            inventory = serializer.save()
+            if quantity is not None:
+                inventory.quantity = set_inventory_quantity(inventory, quantity, user=self.request.user)
+    
     @action(detail=True, methods=['post'])
     def restock(self, request, pk=None):
         """Restock inventory"""
@@ -208,10 +304,13 @@ class InventoryViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        inventory.quantity += quantity
-        from django.utils import timezone
-        inventory.last_restocked = timezone.now()
-        inventory.save()
+        with db_transaction.atomic():
+            new_quantity = adjust_inventory(
+                inventory, quantity, 'RESTOCK', reference=request.data.get('reference', ''), user=request.user
+            )
+            inventory.last_restocked = timezone.now()
+            inventory.save(update_fields=['last_restocked', 'updated_at'])
+        inventory.quantity = new_quantity
         
         serializer = self.get_serializer(inventory)
         return Response(serializer.data)
@@ -222,15 +321,58 @@ class InventoryViewSet(viewsets.ModelViewSet):
         inventory = self.get_object()
         adjustment = request.data.get('adjustment', 0)
         
-        new_quantity = inventory.quantity + adjustment
-        if new_quantity < 0:
+        new_quantity = adjust_inventory(
+            inventory, adjustment, 'ADJUSTMENT', reference=request.data.get('reference', ''),
+            user=request.user, allow_negative=False,
+        )
+        if new_quantity is None:
             return Response(
                 {'error': 'Insufficient stock'},
                 status=status.HTTP_400_BAD_REQUEST
             )
-        
         inventory.quantity = new_quantity
-        inventory.save()
         
         serializer = self.get_serializer(inventory)
         return Response(serializer.data)
+    
+    @action(detail=True, methods=['get'])
+    def movements(self, request, pk=None):
+        """Ledger entries of an inventory record, newest first (?kind=, ?since=, ?until=)"""
+        inventory = self.get_object()
+        queryset = inventory.movements.select_related('user')
+        
+        kind = request.query_params.get('kind', None)
+        if kind:
+            queryset = queryset.filter(kind=kind.upper())
+        for param, lookup in (('since', 'created_at__gte'), ('until', 'created_at__lte')):
+            value = request.query_params.get(param, None)
+            if value:
+                when = _parse_datetime(value)
+                if when is None:
+                    return Response(
+                        {'error': f'{param} must be an ISO 8601 datetime'},
+                        status=status.HTTP_400_BAD_REQUEST
+                    )
+                queryset = queryset.filter(**{lookup: when})
+        
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(InventoryMovementSerializer(page, many=True).data)
+        return Response(InventoryMovementSerializer(queryset, many=True).data)
+    
+    @action(detail=True, methods=['get'], url_path='stock-as-of')
+    def stock_as_of(self, request, pk=None):
+        """Stock of an inventory record at ?at=<ISO 8601 datetime>, from the ledger"""
+        inventory = self.get_object()
+        when = _parse_datetime(request.query_params.get('at', ''))
+        if when is None:
+            return Response(
+                {'error': 'at must be an ISO 8601 datetime'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        return Response({
+            'inventory': inventory.id,
+            'at': when,
+            'quantity': ledger.stock_as_of(inventory, when),
+        })
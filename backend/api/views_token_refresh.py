@@ -1,11 +1,15 @@
 """
 Custom token refresh view that reads refresh token from HttpOnly cookie
 """
+import logging
+
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status, permissions
-from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework_simplejwt.exceptions import TokenError
+from .tokens import RefreshToken
+
+logger = logging.getLogger(__name__)
 
 
 class CookieTokenRefreshView(APIView):
@@ -15,15 +19,12 @@ class CookieTokenRefreshView(APIView):
     permission_classes = [permissions.AllowAny]
     
     def post(self, request):
-        # Debug: Print all cookies
-        print('All cookies:', request.COOKIES)
-        
         # Get refresh token from cookie
         refresh_token = request.COOKIES.get('refresh_token')
         
-        print(f'Refresh token from cookie: {refresh_token}')
-        
         if not refresh_token:
+            # Cookie names only: values are credentials
+            logger.info('Refresh token cookie missing', extra={'cookies': sorted(request.COOKIES)})
             return Response({
                 'error': 'Refresh token not found in cookies',
                 'cookies_received': list(request.COOKIES.keys())
@@ -56,11 +57,13 @@ class CookieTokenRefreshView(APIView):
             return response
             
         except TokenError as e:
+            logger.info('Refresh token rejected: %s', e)
             return Response({
                 'error': 'Invalid or expired refresh token',
                 'detail': str(e)
             }, status=status.HTTP_401_UNAUTHORIZED)
         except Exception as e:
+            logger.exception('Token refresh failed')
             return Response({
                 'error': 'Token refresh failed',
                 'detail': str(e)
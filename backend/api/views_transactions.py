@@ -1,37 +1,111 @@
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
+from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
-from django.db import transaction as db_transaction
+from django.db import IntegrityError, transaction as db_transaction
+from django.http import Http404
 from django.utils import timezone
-from .models import Transaction, Product, Inventory
-from .serializers import TransactionSerializer
+from django.utils.dateparse import parse_date
+from decimal import Decimal, InvalidOperation
+from django.conf import settings
+from .alerts import queue_low_stock_alert
+from .encryption import CartQRCodec
+from .idempotency import idempotent
+from .locations import LocationError, request_location_id, request_terminal, stock_at
+from .models import Transaction, Product, Refund
+from .offline_sales import MAX_SALES, import_sales
+from .pricing import PRICE_TOLERANCE, CartQuote, PricingError, quote_cart
+from .replicas import ReplicaReadMixin
+from .row_serializers import RowListMixin, TransactionRowSerializer
+from .serializers import TransactionSerializer, RefundSerializer
+from .stock import adjust_stock, stock_key
+from .views_products import _parse_datetime
+import datetime
+import hashlib
 import json
+import logging
 
+logger = logging.getLogger(__name__)
 
-class TransactionViewSet(viewsets.ModelViewSet):
+
+class ReturnError(Exception):
+    """Invalid refund or exchange request"""
+
+
+class CartQuoteView(APIView):
+    """Price a cart with the server's catalog prices"""
+    
+    permission_classes = [IsAuthenticated]
+    
+    def post(self, request):
+        """
+        Expected payload:
+        {
+            "cart_items": [...]
+        }
+        Items use the checkout cart shape or the QR shape
+        ({"productId", "variantId", "addonIds", "quantity"}).
+        """
+        cart_items = request.data.get('cart_items')
+        if not isinstance(cart_items, list) or not cart_items:
+            return Response({
+                'error': 'cart_items must be a non-empty list'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            quote = quote_cart(cart_items)
+        except PricingError as e:
+            return Response({'error': str(e)}, status=e.status_code)
+        return Response(quote.as_dict(), status=status.HTTP_200_OK)
+
+
+class TransactionViewSet(RowListMixin, ReplicaReadMixin, viewsets.ModelViewSet):
     """ViewSet for Transaction operations"""
     
     queryset = Transaction.objects.all()
     serializer_class = TransactionSerializer
+    row_serializer_class = TransactionRowSerializer
     permission_classes = [IsAuthenticated]
     ordering = ['-created_at']
     
     def get_queryset(self):
         """Filter transactions based on user role"""
-        queryset = Transaction.objects.all()
+        queryset = Transaction.objects.select_related('cashier').prefetch_related('refunds__processed_by')
         
         # Cashiers can only see their own transactions
         if self.request.user.is_cashier:
             queryset = queryset.filter(cashier=self.request.user)
         
+        # Date filters are plain created_at ranges (no __date transform), so a
+        # partitioned table only scans the months they cover (api.partitions)
+        try:
+            day = parse_date(self.request.query_params.get('date', ''))
+        except ValueError:
+            day = None
+        if day:
+            start = timezone.make_aware(datetime.datetime.combine(day, datetime.time.min))
+            queryset = queryset.filter(created_at__gte=start, created_at__lt=start + datetime.timedelta(days=1))
+        for param, lookup in (('since', 'created_at__gte'), ('until', 'created_at__lte')):
+            when = _parse_datetime(self.request.query_params.get(param, ''))
+            if when is not None:
+                queryset = queryset.filter(**{lookup: when})
+        
         return queryset
     
     @action(detail=False, methods=['post'], url_path='process-payment')
+    @idempotent
     @db_transaction.atomic
     def process_payment(self, request):
         """
         Process payment and create transaction
+        Retries may send the same Idempotency-Key header to get the first
+        result back instead of creating another transaction.
+        Prices are computed server-side (api.pricing); subtotal and tax sent
+        by the client are ignored and a total that differs from the server's
+        is rejected with the current quote.
+        Stock is deducted at the location of the X-Terminal header's
+        terminal, else the cashier's (api.locations).
         Expected payload:
         {
             "cart_items": [...],
@@ -45,142 +119,485 @@ class TransactionViewSet(viewsets.ModelViewSet):
         """
         try:
             cart_items = request.data.get('cart_items', [])
-            subtotal = float(request.data.get('subtotal', 0))
-            tax = float(request.data.get('tax', 0))
-            total = float(request.data.get('total', 0))
-            amount_paid = float(request.data.get('amount_paid', 0))
+            try:
+                amount_paid = Decimal(str(request.data.get('amount_paid', 0)))
+                client_total = request.data.get('total')
+                client_total = Decimal(str(client_total)) if client_total is not None else None
+                # NaN/Infinity parse, but cannot be compared with the quote
+                if not amount_paid.is_finite() or (client_total is not None and not client_total.is_finite()):
+                    raise InvalidOperation
+            except InvalidOperation:
+                return Response({
+                    'error': 'Invalid amount_paid or total'
+                }, status=status.HTTP_400_BAD_REQUEST)
             payment_method = request.data.get('payment_method', 'CASH')
             notes = request.data.get('notes', '')
             
+            if not isinstance(cart_items, list) or not cart_items:
+                return Response({
+                    'error': 'cart_items must be a non-empty list'
+                }, status=status.HTTP_400_BAD_REQUEST)
+            
+            # Price the cart server-side; the client's figures are only checked
+            try:
+                quote = quote_cart(cart_items)
+            except PricingError as e:
+                return Response({'error': str(e)}, status=e.status_code)
+            
+            if client_total is not None and abs(client_total - quote.total) > PRICE_TOLERANCE:
+                return Response({
+                    'error': 'Cart prices have changed, please review the updated total',
+                    'quote': quote.as_dict(),
+                }, status=status.HTTP_400_BAD_REQUEST)
+            
             # Validate payment
-            if amount_paid < total:
+            if amount_paid < quote.total:
                 return Response({
                     'error': 'Insufficient payment amount'
                 }, status=status.HTTP_400_BAD_REQUEST)
             
-            # Validate stock availability
-            for item in cart_items:
-                product_id = item['product']['id']
-                quantity = item['quantity']
-                
-                try:
-                    product = Product.objects.get(id=product_id)
-                except Product.DoesNotExist:
-                    return Response({
-                        'error': f'Product {product_id} not found'
-                    }, status=status.HTTP_404_NOT_FOUND)
-                
-                if product.current_stock < quantity:
-                    return Response({
-                        'error': f'Insufficient stock for {product.name}. Available: {product.current_stock}, Requested: {quantity}'
-                    }, status=status.HTTP_400_BAD_REQUEST)
-            
-            # Create transaction
-            transaction = Transaction.objects.create(
-                cashier=request.user,
-                cart_items=cart_items,
-                subtotal=subtotal,
-                tax=tax,
-                total=total,
-                amount_paid=amount_paid,
-                payment_method=payment_method,
-                status='COMPLETED',
-                notes=notes
-            )
-            
-            # Update inventory for each item
-            for item in cart_items:
-                product_id = item['product']['id']
-                quantity = item['quantity']
-                variant_id = item.get('variant', {}).get('id') if item.get('variant') else None
-                
-                product = Product.objects.get(id=product_id)
-                
-                # Find the appropriate inventory record
-                if variant_id:
-                    inventory = Inventory.objects.filter(
-                        product=product,
-                        variant_id=variant_id
-                    ).first()
-                else:
-                    inventory = Inventory.objects.filter(
-                        product=product,
-                        variant__isnull=True
-                    ).first()
-                
-                if inventory:
-                    # Deduct from existing inventory
-                    inventory.quantity -= quantity
-                    inventory.save()
-                else:
-                    # Create new inventory record with negative quantity (for tracking)
-                    Inventory.objects.create(
-                        product=product,
-                        variant_id=variant_id if variant_id else None,
-                        quantity=-quantity,
-                        low_stock_threshold=10
-                    )
-            
-            serializer = self.get_serializer(transaction)
-            return Response({
-                'message': 'Payment processed successfully',
-                'transaction': serializer.data,
-                'change': float(transaction.change_given)
-            }, status=status.HTTP_201_CREATED)
+            location_id = request_location_id(request)
+            return self._record_sale(request, cart_items, quote, amount_paid, payment_method, notes, location_id)
             
+        except LocationError as e:
+            return Response({
+                'error': str(e)
+            }, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
+            logger.exception('Payment processing failed')
             return Response({
                 'error': f'Failed to process payment: {str(e)}'
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
     
+    @action(detail=False, methods=['post'], url_path='redeem-qr')
+    @idempotent
+    @db_transaction.atomic
+    def redeem_qr(self, request):
+        """
+        Resolve a customer's checkout QR code (compact or legacy format,
+        see CartQRCodec) into a priced cart and, with "complete", pay for
+        it in the same call
+        Expected payload:
+        {
+            "qr": "<scanned QR text>",
+            "complete": false,
+            "amount_paid": 120.00,
+            "payment_method": "CASH",
+            "notes": ""
+        }
+        Without "complete" nothing is written. Prices come from the server;
+        "price_changed" tells whether the total shown to the customer is
+        out of date. A QR code can only be paid for once.
+        """
+        qr = request.data.get('qr')
+        if not qr or not isinstance(qr, str):
+            return Response({
+                'error': 'qr is required'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            payload = CartQRCodec.decode(qr, settings.CART_QR_KEY)
+            items = payload['items']
+            qr_total = payload.get('total')
+            qr_total = Decimal(str(qr_total)) if qr_total is not None else None
+            if qr_total is not None and not qr_total.is_finite():
+                raise InvalidOperation
+        except (ValueError, KeyError, TypeError, AttributeError, InvalidOperation):
+            return Response({
+                'error': 'Invalid or unreadable QR code'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        if not isinstance(items, list) or not items:
+            return Response({
+                'error': 'The QR cart is empty'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            quote = quote_cart(items)
+        except PricingError as e:
+            return Response({'error': str(e)}, status=e.status_code)
+        
+        try:
+            location_id = request_location_id(request)
+        except LocationError as e:
+            return Response({
+                'error': str(e)
+            }, status=status.HTTP_400_BAD_REQUEST)
+        stock = self._available_stock(quote, location_id)
+        client_id = f'qr-{hashlib.sha256(qr.encode()).hexdigest()}'
+        redeemed = Transaction.objects.filter(client_id=client_id).only('transaction_number').first()
+        price_changed = qr_total is not None and abs(qr_total - quote.total) > PRICE_TOLERANCE
+        
+        cart = quote.as_dict()
+        for line in cart['items']:
+            line['available'] = stock.get(line['product_id'], 0)
+        result = {
+            'cart': cart,
+            'cart_items': [line.as_cart_item() for line in quote.lines],
+            'qr_total': str(qr_total) if qr_total is not None else None,
+            'price_changed': price_changed,
+            'stock_error': self._stock_shortfall(quote, location_id, stock),
+            'redeemed_transaction': redeemed.transaction_number if redeemed else None,
+        }
+        
+        if not request.data.get('complete'):
+            return Response(result, status=status.HTTP_200_OK)
+        
+        if redeemed:
+            return Response({
+                'error': 'This QR code was already paid for',
+                **result,
+            }, status=status.HTTP_409_CONFLICT)
+        if price_changed:
+            return Response({
+                'error': 'Cart prices have changed, please review the updated total',
+                **result,
+            }, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            amount_paid = Decimal(str(request.data.get('amount_paid', 0)))
+            if not amount_paid.is_finite():
+                raise InvalidOperation
+        except InvalidOperation:
+            return Response({
+                'error': 'Invalid amount_paid'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        if amount_paid < quote.total:
+            return Response({
+                'error': 'Insufficient payment amount'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        return self._record_sale(
+            request,
+            result['cart_items'],
+            quote,
+            amount_paid,
+            request.data.get('payment_method', 'CASH'),
+            request.data.get('notes', ''),
+            location_id,
+            client_id=client_id,
+        )
+    
+    def _record_sale(self, request, cart_items, quote, amount_paid, payment_method, notes, location_id,
+                     client_id=None):
+        """Check stock, create the COMPLETED transaction of a priced cart and deduct its stock at ``location_id``"""
+        shortfall = self._stock_shortfall(quote, location_id)
+        if shortfall:
+            return Response({'error': shortfall}, status=status.HTTP_400_BAD_REQUEST)
+        
+        # Store the server-computed line subtotals and taxes with the cart
+        # (refunds give back each line's own tax)
+        for item, line in zip(cart_items, quote.lines):
+            item['subtotal'] = float(line.subtotal)
+            item['tax'] = float(line.tax)
+        
+        # Create transaction
+        try:
+            with db_transaction.atomic():
+                transaction = Transaction.objects.create(
+                    cashier=request.user,
+                    location_id=location_id,
+                    terminal=request_terminal(request),
+                    cart_items=cart_items,
+                    subtotal=quote.subtotal,
+                    tax=quote.tax,
+                    total=quote.total,
+                    amount_paid=amount_paid,
+                    payment_method=payment_method,
+                    status='COMPLETED',
+                    notes=notes,
+                    client_id=client_id,
+                )
+        except IntegrityError:
+            # A concurrent request recorded the same client_id first
+            return Response({
+                'error': 'This sale was already recorded'
+            }, status=status.HTTP_409_CONFLICT)
+        
+        # Deduct the stock of every line at once; pairs without an
+        # inventory record are created with negative quantity (for tracking)
+        deltas = {}
+        for line in quote.lines:
+            deltas[line.stock_key] = deltas.get(line.stock_key, 0) - line.quantity
+        adjust_stock(deltas, 'SALE', create_missing=True,
+                     reference=transaction.transaction_number, user=request.user, location_id=location_id)
+        # Alerts run in a task worker once the sale commits (api.tasks)
+        queue_low_stock_alert(deltas, location_id)
+        
+        logger.info('Payment processed', extra={
+            'transaction_number': transaction.transaction_number,
+            'total': str(quote.total),
+            'items': len(cart_items),
+            'payment_method': payment_method,
+        })
+        
+        serializer = self.get_serializer(transaction)
+        return Response({
+            'message': 'Payment processed successfully',
+            'transaction': serializer.data,
+            'change': float(transaction.change_given)
+        }, status=status.HTTP_201_CREATED)
+    
+    @staticmethod
+    def _available_stock(quote, location_id):
+        """{product_id: stock at ``location_id``} of the products in a quote (one aggregate query)"""
+        # Includes sales not yet compacted into Inventory.quantity (deferred ledger)
+        return stock_at(location_id, {line.product.id for line in quote.lines})
+    
+    @classmethod
+    def _stock_shortfall(cls, quote, location_id, stock=None):
+        """Error message for the first product the quote needs more of than is in stock at ``location_id``"""
+        if stock is None:
+            stock = cls._available_stock(quote, location_id)
+        requested = {}
+        for line in quote.lines:
+            requested[line.product.id] = requested.get(line.product.id, 0) + line.quantity
+        for line in quote.lines:
+            available = stock.get(line.product.id, 0)
+            if available < requested[line.product.id]:
+                return f'Insufficient stock for {line.product.name}. Available: {available}, Requested: {requested[line.product.id]}'
+        return None
+    
+    @action(detail=False, methods=['post'], url_path='bulk-upload')
+    def bulk_upload(self, request):
+        """
+        Record sales a terminal queued while offline
+        Expected payload:
+        {
+            "sales": [
+                {
+                    "client_id": "terminal-generated unique id",
+                    "created_at": "2024-05-01T10:15:00Z",
+                    "cart_items": [...],
+                    "total": 110.00,
+                    "amount_paid": 120.00,
+                    "payment_method": "CASH",
+                    "notes": ""
+                }
+            ]
+        }
+        Each sale is reported as created, duplicate (client_id already
+        uploaded) or rejected, in the order sent; sales are priced on the
+        server and rejected when "total" differs. Stock is deducted at the
+        uploading terminal's location.
+        """
+        sales = request.data.get('sales')
+        if not isinstance(sales, list) or not sales:
+            return Response({
+                'error': 'sales must be a non-empty list'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        if len(sales) > MAX_SALES:
+            return Response({
+                'error': f'At most {MAX_SALES} sales per upload'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            location_id = request_location_id(request)
+        except LocationError as e:
+            return Response({
+                'error': str(e)
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        results = import_sales(sales, request.user, location_id, request_terminal(request))
+        summary = {
+            outcome: sum(1 for result in results if result['status'] == outcome)
+            for outcome in ('created', 'duplicate', 'rejected')
+        }
+        # LogRecord already has a "created" attribute
+        logger.info('Offline sales uploaded', extra={
+            f'{outcome}_count': count for outcome, count in summary.items()
+        })
+        
+        return Response({
+            'results': results,
+            **summary,
+        }, status=status.HTTP_200_OK)
+    
     @action(detail=True, methods=['post'], url_path='refund')
     @db_transaction.atomic
     def refund_transaction(self, request, pk=None):
-        """Refund a transaction and restore inventory"""
+        """
+        Refund lines of a transaction and restore their stock
+        Expected payload (omit "lines" to refund everything not yet returned):
+        {
+            "lines": [{"line": 0, "quantity": 1}],
+            "reason": ""
+        }
+        """
+        return self._process_return(request, kind='REFUND')
+    
+    @action(detail=True, methods=['post'], url_path='exchange')
+    @db_transaction.atomic
+    def exchange_items(self, request, pk=None):
+        """
+        Exchange lines of a transaction for other items
+        Replacements use the checkout cart shape and are priced server-side
+        (api.pricing); the refund is the returned lines minus their total.
+        Expected payload:
+        {
+            "lines": [{"line": 0, "quantity": 1}],
+            "exchange_items": [...],
+            "reason": ""
+        }
+        """
+        return self._process_return(request, kind='EXCHANGE')
+    
+    def _process_return(self, request, kind):
+        """Returned items go back to (and replacements come from) the stock of the location processing it"""
+        label = 'refund' if kind == 'REFUND' else 'exchange'
         try:
-            transaction = self.get_object()
+            location_id = request_location_id(request)
+            # get_object() applies the cashier scoping; the row lock then
+            # serializes returns of this transaction only
+            transaction = Transaction.objects.select_for_update().get(pk=self.get_object().pk)
             
             if transaction.status == 'REFUNDED':
                 return Response({
                     'error': 'Transaction already refunded'
                 }, status=status.HTTP_400_BAD_REQUEST)
+            if transaction.status != 'COMPLETED' and transaction.status != 'PARTIALLY_REFUNDED':
+                return Response({
+                    'error': f'Cannot {label} a {transaction.get_status_display().lower()} transaction'
+                }, status=status.HTTP_400_BAD_REQUEST)
             
-            # Restore inventory
-            cart_items = transaction.cart_items
-            for item in cart_items:
-                product_id = item['product']['id']
-                quantity = item['quantity']
-                variant_id = item.get('variant', {}).get('id') if item.get('variant') else None
-                
-                product = Product.objects.get(id=product_id)
-                
-                # Find the appropriate inventory record
-                if variant_id:
-                    inventory = Inventory.objects.filter(
-                        product=product,
-                        variant_id=variant_id
-                    ).first()
-                else:
-                    inventory = Inventory.objects.filter(
-                        product=product,
-                        variant__isnull=True
-                    ).first()
-                
-                if inventory:
-                    inventory.quantity += quantity
-                    inventory.save()
-            
-            # Update transaction status
-            transaction.status = 'REFUNDED'
-            transaction.save()
-            
-            serializer = self.get_serializer(transaction)
-            return Response({
-                'message': 'Transaction refunded successfully',
-                'transaction': serializer.data
-            }, status=status.HTTP_200_OK)
+            returned = transaction.refunded_quantities()
+            lines = self._returned_lines(transaction, request.data.get('lines'), returned)
+            replacements = (request.data.get('exchange_items') or []) if kind == 'EXCHANGE' else []
+            if kind == 'EXCHANGE' and not replacements:
+                raise ReturnError('Exchange requires exchange_items')
+            if not isinstance(replacements, list):
+                raise ReturnError('exchange_items must be a list')
+            # Replacements are priced like a sale; figures sent by the client are ignored
+            replacement_lines = quote_cart(replacements).lines if replacements else []
+            
+            deltas = {}
+            for line in lines:
+                key = (line['product_id'], line['variant_id'])
+                deltas[key] = deltas.get(key, 0) + line['quantity']
+            for line in replacement_lines:
+                deltas[line.stock_key] = deltas.get(line.stock_key, 0) - line.quantity
+            self._check_replacement_stock(deltas, location_id)
+            
+            # Refunded lines (with their tax) minus the replacements (with theirs)
+            amount = sum((line['amount'] for line in lines), Decimal('0'))
+            if replacement_lines:
+                amount -= CartQuote(replacement_lines).total
+            
+            refund = Refund.objects.create(
+                transaction=transaction,
+                kind=kind,
+                processed_by=request.user,
+                items=[dict(line, amount=str(line['amount'])) for line in lines],
+                exchange_items=[line.as_cart_item() for line in replacement_lines],
+                amount=amount,
+                reason=request.data.get('reason', ''),
+            )
+            adjust_stock(deltas, kind, create_missing=bool(replacement_lines),
+                         reference=refund.refund_number, user=request.user, location_id=location_id)
+            # Exchanged-out replacements can take stock to its threshold
+            queue_low_stock_alert(deltas, location_id)
             
+            for line in lines:
+                returned[line['line']] = returned.get(line['line'], 0) + line['quantity']
+            fully_returned = all(
+                returned.get(index, 0) >= item['quantity']
+                for index, item in enumerate(transaction.cart_items)
+            )
+            transaction.status = 'REFUNDED' if fully_returned else 'PARTIALLY_REFUNDED'
+            transaction.save(update_fields=['status', 'updated_at'])
+            
+            logger.info('Transaction %s', 'refunded' if kind == 'REFUND' else 'exchanged', extra={
+                'transaction_number': transaction.transaction_number,
+                'refund_number': refund.refund_number,
+                'amount': amount,
+                'lines': len(lines),
+            })
+            
+            return Response({
+                'message': f'Transaction {"refunded" if kind == "REFUND" else "exchanged"} successfully',
+                'refund': RefundSerializer(refund).data,
+                'transaction': self.get_serializer(transaction).data
+            }, status=status.HTTP_200_OK)
+        
+        except (ReturnError, LocationError, PricingError) as e:
+            # Unknown replacement products are a bad request here, not a missing transaction
+            return Response({
+                'error': str(e)
+            }, status=status.HTTP_400_BAD_REQUEST)
+        except Http404:
+            raise
         except Exception as e:
+            logger.exception('%s failed', label.capitalize())
             return Response({
-                'error': f'Failed to refund transaction: {str(e)}'
+                'error': f'Failed to {label} transaction: {str(e)}'
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    
+    @staticmethod
+    def _returned_lines(transaction, requested, returned):
+        """Validate requested [{line, quantity}] against the quantities still returnable"""
+        cart_items = transaction.cart_items
+        if requested is None:
+            requested = [
+                {'line': index, 'quantity': item['quantity'] - returned.get(index, 0)}
+                for index, item in enumerate(cart_items)
+                if item['quantity'] > returned.get(index, 0)
+            ]
+        if not requested:
+            raise ReturnError('No lines to return')
+        
+        # Carts recorded without line taxes (sales made before they were stored)
+        # get tax back in proportion to the line subtotal
+        subtotal = Decimal(str(transaction.subtotal))
+        ratio = Decimal(str(transaction.total)) / subtotal if subtotal else Decimal('1')
+        
+        lines = []
+        seen = set()
+        for entry in requested:
+            try:
+                index = int(entry['line'])
+                quantity = int(entry['quantity'])
+            except (KeyError, TypeError, ValueError):
+                raise ReturnError('Each line needs integer "line" and "quantity"')
+            if index in seen:
+                raise ReturnError(f'Line {index} listed twice')
+            seen.add(index)
+            if not 0 <= index < len(cart_items):
+                raise ReturnError(f'Line {index} does not exist')
+            
+            item = cart_items[index]
+            remaining = item['quantity'] - returned.get(index, 0)
+            if quantity < 1 or quantity > remaining:
+                raise ReturnError(f'Line {index}: {remaining} unit(s) can be returned, requested {quantity}')
+            
+            product_id, variant_id = stock_key(item)
+            line_subtotal = Decimal(str(item.get('subtotal', 0)))
+            if 'tax' in item:
+                unit_amount = (line_subtotal + Decimal(str(item['tax']))) / item['quantity']
+            else:
+                unit_amount = line_subtotal / item['quantity'] * ratio
+            lines.append({
+                'line': index,
+                'product_id': product_id,
+                'variant_id': variant_id,
+                'quantity': quantity,
+                'amount': (unit_amount * quantity).quantize(Decimal('0.01')),
+            })
+        return lines
+    
+    @staticmethod
+    def _check_replacement_stock(deltas, location_id):
+        """Reject exchanges whose replacement items exceed stock at ``location_id`` (net of returned items)"""
+        needed = {}
+        for (product_id, variant_id), delta in deltas.items():
+            needed[product_id] = needed.get(product_id, 0) + delta
+        needed = {product_id: -delta for product_id, delta in needed.items() if delta < 0}
+        if not needed:
+            return
+        
+        known = set(Product.objects.filter(id__in=needed).values_list('id', flat=True))
+        stock = stock_at(location_id, needed)
+        for product_id, quantity in needed.items():
+            if product_id not in known:
+                raise ReturnError(f'Product {product_id} not found')
+            if stock.get(product_id, 0) < quantity:
+                raise ReturnError(
+                    f'Insufficient stock for product {product_id}. Available: {stock.get(product_id, 0)}, Requested: {quantity}'
+                )
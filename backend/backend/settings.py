@@ -12,6 +12,8 @@ https://docs.djangoproject.com/en/6.0/ref/settings/
 
 from pathlib import Path
 import os
+import sys
+import tempfile
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -28,6 +30,9 @@ DEBUG = os.environ.get('DEBUG', 'True') == 'True'
 
 ALLOWED_HOSTS = ['*']
 
+# True while running `manage.py test` or pytest
+TESTING = (len(sys.argv) > 1 and sys.argv[1] == 'test') or 'pytest' in sys.modules
+
 
 # Application definition
 
@@ -46,6 +51,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.PerformanceMiddleware',
+    'api.middleware.QueryInspectionMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -54,7 +61,11 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'api.replicas.ReplicaRoutingMiddleware',
+    'api.response_cache.ResponseCacheMiddleware',
     'api.middleware.EncryptionMiddleware',
+    # Last: times the view call alone
+    'api.middleware.ViewTimingMiddleware',
 ]
 
 ROOT_URLCONF = 'backend.urls'
@@ -75,6 +86,11 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'backend.wsgi.application'
+ASGI_APPLICATION = 'backend.asgi.application'
+
+# Serve the catalog and transaction read endpoints with async views (api.views_async).
+# Enable when running under an ASGI server such as uvicorn.
+ASYNC_READ_VIEWS = os.environ.get('ASYNC_READ_VIEWS', 'False') == 'True'
 
 
 # Database
@@ -91,6 +107,28 @@ DATABASES = {
     }
 }
 
+# Read replicas (api.replicas): DB_REPLICA_HOSTS="10.0.0.2,10.0.0.3:5433" adds one
+# alias per streaming replica of default (same database name and credentials).
+# Designated GET views read from them; clients that just wrote stay on default
+# for DB_REPLICA_STICKY_SECONDS.
+_replica_hosts = [host.strip() for host in os.environ.get('DB_REPLICA_HOSTS', '').split(',') if host.strip()]
+for _index, _replica in enumerate(_replica_hosts, 1):
+    _host, _, _port = _replica.partition(':')
+    DATABASES[f'replica_{_index}'] = {
+        **DATABASES['default'],
+        'HOST': _host,
+        'PORT': _port or DATABASES['default']['PORT'],
+        # Tests read replicas through the default connection
+        'TEST': {'MIRROR': 'default'},
+    }
+
+READ_REPLICAS = {
+    'ALIASES': [alias for alias in DATABASES if alias != 'default'],
+    'STICKY_SECONDS': int(os.environ.get('DB_REPLICA_STICKY_SECONDS', '5')),
+}
+
+DATABASE_ROUTERS = ['api.replicas.ReplicaRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
@@ -153,6 +191,14 @@ CORS_ALLOW_HEADERS = [
     'user-agent',
     'x-csrftoken',
     'x-requested-with',
+    'idempotency-key',
+    'x-terminal',
+    'x-read-primary',
+]
+
+CORS_EXPOSE_HEADERS = [
+    'idempotent-replayed',
+    'x-read-primary',
 ]
 
 CORS_ALLOW_METHODS = [
@@ -175,12 +221,23 @@ SESSION_COOKIE_HTTPONLY = True
 # Django REST Framework Settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'api.authentication.CachedJWTAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
+    # orjson-backed JSON (api.fast_json); api.renderers.TimedJSONRenderer and
+    # rest_framework.parsers.JSONParser are the standard-library equivalents
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'api.parsers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 10,
 }
@@ -210,4 +267,154 @@ SIMPLE_JWT = {
     'TOKEN_TYPE_CLAIM': 'token_type',
     
     'JTI_CLAIM': 'jti',
+    
+    # Rotation rejects replayed refresh tokens; blacklist lookups go through api.tokens
+    'TOKEN_REFRESH_SERIALIZER': 'api.tokens.BlacklistCheckedTokenRefreshSerializer',
+}
+
+# In-process Bloom filter of blacklisted refresh-token JTIs (api.tokens)
+TOKEN_BLACKLIST_FILTER = {
+    'ENABLED': os.environ.get('TOKEN_BLACKLIST_FILTER', 'True') == 'True',
+    'SYNC_INTERVAL': 5,
+    'REBUILD_INTERVAL': 3600,
+}
+
+# Structured logging (api.log): JSON lines written by a background thread.
+# Per-request access records are sampled; warnings and errors are always kept.
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'json': {'()': 'api.log.JSONFormatter'},
+    },
+    'filters': {
+        'request_context': {'()': 'api.log.RequestContextFilter'},
+        'sampling': {
+            '()': 'api.log.SamplingFilter',
+            'rates': {'api.request': float(os.environ.get('LOG_REQUEST_SAMPLE_RATE', '0.1'))},
+        },
+    },
+    'handlers': {
+        'queue': {
+            '()': 'api.log.QueueHandler',
+            'formatter': 'json',
+            'filters': ['request_context', 'sampling'],
+            'queue_size': 10000,
+        },
+    },
+    'loggers': {
+        'api': {
+            'handlers': ['queue'],
+            'level': os.environ.get('LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+    },
+}
+
+# How long process-payment remembers an Idempotency-Key (api.idempotency)
+IDEMPOTENCY_KEY_TTL = timedelta(hours=int(os.environ.get('IDEMPOTENCY_KEY_TTL_HOURS', '24')))
+
+# Seconds an authenticated user is served from the per-process cache
+# (api.authentication) before it is reloaded; 0 disables the cache
+AUTH_USER_CACHE_TTL = int(os.environ.get('AUTH_USER_CACHE_TTL', '30'))
+
+# Passphrase the customer app encrypts checkout QR codes with (CartService
+# ENCRYPTION_KEY); the redeem-qr endpoint decrypts them with it
+CART_QR_KEY = os.environ.get('CART_QR_KEY', 'pos-store-cart-encryption-key-2024')
+
+# Process-local catalog cache used for pricing (api.catalog_cache): seconds a
+# record is served before reloading (edits in this process evict it at once,
+# edits elsewhere after this TTL; 0 disables) and records kept per model
+CATALOG_CACHE_TTL = int(os.environ.get('CATALOG_CACHE_TTL', '60'))
+CATALOG_CACHE_MAX_SIZE = int(os.environ.get('CATALOG_CACHE_MAX_SIZE', '5000'))
+
+# Rendered-response cache for catalog GET endpoints (api.response_cache):
+# 'locmem' (per process), 'file' (per host, in LOCATION) or 'django' (the
+# CACHE_ALIAS cache, shared by every host). Off under tests.
+RESPONSE_CACHE = {
+    'ENABLED': os.environ.get('RESPONSE_CACHE', 'True') == 'True' and not TESTING,
+    'BACKEND': os.environ.get('RESPONSE_CACHE_BACKEND', 'locmem'),
+    'TTL': int(os.environ.get('RESPONSE_CACHE_TTL', '30')),
+    'MAX_ENTRIES': 2000,
+    'LOCATION': os.environ.get('RESPONSE_CACHE_LOCATION', os.path.join(tempfile.gettempdir(), 'pos-response-cache')),
+    'CACHE_ALIAS': 'default',
+}
+
+# Build product, inventory and transaction list responses from values() rows
+# instead of model instances (api.row_serializers); same JSON, less CPU
+ROW_SERIALIZERS = os.environ.get('ROW_SERIALIZERS', 'True') == 'True'
+
+# Resized WebP/JPEG (and AVIF when supported) derivatives of product and
+# category images, rendered by a background thread pool (api.images)
+IMAGE_DERIVATIVES = {
+    'ENABLED': os.environ.get('IMAGE_DERIVATIVES', 'True') == 'True',
+    'QUALITY': int(os.environ.get('IMAGE_DERIVATIVES_QUALITY', '80')),
+    'WORKERS': int(os.environ.get('IMAGE_DERIVATIVES_WORKERS', '2')),
+    'SYNCHRONOUS': TESTING,
+}
+
+# Append-only inventory movement ledger (api.ledger). DEFERRED: checkouts only
+# INSERT movements and a background compaction applies them to
+# Inventory.quantity COMPACT_DELAY seconds later (no row-lock contention).
+INVENTORY_LEDGER = {
+    'DEFERRED': os.environ.get('INVENTORY_LEDGER_DEFERRED', 'False') == 'True',
+    'COMPACT_DELAY': float(os.environ.get('INVENTORY_LEDGER_COMPACT_DELAY', '1.0')),
+    'BATCH_SIZE': 500,
+}
+
+# Uploads are named after their SHA-256 (identical images share one file) and
+# served as immutable; files of replaced or deleted images are garbage-collected
+# once unreferenced (api.media). SERVE routes MEDIA_URL through Django.
+MEDIA_STORAGE = {
+    'CONTENT_ADDRESSED': os.environ.get('CONTENT_ADDRESSED_MEDIA', 'True') == 'True',
+    'SERVE': os.environ.get('SERVE_MEDIA', str(DEBUG)) == 'True',
+    'MAX_AGE': 365 * 24 * 3600,
+    'GC': os.environ.get('MEDIA_GC', 'True') == 'True',
+    'GC_GRACE_SECONDS': int(os.environ.get('MEDIA_GC_GRACE_SECONDS', '300')),
+}
+
+STORAGES = {
+    'default': {
+        'BACKEND': 'api.media.ContentAddressedStorage' if MEDIA_STORAGE['CONTENT_ADDRESSED']
+        else 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+    # Archived transaction partitions (point at object storage for cold retention)
+    'transaction_archive': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+        'OPTIONS': {'location': os.environ.get('TRANSACTION_ARCHIVE_DIR', os.path.join(BASE_DIR, 'archive'))},
+    },
+}
+
+# Monthly partitions of the transactions table (PostgreSQL, api.partitions):
+# enable once with `manage.py partition_transactions --convert`; older months
+# move to the transaction_archive storage with `archive_transactions`.
+TRANSACTION_PARTITIONS = {
+    'MONTHS_AHEAD': int(os.environ.get('TRANSACTION_PARTITIONS_MONTHS_AHEAD', '3')),
+    'ARCHIVE_AFTER_MONTHS': int(os.environ.get('TRANSACTION_ARCHIVE_AFTER_MONTHS', '24')),
+    'ARCHIVE_STORAGE': 'transaction_archive',
+}
+
+# Database-backed background tasks (api.tasks), run by `manage.py run_tasks`
+# workers. SYNCHRONOUS runs each task in-process after its transaction commits
+# (tests, or development without a worker).
+TASK_QUEUE = {
+    'CONCURRENCY': int(os.environ.get('TASK_CONCURRENCY', '4')),
+    'POLL_INTERVAL': float(os.environ.get('TASK_POLL_INTERVAL', '1.0')),
+    'MAX_ATTEMPTS': int(os.environ.get('TASK_MAX_ATTEMPTS', '5')),
+    'BACKOFF': 2.0,
+    'BACKOFF_MAX': 600.0,
+    'LOCK_TIMEOUT': int(os.environ.get('TASK_LOCK_TIMEOUT', '300')),
+    'KEEP_SUCCEEDED_HOURS': 24,
+    'SYNCHRONOUS': os.environ.get('TASKS_SYNCHRONOUS', str(TESTING)) == 'True',
+}
+
+# N+1 / slow query detector (api.query_inspector)
+# Opt in with QUERY_INSPECTOR=True; always on and raising under tests
+QUERY_INSPECTOR = {
+    'ENABLED': os.environ.get('QUERY_INSPECTOR', 'False') == 'True' or TESTING,
+    'DUPLICATE_THRESHOLD': int(os.environ.get('QUERY_INSPECTOR_DUPLICATE_THRESHOLD', '3')),
+    'SLOW_QUERY_MS': int(os.environ.get('QUERY_INSPECTOR_SLOW_QUERY_MS', '100')),
+    'EXPLAIN_SLOW_QUERIES': True,
+    'RAISE': TESTING,
 }
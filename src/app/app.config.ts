@@ -4,6 +4,7 @@ import { provideHttpClient, withInterceptors } from '@angular/common/http';
 
 import { routes } from './app.routes';
 import { encryptionInterceptor } from './interceptors/encryption.interceptor';
+import { readPrimaryInterceptor } from './interceptors/read-primary.interceptor';
 import { EncryptionService } from './services/encryption.service';
 import { initializeApp } from './app.initializer';
 
@@ -12,7 +13,7 @@ export const appConfig: ApplicationConfig = {
     provideZoneChangeDetection({ eventCoalescing: true }), 
     provideRouter(routes),
     provideHttpClient(
-      withInterceptors([encryptionInterceptor])
+      withInterceptors([readPrimaryInterceptor, encryptionInterceptor])
     ),
     {
       provide: APP_INITIALIZER,
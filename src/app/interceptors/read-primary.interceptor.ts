@@ -0,0 +1,34 @@
+import { HttpInterceptorFn, HttpRequest, HttpHandlerFn, HttpEvent, HttpResponse } from '@angular/common/http';
+import { Observable } from 'rxjs';
+import { tap } from 'rxjs/operators';
+
+// After a write the API answers with X-Read-Primary: <seconds>. Sending the
+// header back until then makes reads come from the primary database instead
+// of a replica that may not have the change yet (read-your-writes).
+const READ_PRIMARY_HEADER = 'X-Read-Primary';
+
+let readPrimaryUntil = 0;
+
+export const readPrimaryInterceptor: HttpInterceptorFn = (
+  req: HttpRequest<any>,
+  next: HttpHandlerFn
+): Observable<HttpEvent<any>> => {
+  let modifiedReq = req;
+
+  if (Date.now() < readPrimaryUntil) {
+    modifiedReq = req.clone({
+      setHeaders: { [READ_PRIMARY_HEADER]: '1' }
+    });
+  }
+
+  return next(modifiedReq).pipe(
+    tap(event => {
+      if (event instanceof HttpResponse) {
+        const seconds = Number(event.headers.get(READ_PRIMARY_HEADER));
+        if (seconds > 0) {
+          readPrimaryUntil = Math.max(readPrimaryUntil, Date.now() + seconds * 1000);
+        }
+      }
+    })
+  );
+};
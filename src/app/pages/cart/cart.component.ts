@@ -63,7 +63,7 @@ export class CartComponent implements OnInit {
 
     this.loading = true;
     try {
-      const encryptedData = this.cartService.generateCheckoutQR();
+      const encryptedData = await this.cartService.generateCompactCheckoutQR();
       
       this.qrCodeUrl = await QRCode.toDataURL(encryptedData, {
         width: 400,
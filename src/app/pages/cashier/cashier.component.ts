@@ -40,6 +40,9 @@ export class CashierComponent implements OnInit {
   
   private readonly ENCRYPTION_KEY = 'pos-store-cart-encryption-key-2024';
 
+  // Idempotency key of the last payment attempt, reused while retrying the same payload
+  private pendingPayment: { key: string; payload: string } | null = null;
+
   constructor(
     private productService: ProductService,
     private cartService: CartService,
@@ -370,8 +373,10 @@ export class CashierComponent implements OnInit {
     };
 
     // Call API to process payment
-    this.productService.processPayment(transactionData).subscribe({
+    const idempotencyKey = this.getPaymentKey(transactionData);
+    this.productService.processPayment(transactionData, idempotencyKey).subscribe({
       next: (response: any) => {
+        this.pendingPayment = null;
         this.receiptData = {
           items: this.manualCart.items,
           subtotal: subtotal,
@@ -388,12 +393,27 @@ export class CashierComponent implements OnInit {
         this.manualCart = { items: [], total: 0, itemCount: 0, timestamp: Date.now() };
       },
       error: (err: any) => {
+        // Keep the key only when the outcome is unknown (network error, timeout)
+        if (err.status >= 400 && err.status < 500) {
+          this.pendingPayment = null;
+        }
         this.error = err.error?.error || 'Failed to process payment';
         console.error('Payment error:', err);
       }
     });
   }
 
+  private getPaymentKey(transactionData: any): string {
+    const payload = JSON.stringify(transactionData);
+    if (this.pendingPayment?.payload !== payload) {
+      const key = typeof crypto !== 'undefined' && 'randomUUID' in crypto
+        ? crypto.randomUUID()
+        : `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
+      this.pendingPayment = { key, payload };
+    }
+    return this.pendingPayment.key;
+  }
+
   getCurrentCart(): Cart | null {
     return this.scannedCart || (this.manualCart.items.length > 0 ? this.manualCart : null);
   }
@@ -200,10 +200,12 @@ export class ProductsComponent implements OnInit {
   }
 
   getImageUrl(product: Product): string {
-    if (product.image) {
-      return product.image.startsWith('http') 
-        ? product.image 
-        : `http://localhost:8083${product.image}`;
+    // Grid tiles use the resized derivative; the original until it is generated
+    const image = product.thumbnail?.webp || product.thumbnail?.jpeg || product.image;
+    if (image) {
+      return image.startsWith('http') 
+        ? image 
+        : `http://localhost:8083${image}`;
     }
     return 'data:image/svg+xml,%3Csvg xmlns="http://www.w3.org/2000/svg" width="200" height="200" viewBox="0 0 200 200"%3E%3Crect fill="%23f3f4f6" width="200" height="200"/%3E%3Cpath fill="%239ca3af" d="M100 85c-8.3 0-15 6.7-15 15s6.7 15 15 15 15-6.7 15-15-6.7-15-15-15zm0 25c-5.5 0-10-4.5-10-10s4.5-10 10-10 10 4.5 10 10-4.5 10-10 10z"/%3E%3Cpath fill="%239ca3af" d="M150 60H50c-5.5 0-10 4.5-10 10v60c0 5.5 4.5 10 10 10h100c5.5 0 10-4.5 10-10V70c0-5.5-4.5-10-10-10zm5 70c0 2.8-2.2 5-5 5H50c-2.8 0-5-2.2-5-5V70c0-2.8 2.2-5 5-5h100c2.8 0 5 2.2 5 5v60z"/%3E%3C/svg%3E';
   }
@@ -25,6 +25,8 @@ export interface Cart {
 export class CartService {
   private readonly CART_KEY = 'pos_cart';
   private readonly ENCRYPTION_KEY = 'pos-store-cart-encryption-key-2024';
+  private readonly QR_CODEC_VERSION = 1;
+  private readonly QR_KEY_CONTEXT = 'pos-store/cart-qr/v1\0';
   
   private cartSubject = new BehaviorSubject<Cart>(this.loadCart());
   public cart$: Observable<Cart> = this.cartSubject.asObservable();
@@ -185,6 +187,70 @@ export class CartService {
     return encryptedCheckout;
   }
 
+  /**
+   * Compact checkout QR (CartQRCodec v1 on the server): ids and quantities
+   * packed as varints, sealed with AES-256-CTR + HMAC-SHA256 and base45
+   * encoded for the QR alphanumeric mode. Falls back to the legacy payload
+   * where WebCrypto is unavailable (pages not served over HTTPS).
+   */
+  async generateCompactCheckoutQR(): Promise<string> {
+    if (!globalThis.crypto?.subtle) {
+      return this.generateCheckoutQR();
+    }
+    const cart = this.loadCart();
+
+    const packed: number[] = [];
+    const writeVarint = (value: number) => {
+      while (value > 0x7f) {
+        packed.push((value % 0x80) | 0x80);
+        value = Math.floor(value / 0x80);
+      }
+      packed.push(value);
+    };
+    writeVarint(Math.floor(cart.timestamp / 1000));
+    writeVarint(Math.round(cart.total * 100));
+    writeVarint(cart.items.length);
+    for (const item of cart.items) {
+      writeVarint(item.product.id);
+      writeVarint(item.variant?.id ?? 0);
+      writeVarint(item.addons.length);
+      item.addons.forEach(addon => writeVarint(addon.id));
+      writeVarint(item.quantity);
+    }
+
+    const subtle = globalThis.crypto.subtle;
+    const context = new TextEncoder().encode(this.QR_KEY_CONTEXT);
+    const passphrase = new TextEncoder().encode(this.ENCRYPTION_KEY);
+    const keyMaterial = new Uint8Array(await subtle.digest('SHA-512', new Uint8Array([...context, ...passphrase])));
+    const encKey = await subtle.importKey('raw', keyMaterial.slice(0, 32), 'AES-CTR', false, ['encrypt']);
+    const macKey = await subtle.importKey('raw', keyMaterial.slice(32), { name: 'HMAC', hash: 'SHA-256' }, false, ['sign']);
+
+    const nonce = globalThis.crypto.getRandomValues(new Uint8Array(12));
+    const counter = new Uint8Array(16);
+    counter.set(nonce);
+    const ciphertext = new Uint8Array(
+      await subtle.encrypt({ name: 'AES-CTR', counter, length: 32 }, encKey, new Uint8Array(packed))
+    );
+
+    const body = new Uint8Array([this.QR_CODEC_VERSION, ...nonce, ...ciphertext]);
+    const tag = new Uint8Array(await subtle.sign('HMAC', macKey, body)).slice(0, 16);
+    return 'PC1:' + this.base45Encode(new Uint8Array([...body, ...tag]));
+  }
+
+  private base45Encode(data: Uint8Array): string {
+    const alphabet = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ $%*+-./:';
+    let out = '';
+    for (let i = 0; i + 1 < data.length; i += 2) {
+      const n = data[i] * 256 + data[i + 1];
+      out += alphabet[n % 45] + alphabet[Math.floor(n / 45) % 45] + alphabet[Math.floor(n / 2025)];
+    }
+    if (data.length % 2) {
+      const n = data[data.length - 1];
+      out += alphabet[n % 45] + alphabet[Math.floor(n / 45)];
+    }
+    return out;
+  }
+
   decryptCheckoutQR(encryptedData: string): any {
     try {
       const decryptedData = this.decrypt(encryptedData);
@@ -4,11 +4,21 @@ import { Observable } from 'rxjs';
 import { map } from 'rxjs/operators';
 import { AuthService } from './auth.service';
 
+// One resized derivative of an uploaded image (URLs per format)
+export interface ImageVariant {
+  width: number;
+  height: number;
+  avif?: string;
+  webp?: string;
+  jpeg?: string;
+}
+
 export interface Category {
   id: number;
   name: string;
   description: string;
   image?: string;
+  thumbnail?: ImageVariant | null;
   is_active: boolean;
   product_count: number;
   created_at: string;
@@ -40,6 +50,8 @@ export interface AddOn {
 
 export interface Inventory {
   id: number;
+  location: number;
+  location_name: string;
   product: number;
   product_name: string;
   variant?: number;
@@ -61,6 +73,8 @@ export interface Product {
   category_name?: string;
   base_price: number;
   image?: string;
+  thumbnail?: ImageVariant | null;
+  images?: { [size: string]: ImageVariant };
   sku: string;
   is_taxable: boolean;
   is_active: boolean;
@@ -101,9 +115,28 @@ export class ProductService {
       headers['Authorization'] = `Bearer ${token}`;
     }
     
+    // Sales and returns made on this terminal change its location's stock
+    const terminal = this.getTerminalCode();
+    if (terminal) {
+      headers['X-Terminal'] = terminal;
+    }
+    
     return new HttpHeaders(headers);
   }
 
+  // Code of the checkout terminal this browser is (set up once per device)
+  getTerminalCode(): string | null {
+    return localStorage.getItem('terminal_code');
+  }
+
+  setTerminalCode(code: string | null): void {
+    if (code) {
+      localStorage.setItem('terminal_code', code);
+    } else {
+      localStorage.removeItem('terminal_code');
+    }
+  }
+
   // Category Methods
   getCategories(activeOnly: boolean = false, paginationParams?: any): Observable<any> {
     let params = new HttpParams();
@@ -404,8 +437,35 @@ export class ProductService {
   }
 
   // Transaction Methods
-  processPayment(transactionData: any): Observable<any> {
+  // Price a cart with the server's catalog prices (what checkout will charge)
+  quoteCart(cartItems: any[]): Observable<any> {
+    return this.http.post<any>(`${this.apiUrl}/cart/quote/`, { cart_items: cartItems }, {
+      headers: this.getHeaders()
+    });
+  }
+
+  processPayment(transactionData: any, idempotencyKey?: string): Observable<any> {
+    let headers = this.getHeaders();
+    if (idempotencyKey) {
+      // Lets the backend recognise a retry of the same payment
+      headers = headers.set('Idempotency-Key', idempotencyKey);
+    }
     return this.http.post<any>(`${this.apiUrl}/transactions/process-payment/`, transactionData, {
+      headers
+    });
+  }
+
+  // Resolve a scanned checkout QR code into a priced cart; with complete, also pay for it
+  redeemCheckoutQR(qr: string, payment?: { amount_paid: number; payment_method?: string; notes?: string }): Observable<any> {
+    const body = payment ? { qr, complete: true, ...payment } : { qr };
+    return this.http.post<any>(`${this.apiUrl}/transactions/redeem-qr/`, body, {
+      headers: this.getHeaders()
+    });
+  }
+
+  // Upload sales queued while the terminal was offline (each needs a unique client_id)
+  uploadOfflineSales(sales: any[]): Observable<any> {
+    return this.http.post<any>(`${this.apiUrl}/transactions/bulk-upload/`, { sales }, {
       headers: this.getHeaders()
     });
   }